@@ -3,13 +3,17 @@
 """Top level package for MWC utilities"""
 
 
-# from . import mcmc
 from . import viz
 from . import image
 from . import channcap
 from . import stats
 from . import maxent
 from . import model
+from . import codegen
+from . import momgen
+from . import fsp
+from . import gillespie
+from . import mcmc
 
 __author__ = """Manue Razo-Mejia"""
 __email__ = """mrazomej@caltech.edu"""
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Title:
+    codegen.py
+Last update:
+    2026-10-19
+Author(s):
+    Manuel Razo-Mejia
+Purpose:
+    This file compiles the functions used to turn the symbolic moment
+    dynamics matrices derived with sympy into plain numpy source code. The
+    generated modules do not depend on sympy or cloudpickle and evaluate the
+    matrices for a whole grid of parameters at once.
+"""
+
+import os
+import types
+import importlib.util
+import numpy as np
+
+
+def matrix_to_source(A_sym, params, fun_name='A_mat', expo=None,
+                     header=''):
+    '''
+    Generates the source code of a python module with a function that
+    evaluates a symbolic matrix using numpy. The generated function takes
+    broadcastable arrays as parameters. For scalar parameters it returns a
+    k x k matrix, and for parameters of shape S it returns an array of
+    shape S + (k, k).
+
+    Parameters
+    ----------
+    A_sym : sympy.Matrix.
+        Symbolic matrix to be converted into source code.
+    params : list.
+        List of sympy symbols (or strings) in the order in which they will
+        be fed to the generated function.
+    fun_name : str. Default = 'A_mat'
+        Name of the generated function.
+    expo : array-like or None.
+        List containing the moments involved in the dynamics. If given it is
+        saved as the `expo` variable of the generated module.
+    header : str.
+        Comment to be added at the top of the generated module.
+
+    Returns
+    -------
+    source : str.
+        Source code of the generated module.
+    '''
+    import sympy
+    from sympy.printing.lambdarepr import NumPyPrinter
+
+    # Convert parameters into symbols and generate valid argument names
+    params = [sympy.Symbol(p) if isinstance(p, str) else p for p in params]
+    args = ['par{:d}'.format(i) if not str(p).isidentifier() else str(p)
+            for i, p in enumerate(params)]
+    # Substitute symbols by the argument names
+    A_sym = sympy.Matrix(A_sym).subs(
+        {p: sympy.Symbol(a) for p, a in zip(params, args)},
+        simultaneous=True)
+
+    printer = NumPyPrinter()
+
+    # Write the module header
+    lines = ['# -*- coding: utf-8 -*-',
+             '"""',
+             'Automatically generated by ccutils.codegen. Do not edit.']
+    if header:
+        lines.append(header)
+    lines += ['"""', 'import numpy', '', '',
+              'params = {}'.format(tuple(args))]
+    if expo is not None:
+        lines.append('expo = {}'.format([tuple(int(x) for x in e)
+                                         for e in expo]))
+    lines += ['', '',
+              'def {}({}):'.format(fun_name, ', '.join(args)),
+              '    # Find the shape of the broadcasted parameters',
+              '    shape = numpy.broadcast({}).shape'.format(
+                  ', '.join(args + ['0'])),
+              '    # Initialize matrix',
+              '    A = numpy.zeros(shape + {})'.format(A_sym.shape)]
+
+    # Write only the non-zero entries
+    for i in range(A_sym.shape[0]):
+        for j in range(A_sym.shape[1]):
+            if A_sym[i, j] != 0:
+                lines.append('    A[..., {:d}, {:d}] = {}'.format(
+                    i, j, printer.doprint(A_sym[i, j])))
+
+    lines += ['    return A', '']
+
+    return '\n'.join(lines)
+
+
+def lambdify_to_source(fun, params, fun_name='A_mat', expo=None,
+                       header=''):
+    '''
+    Generates the source code of a numpy matrix builder out of a function
+    generated with sympy.lambdify that returns a single matrix per call.
+    The function is evaluated with sympy symbols (and sympy versions of
+    the numerical functions it uses) to recover the symbolic matrix.
+
+    Parameters
+    ----------
+    fun : function.
+        Function generated with sympy.lambdify.
+    params : list of str.
+        Names of the parameters in the order in which they are fed to fun.
+    fun_name : str. Default = 'A_mat'
+        Name of the generated function.
+    expo : array-like or None.
+        List containing the moments involved in the dynamics.
+    header : str.
+        Comment to be added at the top of the generated module.
+
+    Returns
+    -------
+    source : str.
+        Source code of the generated module.
+    '''
+    import sympy
+
+    # Replace the numerical functions in the namespace of the lambdify
+    # function with their sympy counterparts
+    namespace = dict(fun.__globals__)
+    for name, value in fun.__globals__.items():
+        if callable(value) and name != 'array' and hasattr(sympy, name):
+            namespace[name] = getattr(sympy, name)
+    fun_sym = types.FunctionType(fun.__code__, namespace, fun.__name__,
+                                 fun.__defaults__, fun.__closure__)
+
+    # Evaluate function with symbols
+    symbols = [sympy.Symbol(p) for p in params]
+    A_sym = sympy.Matrix(np.array(fun_sym(*symbols), dtype=object))
+
+    return matrix_to_source(A_sym, symbols, fun_name, expo, header)
+
+
+def pkl_to_module(pkl_file, out_file, params, fun_name='A_mat'):
+    '''
+    Converts one of the cloudpickle files containing a lambdify function and
+    the list of exponents (such as three_state_protein_dynamics_matrix.pkl)
+    into a python module with plain numpy code.
+
+    Parameters
+    ----------
+    pkl_file : str.
+        Path to the pickle file. The file must contain the lambdify function
+        followed by the list of exponents.
+    out_file : str.
+        Path where to save the generated module.
+    params : list of str.
+        Names of the parameters in the order in which they are fed to the
+        lambdify function.
+    fun_name : str. Default = 'A_mat'
+        Name of the generated function.
+    '''
+    import cloudpickle
+
+    # Read the lambdify function and exponents
+    with open(pkl_file, 'rb') as file:
+        A_mat_lam = cloudpickle.load(file)
+        expo = cloudpickle.load(file)
+
+    # Generate source code
+    source = lambdify_to_source(A_mat_lam, params, fun_name, expo,
+                                header='Source: ' +
+                                os.path.basename(pkl_file))
+
+    with open(out_file, 'w') as file:
+        file.write(source)
+
+
+def load_matrix_module(module_file, fun_name='A_mat'):
+    '''
+    Imports a module generated with this file and returns the matrix
+    builder function and the list of exponents. This mirrors the order in
+    which the cloudpickle files are read.
+
+    Parameters
+    ----------
+    module_file : str.
+        Path to the generated module.
+    fun_name : str. Default = 'A_mat'
+        Name of the generated function.
+
+    Returns
+    -------
+    A_mat_fun : function.
+        Function that builds the matrix given the rate parameters.
+    expo : list or None.
+        List containing the moments involved in the dynamics.
+    '''
+    module = import_file(module_file)
+
+    return getattr(module, fun_name), getattr(module, 'expo', None)
+
+
+def import_file(module_file):
+    '''
+    Imports a python module given the path to its file.
+
+    Parameters
+    ----------
+    module_file : str.
+        Path to the module.
+
+    Returns
+    -------
+    module : module.
+        Imported module.
+    '''
+    name = os.path.splitext(os.path.basename(module_file))[0]
+    spec = importlib.util.spec_from_file_location(name, module_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
@@ -0,0 +1,582 @@
+# -*- coding: utf-8 -*-
+"""
+Title:
+    fsp.py
+Last update:
+    2026-10-19
+Author(s):
+    Manuel Razo-Mejia
+Purpose:
+    This file compiles the functions used to solve the chemical master
+    equation of the promoter models with the Finite State Projection (FSP)
+    method. The master equation is truncated to a finite lattice of
+    (promoter state, mRNA, protein) and written as a sparse generator
+    matrix. The truncation is expanded until the probability leaving the
+    lattice is below a tolerance, giving reference distributions against
+    which to compare the MaxEnt approximations.
+"""
+
+import numpy as np
+import scipy as sp
+import scipy.sparse
+import scipy.sparse.linalg
+import scipy.stats
+
+from . import momgen
+
+
+# GENERATOR OF THE MASTER EQUATION
+def cme_generator(par, n_max, model=None, n_states=3, absorbing=True,
+                  sinks=False):
+    '''
+    Builds the sparse generator Q of the chemical master equation
+    dP/dt = QP
+    truncated to mRNA < n_max[0] and protein < n_max[1]. The states are
+    ordered as a C-ordered array of shape (n_states, n_max[0], n_max[1]).
+
+    Parameters
+    ----------
+    par : array-like.
+        Rate parameters in the order given by model['params'].
+    n_max : tuple.
+        (number of mRNA values, number of protein values) in the lattice.
+    model : dict or None.
+        Promoter model definition as returned by momgen.promoter_model. If
+        None momgen.promoter_model(n_states) is used.
+    n_states : int. Default = 3
+        Number of promoter states.
+    absorbing : bool. Default = True
+        If True, reactions leaving the lattice remove probability (the
+        usual FSP construction, where the lost mass bounds the error).
+        If False, these reactions are ignored such that the generator
+        conserves probability, which is needed for steady-state solutions.
+    sinks : bool. Default = False
+        If True (and absorbing is True), the probability leaving the
+        lattice is collected in two extra states appended at the end, the
+        first one for mRNA and the second one for protein. This tells which
+        axis of the lattice needs to be expanded.
+
+    Returns
+    -------
+    Q : scipy.sparse.csr_matrix.
+        Generator of the truncated master equation.
+        shape = (N, N) with N = n_states * n_max[0] * n_max[1], or
+        (N + 2, N + 2) if sinks is True.
+    '''
+    if model is None:
+        model = momgen.promoter_model(n_states)
+    rate = dict(zip(model['params'], par))
+    states = model['states']
+    shape = (len(states), n_max[0], n_max[1])
+    # Generate the (state, mRNA, protein) value of each lattice point
+    s, m, p = [x.ravel() for x in np.indices(shape)]
+    idx = np.arange(s.size)
+
+    rows, cols, vals = list(), list(), list()
+
+    def add_reaction(src, shift, propensity):
+        # Add a reaction from lattice points src moving (ds, dm, dp)
+        ds, dm, dp = shift
+        m_new, p_new = m[src] + dm, p[src] + dp
+        inside = (m_new < shape[1]) & (p_new < shape[2])
+        target = np.ravel_multi_index((s[src][inside] + ds, m_new[inside],
+                                       p_new[inside]), shape)
+        # Probability flowing into the target state
+        rows.append(target)
+        cols.append(idx[src][inside])
+        vals.append(propensity[inside])
+        # Probability flowing into the sinks
+        if absorbing and sinks:
+            rows.append(np.full((~inside).sum(), s.size + (dp > 0)))
+            cols.append(idx[src][~inside])
+            vals.append(propensity[~inside])
+        # Probability flowing out of the source state
+        keep = np.ones_like(inside) if absorbing else inside
+        rows.append(idx[src][keep])
+        cols.append(idx[src][keep])
+        vals.append(-propensity[keep])
+
+    # Promoter state transitions
+    for s_from, s_to, name in model['transitions']:
+        src = s == states.index(s_from)
+        add_reaction(src, (states.index(s_to) - states.index(s_from), 0, 0),
+                     np.full(src.sum(), rate[name], dtype=float))
+    # mRNA production
+    for state, name in model['production'].items():
+        src = s == states.index(state)
+        add_reaction(src, (0, 1, 0),
+                     np.full(src.sum(), rate[name], dtype=float))
+    # mRNA degradation
+    src = m > 0
+    add_reaction(src, (0, -1, 0), rate['gm'] * m[src])
+    # protein production
+    src = m > 0
+    add_reaction(src, (0, 0, 1), rate['rp'] * m[src])
+    # protein degradation
+    src = p > 0
+    add_reaction(src, (0, 0, -1), rate['gp'] * p[src])
+
+    Q = sp.sparse.coo_matrix((np.concatenate(vals),
+                              (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(s.size + 2 * sinks, s.size + 2 * sinks))
+
+    return Q.tocsr()
+
+
+def binomial_partition_operator(n_max):
+    '''
+    Builds the sparse matrix B that partitions the molecules of a
+    distribution binomially with probability 1/2, i.e.
+    P'(k) = ∑ B[k, n] P(n),  B[k, n] = Binomial(k | n, 1/2).
+    Only the entries within 10 standard deviations of n/2 are kept.
+
+    Parameters
+    ----------
+    n_max : int.
+        Number of molecule values in the lattice.
+
+    Returns
+    -------
+    B : scipy.sparse.csr_matrix. shape = n_max x n_max
+        Binomial partitioning matrix.
+    '''
+    n = np.arange(n_max)
+    # Define window around n / 2 for each n
+    width = np.ceil(5 * np.sqrt(n) + 1).astype(int)
+    k_min = np.maximum(n // 2 - width, 0)
+    k_max = np.minimum(n // 2 + width, n)
+    counts = k_max - k_min + 1
+    # List all (k, n) pairs inside the windows
+    col = np.repeat(n, counts)
+    row = np.repeat(k_min - np.cumsum(counts) + counts, counts) + \
+        np.arange(counts.sum())
+    val = sp.stats.binom.pmf(row, col, 0.5)
+
+    return sp.sparse.csr_matrix((val, (row, col)), shape=(n_max, n_max))
+
+
+def partition_distribution(P_dist, B_m, B_p):
+    '''
+    Applies the binomial partitioning of mRNA and protein at cell division
+    to a distribution over the (promoter state, mRNA, protein) lattice.
+    The promoter state is left unchanged.
+
+    Parameters
+    ----------
+    P_dist : array-like. shape = (n_states, n_mRNA, n_protein)
+        Distribution before division.
+    B_m, B_p : scipy.sparse matrices.
+        Partitioning matrices for mRNA and protein as returned by
+        binomial_partition_operator.
+
+    Returns
+    -------
+    P_dist : array-like. shape = (n_states, n_mRNA, n_protein)
+        Distribution after division.
+    '''
+    n_states, n_m, n_p = P_dist.shape
+    # Partition protein: (states * mRNA, protein) x B_p.T
+    P_dist = (B_p @ P_dist.reshape(-1, n_p).T).T.reshape(P_dist.shape)
+    # Partition mRNA for each promoter state
+    P_dist = np.stack([B_m @ P_dist[i] for i in range(n_states)])
+
+    return P_dist
+
+
+# TRUNCATION
+def promoter_occupancy(par, model=None, n_states=3):
+    '''
+    Computes the steady-state probability of each promoter state.
+
+    Parameters
+    ----------
+    par : array-like.
+        Rate parameters in the order given by model['params'].
+    model : dict or None.
+        Promoter model definition. If None momgen.promoter_model(n_states)
+        is used.
+    n_states : int. Default = 3
+        Number of promoter states.
+
+    Returns
+    -------
+    occupancy : array-like.
+        Probability of each state in the order of model['states'].
+    '''
+    if model is None:
+        model = momgen.promoter_model(n_states)
+    rate = dict(zip(model['params'], par))
+    states = model['states']
+    # Build generator of the promoter states
+    K = np.zeros([len(states), len(states)])
+    for s_from, s_to, name in model['transitions']:
+        K[states.index(s_to), states.index(s_from)] += rate[name]
+        K[states.index(s_from), states.index(s_from)] -= rate[name]
+    # Replace first equation with the normalization condition
+    K[0, :] = 1
+    b = np.zeros(len(states))
+    b[0] = 1
+
+    return np.linalg.lstsq(K, b, rcond=None)[0]
+
+
+def initial_truncation(par, model=None, n_states=3, t_cycle=None,
+                       n_std=4):
+    '''
+    Guesses the size of the lattice from the mean mRNA and protein copy
+    numbers given the promoter occupancy, adding n_std Poisson standard
+    deviations. The guess is deliberately small, since the solvers expand
+    the lattice until the tolerance is met and the cost of each expansion
+    grows geometrically.
+
+    Parameters
+    ----------
+    par : array-like.
+        Rate parameters in the order given by model['params'].
+    model : dict or None.
+        Promoter model definition. If None momgen.promoter_model(n_states)
+        is used.
+    n_states : int. Default = 3
+        Number of promoter states.
+    t_cycle : float or None.
+        Length of the cell cycle. Used to bound the protein when there is
+        no protein degradation.
+    n_std : float. Default = 4
+        Number of standard deviations to add to the mean.
+
+    Returns
+    -------
+    n_max : tuple.
+        (number of mRNA values, number of protein values).
+    '''
+    if model is None:
+        model = momgen.promoter_model(n_states)
+    rate = dict(zip(model['params'], par))
+    occupancy = dict(zip(model['states'], promoter_occupancy(par, model)))
+    m_mean = sum(occupancy[state] * rate[name]
+                 for state, name in model['production'].items()) / rate['gm']
+    if rate['gp'] > 0:
+        p_mean = m_mean * rate['rp'] / rate['gp']
+    elif t_cycle is not None:
+        # Protein produced over one cell cycle, i.e. the steady-state mean
+        # right before division when protein is only diluted
+        p_mean = m_mean * rate['rp'] * t_cycle
+    else:
+        raise ValueError('t_cycle is required when gp = 0')
+
+    return (int(m_mean + n_std * np.sqrt(m_mean) + 10),
+            int(p_mean + n_std * np.sqrt(p_mean) + 10))
+
+
+def boundary_mass(P_dist, frac=0.05):
+    '''
+    Returns the probability in the outer layers of the lattice along the
+    mRNA and protein axes. Used to decide which axis to expand.
+
+    Parameters
+    ----------
+    P_dist : array-like. shape = (n_states, n_mRNA, n_protein)
+        Distribution over the lattice.
+    frac : float. Default = 0.05
+        Fraction of the lattice considered as the outer layer.
+
+    Returns
+    -------
+    mass_m, mass_p : float.
+        Probability in the outer mRNA and protein layers.
+    '''
+    n_m = max(1, int(frac * P_dist.shape[1]))
+    n_p = max(1, int(frac * P_dist.shape[2]))
+    return P_dist[:, -n_m:, :].sum(), P_dist[:, :, -n_p:].sum()
+
+
+def expand_truncation(n_max, P_dist, tol, leak=(0, 0), factor=1.5):
+    '''
+    Returns a larger lattice size, expanding by factor the axes that carry
+    more than tol / 2 probability in their outer layers or that leaked more
+    than tol / 2 probability out of the lattice.
+    '''
+    mass = boundary_mass(P_dist)
+    expand = [b > tol / 2 or l > tol / 2 for b, l in zip(mass, leak)]
+    return tuple(int(n * factor) + 1 if e else n
+                 for n, e in zip(n_max, expand))
+
+
+def pad_distribution(P_dist, n_max):
+    '''
+    Pads a distribution with zeros up to a larger lattice.
+    '''
+    return np.pad(P_dist, [(0, 0), (0, n_max[0] - P_dist.shape[1]),
+                           (0, n_max[1] - P_dist.shape[2])])
+
+
+# SOLVERS
+def steady_state_distribution(par, n_max=None, model=None, n_states=3,
+                              tol=1E-6, method='direct', max_expand=10):
+    '''
+    Computes the steady-state distribution of the master equation on a
+    lattice that is expanded until the probability in its outer layers is
+    below tol. This requires a finite steady state, i.e. gp > 0.
+
+    Parameters
+    ----------
+    par : array-like.
+        Rate parameters in the order given by model['params'].
+    n_max : tuple or None.
+        Initial (number of mRNA values, number of protein values). If None
+        it is guessed with initial_truncation.
+    model : dict or None.
+        Promoter model definition. If None momgen.promoter_model(n_states)
+        is used.
+    n_states : int. Default = 3
+        Number of promoter states.
+    tol : float. Default = 1E-6
+        Maximum probability allowed in the outer layers of the lattice.
+    method : str. Default = 'direct'
+        'direct' solves the linear system with a sparse LU decomposition.
+        'iterative' uses LGMRES with an incomplete LU preconditioner, which
+        needs less memory for large lattices.
+    max_expand : int. Default = 10
+        Maximum number of times the lattice is expanded.
+
+    Returns
+    -------
+    P_dist : array-like. shape = (n_states, n_mRNA, n_protein)
+        Steady-state distribution.
+
+    Raises
+    ------
+    RuntimeError
+        Thrown if the tolerance is not reached after max_expand expansions.
+    '''
+    if model is None:
+        model = momgen.promoter_model(n_states)
+    if n_max is None:
+        n_max = initial_truncation(par, model)
+
+    for i in range(max_expand + 1):
+        shape = (len(model['states']),) + tuple(n_max)
+        Q = cme_generator(par, n_max, model, absorbing=False)
+        N = Q.shape[0]
+        # Replace first equation with the normalization condition
+        ones = sp.sparse.csr_matrix(np.ones((1, N)))
+        M = sp.sparse.vstack([ones, Q[1:]]).tocsc()
+        b = np.zeros(N)
+        b[0] = 1
+        if method == 'direct':
+            x = sp.sparse.linalg.spsolve(M, b)
+        elif method == 'iterative':
+            ilu = sp.sparse.linalg.spilu(M, drop_tol=1E-5)
+            precond = sp.sparse.linalg.LinearOperator(M.shape, ilu.solve)
+            # Refine the solution on the residual, since each call only
+            # reduces the residual by the default relative tolerance
+            x = np.zeros(N)
+            for j in range(20):
+                res = b - M @ x
+                if np.abs(res).max() < 1E-14:
+                    break
+                dx, info = sp.sparse.linalg.lgmres(M, res, M=precond)
+                if info < 0:
+                    raise RuntimeError('LGMRES failed')
+                x += dx
+        else:
+            raise ValueError("method must be 'direct' or 'iterative'")
+        # Remove negative round-off values
+        x = np.maximum(x, 0)
+        P_dist = (x / x.sum()).reshape(shape)
+
+        if max(boundary_mass(P_dist)) < tol:
+            return P_dist
+        n_max = expand_truncation(n_max, P_dist, tol)
+
+    raise RuntimeError('steady state did not converge within the lattice. '
+                       'Is the protein degradation rate gp > 0?')
+
+
+def evolve_distribution(Q, P_vec, times, weights=None, method='uniformization'):
+    '''
+    Evolves a distribution under the generator Q. With uniformization the
+    distribution at time t is written as
+    P(t) = ∑ Poisson(k | Λt) S^k P(0),  S = I + Q / Λ,
+    where Λ is the largest exit rate. Since the vectors S^k P(0) do not
+    depend on t, any weighted combination of the distribution at several
+    times is computed in a single pass with scalar weights.
+
+    Parameters
+    ----------
+    Q : scipy.sparse matrix.
+        Generator of the master equation.
+    P_vec : array-like.
+        Flattened initial distribution.
+    times : float or array-like.
+        Times at which the distribution is evaluated.
+    weights : array-like or None. shape = (n_out, len(times))
+        Weights to combine the distributions at each time. If None the
+        distribution at each time is returned.
+    method : str. Default = 'uniformization'
+        'uniformization' or 'expm_multiply' for the scipy Krylov-type
+        action of the matrix exponential on each time interval.
+
+    Returns
+    -------
+    P_out : array-like. shape = (n_out, len(P_vec))
+        Weighted combinations of the distributions. If times is a scalar
+        and weights is None, the distribution at that time.
+    '''
+    scalar = np.ndim(times) == 0
+    times = np.atleast_1d(times).astype(float)
+    if weights is None:
+        weights = np.eye(len(times))
+    weights = np.atleast_2d(weights)
+
+    if method == 'expm_multiply':
+        # Evaluate the distribution one time interval at a time
+        P_t = np.empty((len(times), len(P_vec)))
+        t_prev = 0
+        for i, t in enumerate(times):
+            P_vec = sp.sparse.linalg.expm_multiply(Q * (t - t_prev), P_vec)
+            P_t[i], t_prev = P_vec, t
+        P_out = weights @ P_t
+    elif method == 'uniformization':
+        # Define uniformization rate and the stochastic matrix S
+        rate = max(-Q.diagonal().min(), 1E-300)
+        S = sp.sparse.identity(Q.shape[0], format='csr') + Q / rate
+        # Number of terms such that the Poisson tail is negligible
+        lam = rate * times.max()
+        n_terms = int(lam + 10 * np.sqrt(lam) + 30)
+        # Compute the scalar weight of each term S^k P(0)
+        k = np.arange(n_terms)
+        coeff = weights @ sp.stats.poisson.pmf(k[None, :],
+                                               rate * times[:, None])
+        P_out = np.zeros((len(weights), len(P_vec)))
+        for i in range(n_terms):
+            P_out += coeff[:, i:i + 1] * P_vec[None, :]
+            P_vec = S @ P_vec
+    else:
+        raise ValueError("method must be 'uniformization' or "
+                         "'expm_multiply'")
+
+    if scalar and len(P_out) == 1:
+        return P_out[0]
+    return P_out
+
+
+def cell_cycle_distribution(par_single, par_double, t_single, t_double,
+                            n_cycles, n_max=None, P_init=None, model=None,
+                            n_states=3, n_steps=100, tol=1E-6,
+                            max_expand=10, method='uniformization'):
+    '''
+    Computes the distribution over the (promoter state, mRNA, protein)
+    lattice averaged over the cell cycle. As in model.dmomdt_cycles, cells
+    spend t_single with one promoter and t_double with two promoters, and
+    mRNA and protein are partitioned binomially at division. The
+    distribution of the last cycle is averaged over the age distribution
+    of an exponentially growing population
+    p(a) = ln(2) * 2^(1 - a).
+    The lattice is expanded until less than tol probability leaves it.
+
+    Parameters
+    ----------
+    par_single, par_double : array-like.
+        Rate parameters for the single and double promoter stages in the
+        order given by model['params'].
+    t_single, t_double : float.
+        Time spent with one and two promoters.
+    n_cycles : int.
+        Number of cell cycles to integrate.
+    n_max : tuple or None.
+        Initial (number of mRNA values, number of protein values). If None
+        it is guessed with initial_truncation.
+    P_init : array-like or None. shape = (n_states, n_mRNA, n_protein)
+        Initial distribution. If None all of the probability starts at the
+        first promoter state with zero mRNA and protein.
+    model : dict or None.
+        Promoter model definition. If None momgen.promoter_model(n_states)
+        is used.
+    n_states : int. Default = 3
+        Number of promoter states.
+    n_steps : int. Default = 100
+        Number of time steps per stage used to average the last cycle.
+    tol : float. Default = 1E-6
+        Maximum probability allowed to leave the lattice.
+    max_expand : int. Default = 10
+        Maximum number of times the lattice is expanded.
+    method : str. Default = 'uniformization'
+        Time integration method. See evolve_distribution.
+
+    Returns
+    -------
+    P_avg : array-like. shape = (n_states, n_mRNA, n_protein)
+        Distribution averaged over the last cell cycle.
+    P_div : array-like. shape = (n_states, n_mRNA, n_protein)
+        Distribution right after the last division.
+
+    Raises
+    ------
+    RuntimeError
+        Thrown if the tolerance is not reached after max_expand expansions.
+    '''
+    if model is None:
+        model = momgen.promoter_model(n_states)
+    n_states = len(model['states'])
+    t_cycle = t_single + t_double
+    if n_max is None:
+        n_max = initial_truncation(par_double, model, t_cycle=t_cycle)
+    if P_init is not None:
+        n_max = tuple(max(a, b) for a, b in zip(n_max, P_init.shape[1:]))
+
+    # Define time steps of each stage and the weight of the age of the
+    # cells at each step with the trapezoidal rule. The last row of the
+    # weights returns the distribution at the end of the stage.
+    t_s = np.linspace(0, t_single, n_steps + 1)
+    t_d = np.linspace(0, t_double, n_steps + 1)
+    trapz = np.r_[0.5, np.ones(n_steps - 1), 0.5]
+    w_s = np.log(2) * 2**(1 - t_s / t_cycle) * trapz * t_s[1] / t_cycle
+    w_d = np.log(2) * 2**(1 - (t_single + t_d) / t_cycle) * trapz * \
+        t_d[1] / t_cycle
+    last = np.r_[np.zeros(n_steps), 1]
+    w_s, w_d = np.stack([w_s, last]), np.stack([w_d, last])
+
+    for i in range(max_expand + 1):
+        shape = (n_states,) + tuple(n_max)
+        N = np.prod(shape)
+        # Initialize distribution
+        if P_init is None:
+            P_dist = np.zeros(shape)
+            P_dist[0, 0, 0] = 1
+        else:
+            P_dist = pad_distribution(P_init, n_max)
+        # Build generators, with the two sinks collecting the probability
+        # leaving the lattice, and partitioning operators
+        Q_s = cme_generator(par_single, n_max, model, sinks=True)
+        Q_d = cme_generator(par_double, n_max, model, sinks=True)
+        B_m = binomial_partition_operator(n_max[0])
+        B_p = binomial_partition_operator(n_max[1])
+
+        P_vec = np.r_[P_dist.ravel(), 0, 0]
+        for cyc in range(n_cycles):
+            if cyc < n_cycles - 1:
+                P_vec = evolve_distribution(Q_s, P_vec, t_single,
+                                            method=method)
+                P_vec = evolve_distribution(Q_d, P_vec, t_double,
+                                            method=method)
+            else:
+                # Average the distribution over the last cycle
+                P_avg, P_vec = evolve_distribution(Q_s, P_vec, t_s, w_s,
+                                                   method=method)
+                P_out = evolve_distribution(Q_d, P_vec, t_d, w_d,
+                                            method=method)
+                P_avg, P_vec = P_avg + P_out[0], P_out[1]
+            # Divide cells
+            P_vec[:N] = partition_distribution(P_vec[:N].reshape(shape),
+                                               B_m, B_p).ravel()
+
+        # Check probability that left the lattice along each axis
+        leak = P_vec[N:]
+        P_avg = P_avg[:N].reshape(shape)
+        if leak.sum() < tol and max(boundary_mass(P_avg)) < tol:
+            return P_avg / P_avg.sum(), P_vec[:N].reshape(shape)
+        n_max = expand_truncation(n_max, P_avg, tol, leak)
+
+    raise RuntimeError('cell cycle distribution did not converge within '
+                       'the lattice')
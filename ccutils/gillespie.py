@@ -0,0 +1,562 @@
+# -*- coding: utf-8 -*-
+"""
+Title:
+    gillespie.py
+Last update:
+    2026-10-19
+Author(s):
+    Manuel Razo-Mejia
+Purpose:
+    This file compiles the functions used to run stochastic simulations of
+    the gene expression models with the Gillespie algorithm. Instead of
+    simulating one trajectory at a time, all cells are advanced in lockstep
+    with vectorized propensities, optionally using tau-leaping for the
+    cells where many reactions fire between events. Lineages going through
+    gene replication and cell division are simulated to validate the
+    cell-cycle moment and distribution predictions.
+"""
+
+import numpy as np
+
+from . import momgen
+
+
+# REACTION NETWORKS
+def mass_action_propensity(rates, reactants):
+    '''
+    Returns a function that computes mass-action propensities
+    a_j = k_j ∏_i x_i (x_i - 1) ... (x_i - ν_ij + 1)
+    for a batch of cells.
+
+    Parameters
+    ----------
+    rates : array-like. shape = (n_reactions,) or (n_cells, n_reactions)
+        Rate constant of each reaction. If 2D, each cell has its own set
+        of rates.
+    reactants : array-like. shape = (n_reactions, n_species)
+        Number of molecules of each species consumed by each reaction,
+        i.e. the order of the reaction on each species.
+
+    Returns
+    -------
+    propensity : function.
+        Function that takes the population of shape (n_cells, n_species)
+        and returns the propensities of shape (n_cells, n_reactions).
+    '''
+    rates = np.array(rates, dtype=float)
+    reactants = np.array(reactants, dtype=int)
+    # List (reaction, species, order) for the non-zero orders
+    rxn, species = np.nonzero(reactants)
+
+    def propensity(pop):
+        a = np.broadcast_to(rates, (len(pop), reactants.shape[0])).copy()
+        for j, i in zip(rxn, species):
+            for k in range(reactants[j, i]):
+                a[:, j] *= np.maximum(pop[:, i] - k, 0)
+        return a
+
+    return propensity
+
+
+def promoter_network(par, model=None, n_states=3, protein=True):
+    '''
+    Builds the reaction network of the promoter models used in the project
+    as stoichiometry and rate arrays. The species are the promoter states
+    (in the order of model['states']) followed by mRNA and protein.
+
+    Parameters
+    ----------
+    par : array-like.
+        Rate parameters in the order given by model['params']. Each entry
+        can be an array of length n_cells to give each cell its own rates.
+    model : dict or None.
+        Promoter model definition as returned by momgen.promoter_model. If
+        None momgen.promoter_model(n_states) is used.
+    n_states : int. Default = 3
+        Number of promoter states.
+    protein : bool. Default = True
+        If False, the protein reactions are left out and the last species
+        is mRNA.
+
+    Returns
+    -------
+    stoich : array-like. shape = (n_reactions, n_species)
+        Change in the copy number of each species for each reaction.
+    reactants : array-like. shape = (n_reactions, n_species)
+        Order of each reaction on each species.
+    rates : array-like. shape = (n_reactions,) or (n_cells, n_reactions)
+        Rate constant of each reaction.
+    '''
+    if model is None:
+        model = momgen.promoter_model(n_states)
+    rate = dict(zip(model['params'], par))
+    species = model['states'] + ['m', 'p']
+    if not protein:
+        species = species[:-1]
+    n_species = len(species)
+
+    stoich, reactants, rates = list(), list(), list()
+
+    def add_reaction(reactant, change, k):
+        nu = np.zeros(n_species, dtype=int)
+        r = np.zeros(n_species, dtype=int)
+        r[species.index(reactant)] = 1
+        for s, dx in change.items():
+            nu[species.index(s)] += dx
+        stoich.append(nu)
+        reactants.append(r)
+        rates.append(k)
+
+    # Promoter state transitions
+    for s_from, s_to, name in model['transitions']:
+        add_reaction(s_from, {s_from: -1, s_to: 1}, rate[name])
+    # mRNA production and degradation
+    for state, name in model['production'].items():
+        add_reaction(state, {'m': 1}, rate[name])
+    add_reaction('m', {'m': -1}, rate['gm'])
+    # protein production and degradation
+    if protein:
+        add_reaction('m', {'p': 1}, rate['rp'])
+        add_reaction('p', {'p': -1}, rate['gp'])
+
+    rates = np.stack(np.broadcast_arrays(*rates), axis=-1).astype(float)
+
+    return np.array(stoich), np.array(reactants), rates
+
+
+# SIMULATION
+def sample_reaction(a, rng):
+    '''
+    Draws the index of one reaction per cell with probability proportional
+    to its propensity.
+
+    Parameters
+    ----------
+    a : array-like. shape = (n_cells, n_reactions)
+        Propensities.
+    rng : numpy.random.Generator.
+        Random number generator.
+
+    Returns
+    -------
+    rxn : array-like. shape = (n_cells,)
+        Index of the selected reaction.
+    '''
+    cumsum = np.cumsum(a, axis=1)
+    u = rng.random(len(a)) * cumsum[:, -1]
+    return np.minimum((cumsum < u[:, None]).sum(axis=1), a.shape[1] - 1)
+
+
+def tau_selection(a, pop, stoich, reactants=None, eps=0.01):
+    '''
+    Computes the tau-leaping step size for each cell with the method of
+    Cao, Gillespie & Petzold (J. Chem. Phys. 124, 2006), which bounds the
+    expected relative change of the propensities by eps.
+
+    Parameters
+    ----------
+    a : array-like. shape = (n_cells, n_reactions)
+        Propensities.
+    pop : array-like. shape = (n_cells, n_species)
+        Current population.
+    stoich : array-like. shape = (n_reactions, n_species)
+        Stoichiometry matrix.
+    reactants : array-like or None. shape = (n_reactions, n_species)
+        Order of each reaction on each species. If None all species are
+        treated as reactants of first-order reactions.
+    eps : float. Default = 0.01
+        Error control parameter.
+
+    Returns
+    -------
+    tau : array-like. shape = (n_cells,)
+        Step size for each cell.
+    '''
+    if reactants is None:
+        g = np.ones(stoich.shape[1])
+    else:
+        g = np.array(reactants).max(axis=0).astype(float)
+    # Only the species that are reactants of a reaction are considered
+    idx = g > 0
+    # Mean and variance of the change of each species per unit time
+    mu = a @ stoich[:, idx]
+    sigma2 = a @ stoich[:, idx]**2
+    bound = np.maximum(eps * pop[:, idx] / g[idx], 1)
+    with np.errstate(divide='ignore'):
+        tau = np.minimum(bound / np.abs(mu), bound**2 / sigma2)
+
+    return tau.min(axis=1)
+
+
+def ssa_batch(stoich, propensity, pop_init, time_points, args=(),
+              n_cells=None, tau_leap=False, reactants=None, eps=0.01,
+              n_crit=10, rng=None):
+    '''
+    Uses the Gillespie stochastic simulation algorithm to sample the
+    copy numbers of a batch of independent cells at each of the
+    time_points. All cells are advanced at once: every iteration draws one
+    reaction (or one tau-leap) per cell using vectorized propensities.
+
+    Parameters
+    ----------
+    stoich : array-like. shape = (n_reactions, n_species)
+        Entry j, i gives the change in the copy number of species i when
+        reaction j fires.
+    propensity : function.
+        Function of the form f(pop, *args) that takes the population of
+        shape (n_cells, n_species) and returns the propensities of shape
+        (n_cells, n_reactions). See mass_action_propensity.
+    pop_init : array-like. shape = (n_species,) or (n_cells, n_species)
+        Initial copy numbers.
+    time_points : array-like.
+        Sorted times at which to save the population. The simulation starts
+        at time_points[0].
+    args : tuple. Default = ()
+        Extra arguments passed to propensity.
+    n_cells : int or None.
+        Number of cells to simulate if pop_init is 1D.
+    tau_leap : bool. Default = False
+        If True, cells take Poisson tau-leaps following Cao, Gillespie &
+        Petzold (J. Chem. Phys. 124, 2006) whenever the step is worth more
+        than n_crit exact reactions. Critical reactions, which could
+        exhaust one of their reactants within n_crit firings (e.g. the
+        promoter transitions), fire at most once per leap at an exact
+        exponential time. Leaps that would make a copy number negative are
+        rejected and the cell takes an exact step instead.
+    reactants : array-like or None. shape = (n_reactions, n_species)
+        Order of each reaction on each species. Used for the tau selection.
+    eps : float. Default = 0.01
+        Error control parameter of the tau selection. Tau-leaping inflates
+        stationary variances by roughly 1 / (1 - kτ / 2) for a species
+        degraded at rate k, so eps should be small when distributions,
+        rather than means, are of interest.
+    n_crit : float. Default = 10
+        Critical number of firings and minimum expected number of
+        reactions per leap.
+    rng : numpy.random.Generator or None.
+        Random number generator. If None a new one is created.
+
+    Returns
+    -------
+    pop_out : array-like. shape = (n_cells, len(time_points), n_species)
+        Entry c, t, i is the copy number of species i in cell c at time
+        time_points[t].
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    stoich = np.array(stoich, dtype=np.int64)
+    time_points = np.array(time_points, dtype=float)
+    pop = np.array(pop_init, dtype=np.int64)
+    if pop.ndim == 1:
+        pop = np.tile(pop, (n_cells, 1))
+    n_cells, n_times = len(pop), len(time_points)
+
+    # Initialize output array, time and index of next output of each cell
+    pop_out = np.empty((n_cells, n_times, stoich.shape[1]), dtype=np.int64)
+    t = np.full(n_cells, time_points[0])
+    i_out = np.zeros(n_cells, dtype=int)
+    force_ssa = np.zeros(n_cells, dtype=bool)
+
+    def record(cells, t_new, pop):
+        # Save the population for every output time before t_new
+        while True:
+            cells = cells[i_out[cells] < n_times]
+            cells = cells[time_points[i_out[cells]] < t_new[cells]]
+            if len(cells) == 0:
+                return
+            pop_out[cells, i_out[cells]] = pop[cells]
+            i_out[cells] += 1
+
+    # Number of molecules of each species consumed by each reaction
+    consumed = np.maximum(-stoich, 0)
+
+    active = np.arange(n_cells)
+    while len(active) > 0:
+        a = propensity(pop, *args)
+        a0 = a.sum(axis=1)
+
+        # Decide which cells take a leap
+        leap = np.zeros(n_cells, dtype=bool)
+        if tau_leap:
+            # Reactions that could exhaust one of their reactants within
+            # n_crit firings are critical and are not leaped
+            with np.errstate(divide='ignore', invalid='ignore'):
+                n_fire = np.where(consumed > 0,
+                                  pop[:, None, :] // np.maximum(consumed, 1),
+                                  np.inf).min(axis=2)
+            critical = (n_fire < n_crit) & (a > 0)
+            a_crit = np.where(critical, a, 0)
+            # Step size for the non-critical reactions
+            tau = tau_selection(a - a_crit, pop, stoich, reactants, eps)
+            # Do not leap over the next output time
+            t_next = time_points[np.minimum(i_out, n_times - 1)]
+            tau = np.minimum(tau, t_next - t)
+            # Leap only if it is worth more than n_crit exact reactions.
+            # This must be decided before drawing the time to the next
+            # critical reaction to not bias the critical reactions.
+            leap[active] = (tau[active] * a0[active] > n_crit) & \
+                ~force_ssa[active]
+            # Time to the next critical reaction
+            with np.errstate(divide='ignore'):
+                tau_crit = rng.exponential(size=n_cells) / a_crit.sum(axis=1)
+            fire_crit = tau_crit < tau
+            tau = np.minimum(tau, tau_crit)
+        force_ssa[:] = False
+
+        # Exact steps
+        cells = active[~leap[active]]
+        with np.errstate(divide='ignore'):
+            dt = rng.exponential(size=len(cells)) / a0[cells]
+        rxn = sample_reaction(a[cells], rng)
+        t_new = np.full(n_cells, np.inf)
+        t_new[cells] = t[cells] + dt
+        # Save population before the reaction fires
+        record(cells, t_new, pop)
+        # Cells with zero propensity are done after recording
+        fire = np.isfinite(dt)
+        pop[cells[fire]] += stoich[rxn[fire]]
+        t[cells] = t_new[cells]
+
+        # Tau-leaps
+        cells = active[leap[active]]
+        if len(cells) > 0:
+            # Fire non-critical reactions as Poisson numbers
+            k = rng.poisson((a[cells] - a_crit[cells]) * tau[cells, None])
+            # Fire one critical reaction if it happens within the leap
+            crit = np.nonzero(fire_crit[cells])[0]
+            k[crit, sample_reaction(a_crit[cells[crit]], rng)] += 1
+            pop_new = pop[cells] + k @ stoich
+            # Reject leaps that make copy numbers negative
+            ok = (pop_new >= 0).all(axis=1)
+            force_ssa[cells[~ok]] = True
+            cells, pop_new = cells[ok], pop_new[ok]
+            pop[cells] = pop_new
+            t[cells] += tau[cells]
+            # Save population if the leap reached the output time
+            t_new = np.full(n_cells, -np.inf)
+            t_new[cells] = np.nextafter(t[cells], np.inf)
+            record(cells, t_new, pop)
+
+        active = active[i_out[active] < n_times]
+
+    return pop_out
+
+
+# CELL CYCLE
+def age_weights(t_single, t_double, n_steps):
+    '''
+    Returns the age of the cells at the snapshots taken by cell_cycle_ssa
+    and the weight of each snapshot given the age distribution of an
+    exponentially growing population
+    p(a) = ln(2) * 2^(1 - a).
+    The weights follow the trapezoidal rule used by
+    fsp.cell_cycle_distribution, such that they add up to one.
+
+    Parameters
+    ----------
+    t_single, t_double : float.
+        Time spent with one and two promoters.
+    n_steps : int.
+        Number of time steps per stage.
+
+    Returns
+    -------
+    ages : array-like. shape = (2 * (n_steps + 1),)
+        Time since the last division of each snapshot.
+    weights : array-like. shape = (2 * (n_steps + 1),)
+        Weight of each snapshot.
+    '''
+    t_cycle = t_single + t_double
+    t_s = np.linspace(0, t_single, n_steps + 1)
+    t_d = t_single + np.linspace(0, t_double, n_steps + 1)
+    trapz = np.r_[0.5, np.ones(n_steps - 1), 0.5]
+    w_s = trapz * t_single / n_steps
+    w_d = trapz * t_double / n_steps
+    ages = np.r_[t_s, t_d]
+    weights = np.log(2) * 2**(1 - ages / t_cycle) * np.r_[w_s, w_d] / t_cycle
+
+    return ages, weights
+
+
+def cell_cycle_batch(par_single, par_double, t_single, t_double, n_cycles,
+                     n_cells, n_steps=20, model=None, n_states=3,
+                     duplicate=False, pop_init=None, rng=None, **kwargs):
+    '''
+    Simulates a batch of cell lineages through the cell cycle in a single
+    process. See cell_cycle_ssa for the description of the parameters.
+
+    Returns
+    -------
+    snapshots : array-like. shape = (n_cells, 2 * (n_steps + 1), 2)
+        mRNA and protein copy number of each cell at each snapshot of the
+        last cell cycle.
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    if model is None:
+        model = momgen.promoter_model(n_states)
+    n_states = len(model['states'])
+
+    # Build the reaction network of each stage
+    stoich, reactants, rates_s = promoter_network(par_single, model)
+    _, _, rates_d = promoter_network(par_double, model)
+    prop_s = mass_action_propensity(rates_s, reactants)
+    prop_d = mass_action_propensity(rates_d, reactants)
+    kwargs.update(reactants=reactants, rng=rng)
+
+    # Initialize population with all promoters in the first state
+    if pop_init is None:
+        pop_init = np.zeros(n_states + 2, dtype=int)
+        pop_init[0] = 1
+    pop = np.array(pop_init, dtype=np.int64)
+    if pop.ndim == 1:
+        pop = np.tile(pop, (n_cells, 1))
+
+    t_s = np.linspace(0, t_single, n_steps + 1)
+    t_d = np.linspace(0, t_double, n_steps + 1)
+    for cyc in range(n_cycles):
+        # Single promoter stage
+        out_s = ssa_batch(stoich, prop_s, pop, t_s, **kwargs)
+        pop = out_s[:, -1].copy()
+        # Replicate the gene. The new copy starts in the same state
+        if duplicate:
+            pop[:, :n_states] *= 2
+        # Double promoter stage
+        out_d = ssa_batch(stoich, prop_d, pop, t_d, **kwargs)
+        pop = out_d[:, -1].copy()
+        # Divide the cell, keeping one of the promoter copies and
+        # partitioning each mRNA and protein with probability 1/2
+        if duplicate:
+            state = sample_reaction(pop[:, :n_states], rng)
+            pop[:, :n_states] = 0
+            pop[np.arange(n_cells), state] = 1
+        pop[:, n_states:] = rng.binomial(pop[:, n_states:], 0.5)
+
+    return np.concatenate([out_s, out_d], axis=1)[..., n_states:]
+
+
+def cell_cycle_ssa(par_single, par_double, t_single, t_double, n_cycles,
+                   n_cells, n_steps=20, model=None, n_states=3,
+                   duplicate=False, pop_init=None, n_jobs=1, seed=None,
+                   **kwargs):
+    '''
+    Simulates the same lineage process as model.dmomdt_cycles and
+    fsp.cell_cycle_distribution with the Gillespie algorithm. Cells spend
+    t_single with one copy of the gene, replicate it and spend t_double
+    with two copies. At division one daughter is followed, receiving one
+    promoter copy and a binomially partitioned share of the mRNA and
+    protein. Snapshots of the last cell cycle are returned in a compact
+    integer array together with their age weights.
+
+    Parameters
+    ----------
+    par_single, par_double : array-like.
+        Rate parameters for the single and double promoter stages in the
+        order given by model['params']. Each entry can be an array of
+        length n_cells to give each cell its own rates.
+    t_single, t_double : float.
+        Time spent with one and two promoters.
+    n_cycles : int.
+        Number of cell cycles to simulate.
+    n_cells : int.
+        Number of lineages to simulate.
+    n_steps : int. Default = 20
+        Number of time steps per stage at which snapshots are taken.
+    model : dict or None.
+        Promoter model definition. If None momgen.promoter_model(n_states)
+        is used.
+    n_states : int. Default = 3
+        Number of promoter states.
+    duplicate : bool. Default = False
+        If False the cell keeps a single promoter and par_double gives the
+        rates after replication, following the convention of
+        model.dmomdt_cycles where par_double has twice the mRNA production
+        rate. If True the promoter is copied at t_single and each of the
+        two copies switches independently with the rates in par_double,
+        which should then equal par_single.
+    pop_init : array-like or None. shape = (n_states + 2,)
+        Initial promoter state, mRNA and protein copy numbers. If None all
+        cells start in the first promoter state with no mRNA or protein.
+    n_jobs : int. Default = 1
+        Number of processes among which the cells are split.
+    seed : int or None.
+        Seed of the random number generators of the processes.
+    **kwargs
+        Extra arguments passed to ssa_batch, e.g. tau_leap=True.
+
+    Returns
+    -------
+    snapshots : array-like. shape = (n_cells, 2 * (n_steps + 1), 2)
+        mRNA and protein copy number of each cell at each snapshot of the
+        last cell cycle, stored with the smallest unsigned integer type
+        that fits them.
+    ages : array-like. shape = (2 * (n_steps + 1),)
+        Time since division of each snapshot.
+    weights : array-like. shape = (2 * (n_steps + 1),)
+        Weight of each snapshot under the age distribution of an
+        exponentially growing population. See age_weights.
+    '''
+    # Split the cells and their parameters among the processes
+    chunks = np.array_split(np.arange(n_cells), min(n_jobs, n_cells))
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+
+    def chunk_par(par, idx):
+        return [p[idx] if np.ndim(p) > 0 else p for p in par]
+
+    def chunk_init(idx):
+        if pop_init is None or np.ndim(pop_init) == 1:
+            return pop_init
+        return np.asarray(pop_init)[idx]
+
+    jobs = [(chunk_par(par_single, idx), chunk_par(par_double, idx),
+             t_single, t_double, n_cycles, len(idx), n_steps, model,
+             n_states, duplicate, chunk_init(idx), np.random.default_rng(s))
+            for idx, s in zip(chunks, seeds)]
+
+    if len(jobs) == 1:
+        snapshots = [cell_cycle_batch(*jobs[0], **kwargs)]
+    else:
+        from joblib import Parallel, delayed
+        snapshots = Parallel(n_jobs=n_jobs)(
+            delayed(cell_cycle_batch)(*job, **kwargs) for job in jobs)
+    snapshots = np.concatenate(snapshots)
+    snapshots = snapshots.astype(np.min_scalar_type(snapshots.max()))
+
+    ages, weights = age_weights(t_single, t_double, n_steps)
+
+    return snapshots, ages, weights
+
+
+def snapshot_distribution(snapshots, weights, n_max=None):
+    '''
+    Computes the joint mRNA and protein distribution over the cell cycle
+    from the snapshots returned by cell_cycle_ssa. The result can be
+    compared with the marginal over promoter states of the distribution
+    returned by fsp.cell_cycle_distribution.
+
+    Parameters
+    ----------
+    snapshots : array-like. shape = (n_cells, n_snapshots, 2)
+        mRNA and protein copy numbers.
+    weights : array-like. shape = (n_snapshots,)
+        Weight of each snapshot.
+    n_max : tuple or None.
+        (number of mRNA values, number of protein values) of the output.
+        If None it is set by the largest copy numbers.
+
+    Returns
+    -------
+    P_mp : array-like. shape = n_max
+        Probability of each (mRNA, protein) pair.
+    '''
+    m = snapshots[..., 0].ravel()
+    p = snapshots[..., 1].ravel()
+    if n_max is None:
+        n_max = (int(m.max()) + 1, int(p.max()) + 1)
+    w = np.broadcast_to(weights, snapshots.shape[:2]).ravel()
+    # Counts beyond n_max are dropped
+    keep = (m < n_max[0]) & (p < n_max[1])
+    P_mp = np.bincount(np.ravel_multi_index((m[keep], p[keep]), n_max),
+                       weights=w[keep], minlength=np.prod(n_max))
+
+    return P_mp.reshape(n_max) / w.sum()
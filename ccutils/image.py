@@ -1,9 +1,17 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import threading
 import numpy as np
 import pandas as pd
 
 # Image analysis libraries
 import skimage.io
 import skimage.filters
+import skimage.measure
+import skimage.morphology
 import skimage.segmentation
 import scipy.ndimage
 
@@ -21,36 +29,157 @@ Purpose:
 
 
 # GENERAL USEFUL FUNCTIONS
-def average_stack(im, median_filt=True):
+def read_image(fname, mmap=False):
     """
-    Computes an average image from a provided array of images.
+    Reads a single image from file.
 
     Parameters
     ----------
-    im : list or arrays of 2d-arrays
+    fname : str
+        Path to the image.
+    mmap : bool
+        If True, uncompressed TIFF files are memory-mapped such that pixels
+        are only read from disk when accessed. Files that cannot be
+        memory-mapped are read normally.
+
+    Returns
+    -------
+    im : 2d-array
+        Image.
+    """
+    if mmap is True:
+        try:
+            import tifffile
+        except ImportError:
+            from skimage.external import tifffile
+        try:
+            return tifffile.memmap(fname, mode='r')
+        except (ValueError, TypeError, OSError):
+            # Compressed or non-contiguous images
+            pass
+    return skimage.io.imread(fname)
+
+
+def stream_images(fnames, mmap=False):
+    """
+    Lazily yields the images of a stack one at a time such that only a
+    single frame is kept in memory.
+
+    Parameters
+    ----------
+    fnames : str or list of str
+        List of image paths or a glob pattern. Patterns are sorted by name.
+    mmap : bool
+        If True, TIFF files are memory-mapped. See read_image.
+
+    Yields
+    ------
+    im : 2d-array
+        Next image of the stack.
+    """
+    if isinstance(fnames, str):
+        fnames = sorted(glob.glob(fnames))
+    for fname in fnames:
+        yield read_image(fname, mmap=mmap)
+
+
+def filter_stream(im, median_filt=True, n_threads=1):
+    """
+    Yields the images of a stack in order, median filtering them in a pool
+    of threads. scipy.ndimage releases the GIL, so the filters run in
+    parallel while at most 2 * n_threads frames are held in memory.
+
+    Parameters
+    ----------
+    im : iterable of 2d-arrays
+        Stack of images to be filtered.
+    median_filt : bool
+        If True, each image will be median filtered with a 3x3 square
+        structural element. Otherwise images are yielded as they are.
+    n_threads : int
+        Number of threads used for the filtering.
+
+    Yields
+    ------
+    im_filt : 2d-array
+        Next filtered image of the stack.
+    """
+    if median_filt is not True:
+        yield from im
+        return
+
+    selem = skimage.morphology.square(3)
+
+    def filt(i):
+        return scipy.ndimage.median_filter(i, footprint=selem)
+
+    if n_threads <= 1:
+        for i in im:
+            yield filt(i)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    from collections import deque
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        pending = deque()
+        for i in im:
+            pending.append(pool.submit(filt, i))
+            # Bound the number of frames in flight
+            if len(pending) >= 2 * n_threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def average_stack(im, median_filt=False, return_var=False, n_threads=1):
+    """
+    Computes an average image from a provided array of images. The images
+    are consumed one at a time with Welford's algorithm, so any iterable
+    such as the generator returned by stream_images can be used with a
+    single frame in memory, and the per-pixel variance is obtained in the
+    same pass.
+
+    Parameters
+    ----------
+    im : iterable of 2d-arrays
         Stack of images to be filtered.
     median_filt : bool
         If True, each image will be median filtered before averaging.
         Median filtering is performed using a 3x3 square structural element.
+        Default is False, which averages the raw images as the background
+        and flat-field averages of every `processing.py` have been computed.
+    return_var : bool
+        If True, the per-pixel sample variance across the stack is also
+        returned, e.g. to check the camera noise.
+    n_threads : int
+        Number of threads used to median filter the images.
 
     Returns
     -------
     im_avg : 2d-array
-        averaged image with a type of int.
+        averaged image with a type of float.
+    im_var : 2d-array
+        Per-pixel variance of the images. Only returned if return_var is
+        True.
     """
+    # Initialize running mean and sum of squared deviations
+    im_avg, im_m2 = None, None
+    n_im = 0
+    for i in filter_stream(im, median_filt, n_threads):
+        if im_avg is None:
+            im_avg = np.zeros(np.shape(i))
+            im_m2 = np.zeros(np.shape(i))
+        n_im += 1
+        delta = i - im_avg
+        im_avg += delta / n_im
+        im_m2 += delta * (i - im_avg)
 
-    # Determine if the images should be median filtered.
-    if median_filt is True:
-        selem = skimage.morphology.square(3)
-        im_filt = [scipy.ndimage.median_filter(i, footprint=selem) for i in im]
-    else:
-        im = im_filt
+    if n_im == 0:
+        raise ValueError('no images to average.')
 
-    # Generate and empty image to store the averaged image.
-    im_avg = np.zeros_like(im[0]).astype(int)
-    for i in im:
-        im_avg += i
-    im_avg = im_avg / len(im)
+    if return_var is True:
+        return im_avg, im_m2 / max(n_im - 1, 1)
     return im_avg
 
 
@@ -58,10 +187,127 @@ def ome_split(im):
     """Splits an ome.tiff image into individual channels"""
     if len(np.shape(im)) != 3:
         raise RuntimeError('provided image must be a single image')
-    ims = []
-    for i in range(np.shape(im)[-1]):
-        ims.append(im[:, :, i])
-    return ims
+    # Channels are numbered since ome.tiff files can have any number of them
+    names = range(np.shape(im)[-1])
+    return list(MultiChannelImage.from_ome(im, names=names))
+
+
+class MultiChannelImage(object):
+    """
+    Multichannel image stored as a single contiguous channel-first array.
+    Each channel is a contiguous 2D view of the array that can be passed
+    to the segmentation and measurement functions without copies.
+
+    Parameters
+    ----------
+    data : 3d-array
+        Image with shape (n_channels, rows, columns). It is only copied if
+        it is not C-contiguous.
+    names : tuple of str
+        Name of each channel.
+
+    Examples
+    --------
+    >>> im = MultiChannelImage.from_ome(skimage.io.imread(fname))
+    >>> mask = log_segmentation(im['mCherry'], label=True)
+    >>> df = props_to_df(mask, intensity_image=im['YFP'])
+    """
+    NAMES = ('BF', 'mCherry', 'YFP')
+
+    def __init__(self, data, names=NAMES):
+        if np.ndim(data) != 3:
+            raise ValueError('data must have shape (channels, rows, columns)')
+        if len(names) != len(data):
+            raise ValueError('one name per channel is required')
+        self.data = np.ascontiguousarray(data)
+        self.names = tuple(names)
+
+    @classmethod
+    def from_ome(cls, im, names=NAMES):
+        """
+        Builds the container from an ome.tiff image with the channels in
+        the last axis, transposing it once into a channel-first array.
+        """
+        if np.ndim(im) != 3:
+            raise RuntimeError('provided image must be a single image')
+        return cls(np.moveaxis(im, -1, 0), names)
+
+    @classmethod
+    def from_files(cls, fnames, names=NAMES, mmap=False):
+        """
+        Reads one file per channel into a preallocated channel-first array.
+
+        Parameters
+        ----------
+        fnames : list of str
+            Path to the image of each channel.
+        names : tuple of str
+            Name of each channel.
+        mmap : bool
+            If True, TIFF files are memory-mapped while they are copied.
+            See read_image.
+        """
+        if len(names) != len(fnames):
+            raise ValueError('one name per channel is required')
+        data = None
+        for i, im in enumerate(stream_images(fnames, mmap=mmap)):
+            if data is None:
+                data = np.empty((len(fnames),) + np.shape(im),
+                                dtype=np.asarray(im).dtype)
+            data[i] = im
+        return cls(data, names)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self.names.index(key)
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def shape(self):
+        """Shape (rows, columns) of each channel."""
+        return self.data.shape[1:]
+
+
+def tile_slices(shape, tile_shape, halo=0):
+    """
+    Splits a 2D frame into tiles surrounded by an overlap halo.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Shape of the frame.
+    tile_shape : tuple of int
+        Shape of the tiles without the halo. Tiles at the bottom and right
+        edges of the frame may be smaller.
+    halo : int
+        Number of pixels added on each side of the tiles, clipped at the
+        edges of the frame.
+
+    Yields
+    ------
+    ext : tuple of slices
+        Tile including the halo, in frame coordinates.
+    core : tuple of slices
+        Tile without the halo, in frame coordinates.
+    local : tuple of slices
+        Tile without the halo, in coordinates of the extended tile.
+    """
+    for r0 in range(0, shape[0], tile_shape[0]):
+        for c0 in range(0, shape[1], tile_shape[1]):
+            r1 = min(r0 + tile_shape[0], shape[0])
+            c1 = min(c0 + tile_shape[1], shape[1])
+            e_r0, e_c0 = max(r0 - halo, 0), max(c0 - halo, 0)
+            ext = (slice(e_r0, min(r1 + halo, shape[0])),
+                   slice(e_c0, min(c1 + halo, shape[1])))
+            core = (slice(r0, r1), slice(c0, c1))
+            local = (slice(r0 - e_r0, r1 - e_r0), slice(c0 - e_c0, c1 - e_c0))
+            yield ext, core, local
 
 
 def generate_flatfield(im, im_dark, im_field, median_filt=True):
@@ -115,6 +361,123 @@ def generate_flatfield(im, im_dark, im_field, median_filt=True):
     return im_flat
 
 
+class FlatField(object):
+    """
+    Flat-field correction operator built once from the average dark and
+    illumination images of a date. The correction
+
+        im_flat = ((im - im_dark) / (im_field - im_dark)) *
+                   mean(im_field - im_dark)
+
+    is precomputed as a float32 gain map, so correcting an image reduces
+    to a subtraction and a multiplication that can be written into a
+    caller-provided buffer.
+
+    Parameters
+    ----------
+    im_dark : 2d-array
+        Average image of camera shot noise (no illumination).
+    im_field: 2d-array
+        Average image of fluorescence illumination.
+    median_filt : bool
+        If True, images will be median filtered with a 3x3 square
+        structural element before the correction.
+
+    Raises
+    ------
+    RuntimeError
+        Thrown if bright image and dark image are approximately equal. This
+        will result in a division by zero.
+    """
+    def __init__(self, im_dark, im_field, median_filt=True):
+        # Ensure that the same image is not being provided as the bright
+        # and dark.
+        if np.isclose(im_field, im_dark).all():
+            raise RuntimeError('im_bright and im_dark are approximately '
+                               'equal.')
+        diff = np.asarray(im_field, dtype=float) - im_dark
+        with np.errstate(divide='ignore'):
+            self.gain = (np.mean(diff) / diff).astype(np.float32)
+        self.dark = np.asarray(im_dark, dtype=np.float32)
+        self.median_filt = median_filt
+        self.selem = skimage.morphology.square(3)
+
+    def __call__(self, im, out=None):
+        """
+        Corrects the illumination of an image.
+
+        Parameters
+        ----------
+        im : 2d-array
+            Image to be flattened.
+        out : 2d-array or None
+            float32 array where to write the result. It can be im itself
+            if im is float32. If None a new array is allocated.
+
+        Returns
+        -------
+        im_flat : 2d-array
+            Image corrected for uneven fluorescence illumination.
+        """
+        if out is None:
+            out = np.empty(self.gain.shape, dtype=np.float32)
+        if self.median_filt is True:
+            if np.shares_memory(im, out):
+                im = np.copy(im)
+            scipy.ndimage.median_filter(im, footprint=self.selem, output=out)
+            out -= self.dark
+        else:
+            np.subtract(im, self.dark, out=out)
+        out *= self.gain
+
+        return out
+
+    def tiled(self, im, tile_shape=(1024, 1024), out=None, n_jobs=1):
+        """
+        Corrects the illumination of an image tile by tile, so that only
+        tile-sized temporaries are allocated. The tiles overlap by the
+        radius of the median filter and the result is identical to the
+        correction of the whole frame.
+
+        Parameters
+        ----------
+        im : 2d-array
+            Image to be flattened. It can be a memory-mapped image.
+        tile_shape : tuple of int
+            Shape of the tiles.
+        out : 2d-array or None
+            float32 array where to write the result, e.g. a numpy.memmap.
+            If None a new array is allocated.
+        n_jobs : int
+            Number of threads processing tiles.
+
+        Returns
+        -------
+        im_flat : 2d-array
+            Image corrected for uneven fluorescence illumination.
+        """
+        from joblib import Parallel, delayed
+
+        if out is None:
+            out = np.empty(self.gain.shape, dtype=np.float32)
+        halo = 1 if self.median_filt is True else 0
+
+        def correct(ext, core, local):
+            if self.median_filt is True:
+                tile = scipy.ndimage.median_filter(
+                    im[ext], footprint=self.selem, output=np.float32)[local]
+            else:
+                tile = im[core]
+            np.subtract(tile, self.dark[core], out=out[core])
+            out[core] *= self.gain[core]
+
+        Parallel(n_jobs=n_jobs, prefer='threads')(
+            delayed(correct)(*s) for s in tile_slices(np.shape(im),
+                                                      tile_shape, halo))
+
+        return out
+
+
 # SEGMENTATION                    
 
 def find_zero_crossings(im, selem, thresh):
@@ -145,7 +508,8 @@ def find_zero_crossings(im, selem, thresh):
 
 
 def log_segmentation(im, selem='default', thresh=0.0001, radius=2.0,
-                     median_filt=True, clear_border=True, label=False):
+                     median_filt=True, clear_border=True, label=False,
+                     tile_shape=None, n_jobs=1):
     """
     This function computes the Laplacian of a gaussian filtered image and
     detects object edges as regions which cross zero in the derivative.
@@ -171,6 +535,11 @@ def log_segmentation(im, selem='default', thresh=0.0001, radius=2.0,
         Default is True.
     label : bool
         If True, segmented objecs will be labeled. Default is False.
+    tile_shape : tuple of int or None
+        If given, the image is segmented tile by tile with
+        tiled_segmentation.
+    n_jobs : int
+        Number of threads processing tiles. Only used with tile_shape.
 
     Returns
     -------
@@ -183,6 +552,11 @@ def log_segmentation(im, selem='default', thresh=0.0001, radius=2.0,
     We thank Justin Bois in his help writing this function.
     https://bebi103.caltech.edu
     """
+    if tile_shape is not None:
+        return tiled_segmentation(im, tile_shape, n_jobs=n_jobs, selem=selem,
+                                  thresh=thresh, radius=radius,
+                                  median_filt=median_filt,
+                                  clear_border=clear_border, label=label)
 
     # Test that the provided image is only 2-d.
     if len(np.shape(im)) > 2:
@@ -204,7 +578,7 @@ def log_segmentation(im, selem='default', thresh=0.0001, radius=2.0,
     im_LoG = scipy.ndimage.filters.gaussian_laplace(im_float, radius)
 
     # Define the structural element.
-    if selem == 'default':
+    if isinstance(selem, str):
         selem = skimage.morphology.square(3)
 
     # Using find_zero_crossings, identify the edges of objects.
@@ -229,6 +603,288 @@ def log_segmentation(im, selem='default', thresh=0.0001, radius=2.0,
     return im_final
 
 
+class LogSegmenter(object):
+    """
+    Laplacian of Gaussian segmentation engine computing the same mask as
+    log_segmentation with fewer full-size temporaries. Intermediate images
+    are kept in float32 buffers that are reused between calls with images
+    of the same shape, and the zero crossing detection works on the sign
+    of the LoG image with int8 max/min filters and a Sobel magnitude that
+    is compared squared, skipping the square root. The time spent in each
+    stage is accumulated in the `timings` dictionary.
+
+    Parameters
+    ----------
+    selem : 2d-array, bool or 'default'
+        Structural element for identifying zero crossings. Default value
+        is a 3x3 pixel square.
+    thresh : float
+        Threshold on the Sobel gradient for a zero crossing to be an edge.
+    radius : float
+        Radius for gaussian filter prior to computation of derivatives.
+    median_filt : bool
+        If True, the input image will be median filtered with a 3x3
+        structural element prior to segmentation.
+    clear_border : bool
+        If True, segmented objects touching the border will be removed.
+    label : bool
+        If True, segmented objecs will be labeled.
+
+    Notes
+    -----
+    Working in float32 can flip the sign of LoG values that are zero to
+    within float32 precision, so a few edge pixels may differ from the
+    float64 log_segmentation.
+    """
+    STAGES = ('median', 'log', 'zero_cross', 'sobel', 'skeletonize',
+              'fill_holes', 'small_objects', 'clear_border', 'label')
+
+    def __init__(self, selem='default', thresh=0.0001, radius=2.0,
+                 median_filt=True, clear_border=True, label=False):
+        if isinstance(selem, str):
+            selem = skimage.morphology.square(3)
+        self.selem = selem
+        self.selem_median = skimage.morphology.square(3)
+        self.thresh = thresh
+        self.radius = radius
+        self.median_filt = median_filt
+        self.clear_border = clear_border
+        self.label = label
+        self.buffers = dict()
+        self.reset_timings()
+
+    def get_params(self):
+        """Returns the segmentation parameters as a json-serializable dict."""
+        return dict(selem=np.asarray(self.selem).astype(int).tolist(),
+                    thresh=self.thresh, radius=self.radius,
+                    median_filt=self.median_filt,
+                    clear_border=self.clear_border)
+
+    def reset_timings(self):
+        """Sets the stage timings and the number of calls to zero."""
+        self.timings = dict.fromkeys(self.STAGES, 0.0)
+        self.n_calls = 0
+
+    def timing_summary(self):
+        """
+        Returns a DataFrame with the total and per-image time spent in each
+        stage, sorted from the most to the least expensive.
+        """
+        df = pd.DataFrame({'stage': list(self.timings.keys()),
+                           'total_s': list(self.timings.values())})
+        df['per_image_s'] = df.total_s / max(self.n_calls, 1)
+        df['fraction'] = df.total_s / max(df.total_s.sum(), 1E-12)
+        return df.sort_values('total_s', ascending=False)
+
+    def _workspace(self, shape):
+        # Allocate the buffers for a new image shape
+        if self.buffers.get('shape') != shape:
+            self.buffers = dict(shape=shape,
+                                im=np.empty(shape, dtype=np.float32),
+                                log=np.empty(shape, dtype=np.float32),
+                                grad=np.empty(shape, dtype=np.float32),
+                                tmp=np.empty(shape, dtype=np.float32),
+                                sign=np.empty(shape, dtype=np.int8),
+                                s_max=np.empty(shape, dtype=np.int8),
+                                s_min=np.empty(shape, dtype=np.int8))
+        return self.buffers
+
+    def _tic(self, stage, t0):
+        t1 = time.perf_counter()
+        self.timings[stage] += t1 - t0
+        return t1
+
+    def __call__(self, im):
+        """
+        Segments an image.
+
+        Parameters
+        ----------
+        im :  2d-array
+            Image to be processed. Must be a single channel image.
+
+        Returns
+        -------
+        im_final : 2d-array
+            Final segmentation mask. If label is True, the output will be a
+            integer labeled image. Otherwise the output will be a bool.
+        """
+        # Test that the provided image is only 2-d.
+        if len(np.shape(im)) > 2:
+            raise ValueError('image must be a single channel!')
+        ws = self._workspace(np.shape(im))
+        self.n_calls += 1
+        t0 = time.perf_counter()
+
+        # Median filter straight into the float32 buffer.
+        im_f = ws['im']
+        if self.median_filt is True:
+            scipy.ndimage.median_filter(im, footprint=self.selem_median,
+                                        output=im_f)
+        else:
+            im_f[...] = im
+        # Rescale integer images to [0, 1] as skimage.img_as_float does.
+        if np.issubdtype(np.asarray(im).dtype, np.integer) and \
+                (np.max(im) > 1):
+            im_f *= 1 / np.iinfo(np.asarray(im).dtype).max
+        t0 = self._tic('median', t0)
+
+        # Compute the LoG filter of the image.
+        im_LoG = ws['log']
+        scipy.ndimage.gaussian_laplace(im_f, self.radius, output=im_LoG)
+        t0 = self._tic('log', t0)
+
+        # Zero crossings: a pixel crosses zero if it is non-negative with a
+        # negative neighbor or non-positive with a positive neighbor.
+        sign = ws['sign']
+        np.sign(im_LoG, out=sign, casting='unsafe')
+        scipy.ndimage.maximum_filter(sign, footprint=self.selem,
+                                     output=ws['s_max'])
+        scipy.ndimage.minimum_filter(sign, footprint=self.selem,
+                                     output=ws['s_min'])
+        edges = ((sign >= 0) & (ws['s_min'] < 0)) | \
+            ((sign <= 0) & (ws['s_max'] > 0))
+        t0 = self._tic('zero_cross', t0)
+
+        # Sobel magnitude compared squared against the threshold. The
+        # kernels match skimage.filters.sobel, including the zeroed border.
+        grad, tmp = ws['grad'], ws['tmp']
+        sobel_sq = ws['im']
+        scipy.ndimage.correlate1d(im_LoG, [1, 0, -1], axis=0, output=tmp)
+        scipy.ndimage.correlate1d(tmp, [0.25, 0.5, 0.25], axis=1,
+                                  output=grad)
+        np.multiply(grad, grad, out=sobel_sq)
+        scipy.ndimage.correlate1d(im_LoG, [1, 0, -1], axis=1, output=tmp)
+        scipy.ndimage.correlate1d(tmp, [0.25, 0.5, 0.25], axis=0,
+                                  output=grad)
+        grad *= grad
+        sobel_sq += grad
+        edges &= sobel_sq >= 2 * self.thresh**2
+        edges[[0, -1], :] = False
+        edges[:, [0, -1]] = False
+        t0 = self._tic('sobel', t0)
+
+        # Skeletonize the edges to a line with a single pixel width.
+        skel_im = skimage.morphology.skeletonize(edges)
+        t0 = self._tic('skeletonize', t0)
+
+        # Fill the holes to generate binary image.
+        im_final = scipy.ndimage.binary_fill_holes(skel_im)
+        t0 = self._tic('fill_holes', t0)
+
+        # Remove small objects and objects touching border.
+        im_final = skimage.morphology.remove_small_objects(im_final)
+        t0 = self._tic('small_objects', t0)
+        if self.clear_border is True:
+            im_final = skimage.segmentation.clear_border(im_final,
+                                                         buffer_size=5)
+        t0 = self._tic('clear_border', t0)
+
+        # Determine if the objects should be labeled.
+        if self.label is True:
+            im_final = skimage.measure.label(im_final)
+        self._tic('label', t0)
+
+        return im_final
+
+
+def tiled_segmentation(im, tile_shape=(1024, 1024), max_size=64, n_jobs=1,
+                       clear_border=True, label=False, **kwargs):
+    """
+    Segments an image tile by tile with LogSegmenter, such that the float
+    temporaries have the size of a tile rather than of the whole frame.
+    Each tile is segmented together with a halo that covers the footprint
+    of the median, LoG, zero crossing and Sobel filters plus max_size
+    pixels. Objects that touch the inner edges of an extended tile are
+    discarded, since they are segmented whole by the tile that contains
+    them, and the pieces of the objects that cross tile borders are
+    stitched when the tiles are written into the final mask.
+
+    Parameters
+    ----------
+    im : 2d-array
+        Image to be processed. It can be a memory-mapped image.
+    tile_shape : tuple of int
+        Shape of the tiles without the halo.
+    max_size : int
+        Largest extent in pixels of the objects to be segmented. Objects
+        larger than this may be lost at tile borders.
+    n_jobs : int
+        Number of threads processing tiles.
+    clear_border : bool
+        If True, segmented objects touching the border will be removed.
+    label : bool
+        If True, segmented objecs will be labeled.
+    kwargs : dict
+        Arguments passed to LogSegmenter (selem, thresh, radius and
+        median_filt).
+
+    Returns
+    -------
+    im_final : 2d-array
+        Final segmentation mask. If label is True, the output will be a
+        integer labeled image. Otherwise the output will be a bool.
+    """
+    from joblib import Parallel, delayed
+
+    # Test that the provided image is only 2-d.
+    if len(np.shape(im)) > 2:
+        raise ValueError('image must be a single channel!')
+    shape = np.shape(im)
+    # One segmentation engine per thread, so that the buffers are reused
+    # by all of the tiles processed by the same thread.
+    engines = threading.local()
+    engines.seg = LogSegmenter(clear_border=False, label=False, **kwargs)
+    seg = engines.seg
+    # Rescale integer images from the maximum of the whole frame.
+    scale = 1.0
+    if np.issubdtype(im.dtype, np.integer) and (np.max(im) > 1):
+        scale = 1 / np.iinfo(im.dtype).max
+    # Halo covering the filters and the objects
+    halo = 1 + int(4 * seg.radius + 0.5) + max(np.shape(seg.selem)) // 2 + \
+        1 + max_size
+
+    def segment(ext, core, local):
+        tile = np.asarray(im[ext], dtype=np.float32)
+        if scale != 1:
+            tile *= scale
+        if not hasattr(engines, 'seg'):
+            engines.seg = LogSegmenter(clear_border=False, label=False,
+                                       **kwargs)
+        mask = engines.seg(tile)
+        # Discard objects touching inner edges of the extended tile.
+        tile_lab = skimage.measure.label(mask)
+        edges = []
+        if ext[0].start > 0:
+            edges.append(tile_lab[:2, :])
+        if ext[0].stop < shape[0]:
+            edges.append(tile_lab[-2:, :])
+        if ext[1].start > 0:
+            edges.append(tile_lab[:, :2].T)
+        if ext[1].stop < shape[1]:
+            edges.append(tile_lab[:, -2:].T)
+        if len(edges) > 0:
+            cut = np.unique(np.concatenate(edges, axis=1))
+            mask[np.isin(tile_lab, cut[cut > 0])] = False
+        return core, mask[local]
+
+    im_final = np.zeros(shape, dtype=bool)
+    for core, mask in Parallel(n_jobs=n_jobs, prefer='threads')(
+            delayed(segment)(*s) for s in tile_slices(shape, tile_shape,
+                                                      halo)):
+        im_final[core] = mask
+
+    # Remove objects touching border.
+    if clear_border is True:
+        im_final = skimage.segmentation.clear_border(im_final, buffer_size=5)
+
+    # Determine if the objects should be labeled.
+    if label is True:
+        im_final = skimage.measure.label(im_final)
+
+    return im_final
+
+
 def example_segmentation(mask, im, bar_length, bounds=True):
     """
     Generates and example segmentation with segmentation mask shown in red over
@@ -267,10 +923,14 @@ def example_segmentation(mask, im, bar_length, bounds=True):
     return np.dstack((im_copy, im, im))
 
 
-def props_to_df(mask, physical_distance=1, intensity_image=None):
+def measure_regions(mask, physical_distance=1, intensity_image=None,
+                    solidity=True, tile_shape=None):
     """
-    Converts the output of skimage.measure.regionprops to a nicely
-    formatted pandas DataFrame.
+    Measures all of the objects of a labeled mask at once. Areas, intensities
+    and the second moments that define the eccentricity are computed for all
+    labels in a single pass with np.bincount. Only the solidity requires the
+    convex hull of each object, which is computed on the bounding box of
+    each object.
 
     Parameters
     ----------
@@ -282,41 +942,624 @@ def props_to_df(mask, physical_distance=1, intensity_image=None):
     intensity_image : 2d-array
         Intensity image for intensity based measurements. If none is
         provided, only region based measurements will be returned.
+    solidity : bool
+        If False, the solidity is not computed.
+    tile_shape : tuple of int or None
+        If given, the sums are accumulated tile by tile, so that only
+        tile-sized temporaries are allocated. Objects crossing tile borders
+        are measured as a whole.
 
     Returns
     -------
-    df : pandas DataFrame
-        Tidy DataFrame containing all measurements.
+    props : dict of 1d-arrays
+        Columnar measurements, one entry per object sorted by label, with
+        keys 'label', 'area', 'eccentricity', 'solidity' and, if an
+        intensity image is given, 'mean_intensity' and
+        'integrated_intensity' (the sum of the pixel intensities).
 
+    Raises
+    ------
+    ValueError
+        Thrown if the mask has no objects.
     """
-
+    # A boolean mask is a single object with label 1
+    if np.asarray(mask).dtype == bool:
+        mask = np.asarray(mask, dtype=np.uint8)
     # Ensure that there is at least one object in the image.
-    if np.max(mask) == 0:
+    n_lab = int(np.max(mask)) + 1
+    if n_lab == 1:
         raise ValueError('no objects found in image.')
+    if tile_shape is None:
+        tile_shape = np.shape(mask)
+
+    # Pixel coordinates are taken from the corner of the bounding box of
+    # each object to keep the second moments accurate in large frames.
+    slices = scipy.ndimage.find_objects(mask)
+    corner = np.zeros((n_lab, 2))
+    for l, sl in enumerate(slices, 1):
+        if sl is not None:
+            corner[l] = sl[0].start, sl[1].start
+
+    # Zeroth, first and second raw moments of each label
+    sums = np.zeros((7, n_lab))
+    for _, core, _ in tile_slices(np.shape(mask), tile_shape):
+        # List labels and coordinates of the object pixels only
+        tile = np.asarray(mask[core])
+        fg = np.flatnonzero(tile)
+        lab = tile.ravel()[fg]
+        row, col = np.divmod(fg, tile.shape[1])
+        row = row + (core[0].start - corner[lab, 0])
+        col = col + (core[1].start - corner[lab, 1])
+        sums[0] += np.bincount(lab, minlength=n_lab)
+        sums[1] += np.bincount(lab, row, n_lab)
+        sums[2] += np.bincount(lab, col, n_lab)
+        sums[3] += np.bincount(lab, row * row, n_lab)
+        sums[4] += np.bincount(lab, col * col, n_lab)
+        sums[5] += np.bincount(lab, row * col, n_lab)
+        if intensity_image is not None:
+            sums[6] += np.bincount(
+                lab, np.ravel(np.asarray(intensity_image[core]))[fg], n_lab)
+    labels = np.nonzero(sums[0])[0]
+    area, m_r, m_c, m_rr, m_cc, m_rc, intensity = sums[:, labels]
+
+    # Covariance of the pixel coordinates and its eigenvalues
+    mu_r, mu_c = m_r / area, m_c / area
+    cov_rr = m_rr / area - mu_r**2
+    cov_cc = m_cc / area - mu_c**2
+    cov_rc = m_rc / area - mu_r * mu_c
+    half_tr = (cov_rr + cov_cc) / 2
+    root = np.sqrt(np.maximum(((cov_rr - cov_cc) / 2)**2 + cov_rc**2, 0))
+    l1, l2 = half_tr + root, np.maximum(half_tr - root, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eccentricity = np.where(l1 > 0, np.sqrt(1 - l2 / l1), 0)
 
+    props = dict(label=labels,
+                 area=area * physical_distance**2,
+                 eccentricity=eccentricity)
+
+    # Solidity as the ratio between the area and the convex hull area
+    if solidity is True:
+        area_convex = np.array([
+            skimage.morphology.convex_hull_image(mask[slices[l - 1]] == l)
+            .sum() for l in labels], dtype=float)
+        props['solidity'] = area / area_convex
+
+    if intensity_image is not None:
+        props['integrated_intensity'] = intensity
+        props['mean_intensity'] = intensity / area
+
+    return props
+
+
+def props_to_df(mask, physical_distance=1, intensity_image=None,
+                tile_shape=None):
+    """
+    Measures the objects of a segmentation mask and returns the
+    measurements as a nicely formatted pandas DataFrame. See
+    measure_regions.
+
+    Parameters
+    ----------
+    mask : 2d-array, int
+        Segmentation mask containing objects to be measured.
+    physical_distance : int or float
+        Interpixel distance of the image. This will be used to
+        convert the area measurements to meaningful units.
+    intensity_image : 2d-array
+        Intensity image for intensity based measurements. If none is
+        provided, only region based measurements will be returned.
+    tile_shape : tuple of int or None
+        If given, the measurements are accumulated tile by tile.
+
+    Returns
+    -------
+    df : pandas DataFrame
+        Tidy DataFrame containing all measurements.
+
+    """
     # Define the values that are to be extracted.
     REGIONPROPS = ('area', 'eccentricity', 'solidity',
                    'mean_intensity')
 
     if intensity_image is None:
-        measurements = REGIONPROPS[:-3]
+        measurements = REGIONPROPS[:-1]
     else:
         measurements = REGIONPROPS
 
-    # Iterate through and extract the props.
-    props = skimage.measure.regionprops(mask,
-                                        intensity_image=intensity_image,
-                                        coordinates='xy')
-    for i, p in enumerate(props):
-        extracted = []
-        for val in measurements:
-            extracted.append(p[val])
-
-        if i == 0:
-            df = pd.DataFrame(extracted).T
+    props = measure_regions(mask, physical_distance, intensity_image,
+                            tile_shape=tile_shape)
+
+    return pd.DataFrame({val: props[val] for val in measurements})
+
+
+# PIPELINE
+def background_files(data_dir):
+    """
+    Lists the camera noise and illumination profile images of a date. The
+    images are either stored directly in the `*YFP_profile*` and `*noise*`
+    directories or in one subdirectory per position.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory containing the raw images of the date.
+
+    Returns
+    -------
+    noise_glob, field_glob : list of str
+        Sorted paths of the noise and profile images.
+    """
+    # Glob the profile and noise images of both layouts.
+    field_glob = sorted(
+        glob.glob(os.path.join(data_dir, '*YFP_profile*/*.tif')) +
+        glob.glob(os.path.join(data_dir, '*YFP_profile*/*/*.tif')))
+    noise_glob = sorted(
+        glob.glob(os.path.join(data_dir, '*noise*/*.tif')) +
+        glob.glob(os.path.join(data_dir, '*noise*/*/*.tif')))
+    if (len(field_glob) == 0) or (len(noise_glob) == 0):
+        raise ValueError('no profile or noise images found in ' + data_dir)
+
+    return noise_glob, field_glob
+
+
+def background_images(data_dir, median_filt=False, n_threads=1):
+    """
+    Computes the average illumination profile and camera noise images of a
+    date from the `*YFP_profile*` and `*noise*` directories.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory containing the raw images of the date.
+    median_filt : bool
+        If True, each image will be median filtered before averaging. See
+        average_stack.
+    n_threads : int
+        Number of threads used to median filter the images.
+
+    Returns
+    -------
+    im_noise : 2d-array
+        Average image of camera noise (no illumination).
+    im_field : 2d-array
+        Average image of the fluorescence illumination.
+    """
+    noise_glob, field_glob = background_files(data_dir)
+
+    # Average the stacks streaming one frame at a time
+    im_field = average_stack(stream_images(field_glob, mmap=True),
+                             median_filt=median_filt, n_threads=n_threads)
+    im_noise = average_stack(stream_images(noise_glob, mmap=True),
+                             median_filt=median_filt, n_threads=n_threads)
+
+    return im_noise, im_field
+
+
+def date_positions(data_dir, metadata):
+    """
+    Lists the positions of every strain and inducer concentration of a
+    date. Each position is either a single multichannel `.ome.tif` file or
+    a `Pos*` directory with one image per channel. As in the original
+    `processing.py` scripts, the `Pos*` directories are only used for the
+    conditions without `.ome.tif` files.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory containing the raw images of the date.
+    metadata : dict or module
+        Metadata of the date as defined in each `metadata.py` with at least
+        STRAINS, REPRESSORS, IPTG_NAMES and IPTG_DICT.
+
+    Returns
+    -------
+    positions : list of dict
+        One entry per position with keys 'pos_dir' (path to the `.ome.tif`
+        file or to the `Pos*` directory), 'rbs', 'repressors' and
+        'IPTG_uM'.
+    """
+    if not isinstance(metadata, dict):
+        metadata = vars(metadata)
+
+    positions = []
+    for st, rep in zip(metadata['STRAINS'], metadata['REPRESSORS']):
+        for name in metadata['IPTG_NAMES']:
+            # List the ome.tiff files, or the position directories if
+            # there are none
+            pos = sorted(glob.glob(os.path.join(
+                data_dir, '*' + st + '*_' + name + 'uMIPTG*', '*.ome.tif')))
+            if len(pos) == 0:
+                pos = sorted(glob.glob(os.path.join(
+                    data_dir, '*' + st + '*_' + name + 'uMIPTG*', 'Pos*')))
+            positions += [dict(pos_dir=x, rbs=st, repressors=rep,
+                               IPTG_uM=metadata['IPTG_DICT'][name])
+                          for x in pos]
+
+    return positions
+
+
+def process_position(pos_dir, flatfield, ipdist=0.160,
+                     seg_kwargs=None, tile_shape=None, segmenter=None):
+    """
+    Segments and measures the cells of a single position. The position is
+    either an `.ome.tif` file with the BF, mCherry and YFP channels in its
+    last axis or a directory that contains the 1) BF, 2) TRITC and 3) YFP
+    images, which sort in this order by name. Cells are segmented in the
+    mCherry (TRITC) channel and their intensity is measured in the
+    flat-field corrected YFP channel.
+
+    Parameters
+    ----------
+    pos_dir : str
+        Path to the `.ome.tif` file or directory of the position.
+    flatfield : FlatField
+        Flat-field correction operator of the date.
+    ipdist : float
+        Interpixel distance in µm.
+    seg_kwargs : dict or None
+        Extra arguments passed to LogSegmenter.
+    tile_shape : tuple of int or None
+        If given, the flat-field correction, segmentation and measurements
+        are performed tile by tile to bound the memory used by large
+        frames. See tiled_segmentation.
+    segmenter : LogSegmenter or None
+        Segmentation engine with label=True, reused between positions to
+        keep its buffers. If None one is built from seg_kwargs.
+
+    Returns
+    -------
+    df : pandas DataFrame or None
+        Measurements of each segmented object. None if no objects were
+        found.
+    """
+    if seg_kwargs is None:
+        seg_kwargs = dict()
+    if os.path.isfile(pos_dir):
+        # Single ome.tiff file with the channels in the last axis
+        im = MultiChannelImage.from_ome(read_image(pos_dir, mmap=True))
+        m, y = im['mCherry'], im['YFP']
+    else:
+        # List all images with 1) BF, 2) TRITC, 3) YFP
+        images = np.sort(glob.glob(os.path.join(pos_dir, '*tif')))
+        if tile_shape is None:
+            im = MultiChannelImage.from_files(images[1:3],
+                                              names=('mCherry', 'YFP'),
+                                              mmap=True)
+            m, y = im['mCherry'], im['YFP']
+        else:
+            # Tiles are read straight from the memory-mapped files
+            m = read_image(images[1], mmap=True)
+            y = read_image(images[2], mmap=True)
+
+    if tile_shape is None:
+        y_flat = flatfield(y)
+        # Segment the mCherry channel.
+        if segmenter is None:
+            segmenter = LogSegmenter(label=True, **seg_kwargs)
+        m_seg = segmenter(m)
+    else:
+        y_flat = flatfield.tiled(y, tile_shape)
+        m_seg = tiled_segmentation(m, tile_shape, label=True, **seg_kwargs)
+
+    # Extract the measurements.
+    try:
+        return props_to_df(m_seg, physical_distance=ipdist,
+                           intensity_image=y_flat, tile_shape=tile_shape)
+    except ValueError:
+        return None
+
+
+def process_positions(pos_dirs, flatfield, ipdist=0.160, seg_kwargs=None,
+                      tile_shape=None):
+    """
+    Processes a batch of positions with process_position sharing a single
+    LogSegmenter, so that its buffers are allocated once per batch.
+
+    Parameters
+    ----------
+    pos_dirs : list of str
+        Paths to the `.ome.tif` files or directories of the positions.
+    flatfield, ipdist, seg_kwargs, tile_shape :
+        See process_position.
+
+    Returns
+    -------
+    dfs : list of pandas DataFrame or None
+        Measurements of each position.
+    """
+    if seg_kwargs is None:
+        seg_kwargs = dict()
+    segmenter = LogSegmenter(label=True, **seg_kwargs)
+    return [process_position(pos_dir, flatfield, ipdist, seg_kwargs,
+                             tile_shape, segmenter)
+            for pos_dir in pos_dirs]
+
+
+def process_date(metadata, data_dir, im_noise=None, im_field=None,
+                 n_jobs=-1, seg_kwargs=None, cache_dir=None,
+                 tile_shape=None):
+    """
+    Runs the image processing of a whole date, replacing the loop over
+    strains, concentrations and positions of each `processing.py`. The
+    positions are processed in parallel and the measurements are
+    concatenated in the same order in which the positions are listed, so
+    the result does not depend on the number of processes.
+
+    If a cache directory is given, the measurements of each position are
+    saved as a shard named after the hash of the position images, the
+    background images, the processing parameters with their defaults
+    resolved and CACHE_VERSION (see position_key). Positions with a valid
+    shard are not processed again.
+
+    Parameters
+    ----------
+    metadata : dict or module
+        Metadata of the date as defined in each `metadata.py`.
+    data_dir : str
+        Directory containing the raw images of the date.
+    im_noise, im_field : 2d-array or None
+        Average camera noise and illumination profile images. If None they
+        are computed with background_images.
+    n_jobs : int
+        Number of processes. -1 uses all of the cores.
+    seg_kwargs : dict or None
+        Extra arguments passed to LogSegmenter.
+    cache_dir : str or None
+        Directory where to save the measurement shards.
+    tile_shape : tuple of int or None
+        If given, positions are processed tile by tile. See
+        process_position.
+
+    Returns
+    -------
+    df_im : pandas DataFrame
+        Measurements of all of the segmented objects with the date
+        information.
+    """
+    from joblib import Parallel, delayed, effective_n_jobs
+
+    if not isinstance(metadata, dict):
+        metadata = vars(metadata)
+    if seg_kwargs is None:
+        seg_kwargs = dict()
+    positions = date_positions(data_dir, metadata)
+
+    # Find the positions that need to be processed
+    if cache_dir is None:
+        todo = list(range(len(positions)))
+    else:
+        os.makedirs(cache_dir, exist_ok=True)
+        stat_file = os.path.join(cache_dir, 'file_hashes.json')
+        stat_cache = read_json(stat_file)
+        # Key of the background images
+        if (im_noise is None) or (im_field is None):
+            background = [file_digest(f, stat_cache)
+                          for f in sum(background_files(data_dir), [])]
         else:
-            df2 = pd.DataFrame(extracted).T
-            df = df.append(df2)
-    df.columns = measurements
-    df['area'] = df['area'] * physical_distance**2
-    return df
+            background = [hashlib.sha1(np.ascontiguousarray(x)).hexdigest()
+                          for x in (im_noise, im_field)]
+        # Resolve the segmentation defaults so that changing them also
+        # changes the key
+        params = dict(version=CACHE_VERSION, background=background,
+                      ipdist=metadata['IPDIST'],
+                      segmentation=LogSegmenter(**seg_kwargs).get_params(),
+                      tile_shape=tile_shape)
+        shards = [os.path.join(cache_dir, position_key(
+            p['pos_dir'], params, stat_cache) + '.pkl') for p in positions]
+        write_json(stat_file, stat_cache)
+        todo = [i for i, f in enumerate(shards) if not os.path.exists(f)]
+
+    # Process positions
+    dfs = [None] * len(positions)
+    if len(todo) > 0:
+        if (im_noise is None) or (im_field is None):
+            im_noise, im_field = background_images(data_dir)
+        flatfield = FlatField(im_noise, im_field)
+        # Split the positions into one batch per process
+        batches = np.array_split(np.array(todo),
+                                 min(effective_n_jobs(n_jobs), len(todo)))
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(process_positions)(
+                [positions[i]['pos_dir'] for i in batch], flatfield,
+                metadata['IPDIST'], seg_kwargs, tile_shape)
+            for batch in batches)
+        results = [df for batch in results for df in batch]
+        for i, df in zip(todo, results):
+            dfs[i] = df
+            if cache_dir is not None:
+                # Positions without objects are saved as None
+                pd.to_pickle(df, shards[i] + '.{:d}.tmp'.format(os.getpid()))
+                os.replace(shards[i] + '.{:d}.tmp'.format(os.getpid()),
+                           shards[i])
+    # Read the valid shards
+    if cache_dir is not None:
+        for i in set(range(len(positions))) - set(todo):
+            dfs[i] = pd.read_pickle(shards[i])
+
+    # Add strain and IPTG concentration information.
+    df_list = []
+    for p, df in zip(positions, dfs):
+        if df is None:
+            continue
+        df.insert(0, 'IPTG_uM', p['IPTG_uM'])
+        df.insert(0, 'repressors', p['repressors'])
+        df.insert(0, 'rbs', p['rbs'])
+        df_list.append(df)
+    if len(df_list) == 0:
+        raise ValueError('no objects found in ' + data_dir)
+    df_im = pd.concat(df_list, axis=0, ignore_index=True)
+
+    # Add date information.
+    df_im.insert(0, 'binding_energy', metadata['BINDING_ENERGY'])
+    df_im.insert(0, 'operator', metadata['OPERATOR'])
+    df_im.insert(0, 'username', metadata['USERNAME'])
+    df_im.insert(0, 'date', metadata['DATE'])
+
+    return df_im
+
+
+def qc_fold_change(df_im, strain, area_bounds=(0.5, 6.0),
+                   min_eccentricity=0.8):
+    """
+    Applies the quality control gates of each `analysis.py` to the
+    measurements of a date and computes the fold-change of the experimental
+    strain. The mean intensity of every strain and concentration is
+    computed with a single grouped aggregation and the fold-change
+
+        fold_change = (<I_exp> - <I_auto>) / (<I_delta> - <I_auto>)
+
+    is evaluated for every concentration of the experimental strain using
+    the auto and delta means of every concentration at which both were
+    measured.
+
+    Parameters
+    ----------
+    df_im : pandas DataFrame
+        Measurements of the date as returned by process_date.
+    strain : str
+        Name of the experimental strain in the `rbs` column.
+    area_bounds : tuple of float
+        Lower and upper bounds on the cell area in µm**2.
+    min_eccentricity : float
+        Lower bound on the cell eccentricity.
+
+    Returns
+    -------
+    df_filt : pandas DataFrame
+        Measurements that passed the gates with an extra `intensity` column
+        with the integrated intensity (area * mean_intensity).
+    df_fc : pandas DataFrame
+        Fold-change of the experimental strain with columns `IPTG`,
+        `fold_change`, `auto_IPTG` (concentration of the auto and delta
+        strains used), `mean_intensity`, `mean_auto`, `mean_delta` and
+        `n_cells`.
+    """
+    # Apply the area and eccentricity bounds.
+    df_filt = df_im[(df_im.area > area_bounds[0]) &
+                    (df_im.area < area_bounds[1]) &
+                    (df_im.eccentricity > min_eccentricity)].copy()
+    # Add column of absolute intensity
+    df_filt['intensity'] = df_filt.area * df_filt.mean_intensity
+
+    # Mean intensity and number of cells per strain and concentration
+    df_mean = df_filt.groupby(['rbs', 'IPTG_uM']).intensity.agg(
+        ['mean', 'count'])
+    auto = df_mean.loc['auto', 'mean'] if 'auto' in df_mean.index else \
+        pd.Series(dtype=float)
+    delta = df_mean.loc['delta', 'mean'] if 'delta' in df_mean.index else \
+        pd.Series(dtype=float)
+    exp = df_mean.loc[strain] if strain in df_mean.index else \
+        pd.DataFrame(columns=['mean', 'count'])
+    # Concentrations at which auto and delta were measured
+    ref = np.intersect1d(auto.index, delta.index)
+
+    # Combine every reference concentration with every experimental one
+    n_exp = len(exp)
+    mean_auto = np.repeat(auto[ref].values, n_exp)
+    mean_delta = np.repeat(delta[ref].values, n_exp)
+    mean_exp = np.tile(exp['mean'].values.astype(float), len(ref))
+    df_fc = pd.DataFrame(dict(
+        IPTG=np.tile(exp.index.values, len(ref)),
+        fold_change=(mean_exp - mean_auto) / (mean_delta - mean_auto),
+        auto_IPTG=np.repeat(ref, n_exp),
+        mean_intensity=mean_exp,
+        mean_auto=mean_auto,
+        mean_delta=mean_delta,
+        n_cells=np.tile(exp['count'].values.astype(int), len(ref))))
+
+    return df_filt, df_fc
+
+
+# INCREMENTAL PROCESSING
+# Version of the cached measurements. Increase it whenever a change to the
+# segmentation or measurement code changes the results, so that the shards
+# computed with the previous code are not reused.
+CACHE_VERSION = 1
+
+
+def read_json(fname):
+    """Reads a json file returning an empty dictionary if it is missing."""
+    if not os.path.exists(fname):
+        return dict()
+    with open(fname, 'r') as file:
+        return json.load(file)
+
+
+def write_json(fname, obj):
+    """
+    Writes a json file through a temporary file such that parallel
+    readers never find a partially written file.
+    """
+    tmp_file = '{}.{:d}.tmp'.format(fname, os.getpid())
+    with open(tmp_file, 'w') as file:
+        json.dump(obj, file)
+    os.replace(tmp_file, fname)
+
+
+def file_digest(fname, stat_cache=None, chunk=2**20):
+    """
+    Returns the sha1 hash of the contents of a file.
+
+    Parameters
+    ----------
+    fname : str
+        Path to the file.
+    stat_cache : dict or None
+        Dictionary mapping absolute paths to the [size, modification time,
+        hash] of the files hashed before. Files whose size and modification
+        time did not change are not read again. The dictionary is updated
+        with the new hashes.
+    chunk : int
+        Number of bytes read at a time.
+
+    Returns
+    -------
+    digest : str
+        Hexadecimal sha1 hash.
+    """
+    fname = os.path.abspath(fname)
+    stat = os.stat(fname)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    if (stat_cache is not None) and (fname in stat_cache) and \
+            (stat_cache[fname][:2] == stamp):
+        return stat_cache[fname][2]
+
+    sha = hashlib.sha1()
+    with open(fname, 'rb') as file:
+        for block in iter(lambda: file.read(chunk), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+    if stat_cache is not None:
+        stat_cache[fname] = stamp + [digest]
+
+    return digest
+
+
+def position_key(pos_dir, params, stat_cache=None):
+    """
+    Returns a hash that identifies the measurements of a position, combining
+    the name and contents of its images with the processing parameters.
+
+    Parameters
+    ----------
+    pos_dir : str
+        Path to the `.ome.tif` file or directory of the position.
+    params : dict
+        json-serializable processing parameters.
+    stat_cache : dict or None
+        Cache of file hashes. See file_digest.
+
+    Returns
+    -------
+    key : str
+        Hexadecimal sha1 hash.
+    """
+    if os.path.isfile(pos_dir):
+        images = [pos_dir]
+    else:
+        images = sorted(glob.glob(os.path.join(pos_dir, '*tif')))
+    spec = dict(params=params,
+                images=[(os.path.basename(f), file_digest(f, stat_cache))
+                        for f in images])
+    return hashlib.sha1(json.dumps(spec, sort_keys=True,
+                                   default=str).encode()).hexdigest()
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+"""
+Title:
+    mcmc.py
+Last update:
+    2026-10-19
+Author(s):
+    Manuel Razo-Mejia
+Purpose:
+    This file compiles the functions used for the Bayesian inference of the
+    kinetic parameters of the constitutive promoter from mRNA FISH data. The
+    likelihood evaluates the steady state mRNA distribution once per unique
+    mRNA count for all of the walkers of the ensemble sampler at once. The
+    chains are stored in a memory-mappable binary format with a small
+    header holding the MAP and HPD summary.
+"""
+
+import os
+import json
+import pickle
+import numpy as np
+import scipy.special
+
+from . import model
+from . import stats
+
+
+# LIKELIHOOD
+class mRNALikelihood(object):
+    '''
+    Log likelihood of single-cell mRNA counts under the two-state
+    unregulated promoter model
+    ln L = ∑_m n(m) ln P(m | kp_on, kp_off, rm)
+    where n(m) is the number of cells with m mRNA. The histogram of counts
+    is computed once, so the cost of each evaluation scales with the
+    largest count rather than with the number of cells. The confluent
+    hypergeometric function is evaluated with a recurrence over all counts
+    and all walkers at once (see model.log_hyp1f1_recurrence).
+
+    Instances are plain picklable objects, so they can be handed to
+    emcee.EnsembleSampler with threads or a multiprocessing pool.
+
+    Parameters
+    ----------
+    mRNA : array-like or list of array-like.
+        mRNA counts of each cell. A list gives several data sets that share
+        the kinetic parameters, e.g. small and large cells.
+    rm_scale : float or array-like. Default = 1
+        Factor multiplying the mRNA production rate for each data set, e.g.
+        (1, 2) for cells with one and two copies of the gene.
+    gm : float. Default = 1
+        mRNA degradation rate. The inferred rates are in units of gm.
+    check : bool. Default = False
+        If True every evaluation compares the recurrence with mpmath at a
+        few anchor points. This is slow and meant for debugging.
+    '''
+    def __init__(self, mRNA, rm_scale=1, gm=1, check=False):
+        if not isinstance(mRNA, (list, tuple)) or np.ndim(mRNA[0]) == 0:
+            mRNA = [mRNA]
+        self.rm_scale = np.broadcast_to(rm_scale, len(mRNA)).astype(float)
+        self.gm = gm
+        self.check = check
+        # Histogram of the counts of each data set
+        self.counts = [np.bincount(np.asarray(m, dtype=int)) for m in mRNA]
+        # Keep only the counts that appear in the data
+        self.unique = [np.nonzero(c)[0] for c in self.counts]
+        self.counts = [c[u].astype(float)
+                       for c, u in zip(self.counts, self.unique)]
+
+    def __call__(self, params):
+        '''
+        Evaluates the log likelihood.
+
+        Parameters
+        ----------
+        params : array-like. shape = (3,) or (n_walkers, 3)
+            kp_on, kp_off and rm in units of gm.
+
+        Returns
+        -------
+        log_like : float or array-like. shape = (n_walkers,)
+            Log likelihood. Parameters that are not positive return -inf.
+        '''
+        params = np.asarray(params, dtype=float)
+        log_like = self.batch(np.atleast_2d(params))
+        if params.ndim == 1:
+            return log_like[0]
+        return log_like
+
+    def batch(self, params):
+        '''
+        Evaluates the log likelihood for a batch of walkers at once.
+
+        Parameters
+        ----------
+        params : array-like. shape = (n_walkers, 3)
+            kp_on, kp_off and rm in units of gm for each walker.
+
+        Returns
+        -------
+        log_like : array-like. shape = (n_walkers,)
+            Log likelihood of each walker.
+        '''
+        log_like = np.full(len(params), -np.inf)
+        valid = np.all(params > 0, axis=1) & np.all(np.isfinite(params),
+                                                     axis=1)
+        if not valid.any():
+            return log_like
+        kp_on, kp_off, rm = params[valid].T / self.gm
+        a, b = kp_on, kp_on + kp_off
+        log_like[valid] = 0
+        for scale, m, n in zip(self.rm_scale, self.unique, self.counts):
+            # ln 1F1(a + m; b + m; -r) for all counts
+            log_hyp = model.log_hyp1f1_recurrence(a, b, -scale * rm,
+                                                  int(m[-1]),
+                                                  check=self.check)
+            lnp = scipy.special.gammaln(a[:, None] + m) \
+                - scipy.special.gammaln(m + 1) \
+                - scipy.special.gammaln(b[:, None] + m) \
+                + scipy.special.gammaln(b)[:, None] \
+                - scipy.special.gammaln(a)[:, None] \
+                + m * np.log(scale * rm)[:, None] \
+                + log_hyp[:, m]
+            log_like[valid] += lnp @ n
+
+        return log_like
+
+    def parallel(self, params, n_jobs=-1):
+        '''
+        Evaluates the log likelihood splitting the walkers among processes.
+
+        Parameters
+        ----------
+        params : array-like. shape = (n_walkers, 3)
+            kp_on, kp_off and rm in units of gm for each walker.
+        n_jobs : int. Default = -1
+            Number of processes. -1 uses all of the cores.
+
+        Returns
+        -------
+        log_like : array-like. shape = (n_walkers,)
+            Log likelihood of each walker.
+        '''
+        from joblib import Parallel, delayed, cpu_count
+
+        if n_jobs < 0:
+            n_jobs = cpu_count()
+        chunks = np.array_split(np.asarray(params, dtype=float),
+                                min(n_jobs, len(params)))
+        log_like = Parallel(n_jobs=n_jobs)(
+            delayed(self.batch)(chunk) for chunk in chunks)
+
+        return np.concatenate(log_like)
+
+
+# CHAIN STORAGE
+def chain_files(fname):
+    '''
+    Returns the paths of the binary chain and of its summary given the
+    name of a chain with or without extension.
+    '''
+    base = os.path.splitext(fname)[0]
+    return base + '.npy', base + '.json'
+
+
+def chain_summary(chain, lnprob, names, mass_frac=0.95):
+    '''
+    Computes the summary of an MCMC chain that is saved in the header file
+    of the binary chain format.
+
+    Parameters
+    ----------
+    chain : array-like. shape = (n_samples, n_params)
+        Flat chain of samples.
+    lnprob : array-like. shape = (n_samples,)
+        Log probability of each sample.
+    names : list of str.
+        Name of each parameter.
+    mass_frac : float. Default = 0.95
+        Fraction of the probability included in the HPD.
+
+    Returns
+    -------
+    summary : dict.
+        Dictionary with entries
+        - names : list with the parameter names.
+        - n_samples : number of samples in the chain.
+        - map : dictionary with the maximum a posteriori value of each
+          parameter.
+        - map_lnprob : log probability of the MAP sample.
+        - mass_frac : fraction of the probability in the HPD.
+        - hpd : dictionary with the [lower, upper] HPD bounds of each
+          parameter.
+    '''
+    chain = np.asarray(chain)
+    max_idx = int(np.argmax(lnprob))
+    return dict(names=list(names),
+                n_samples=len(chain),
+                map=dict(zip(names, chain[max_idx].tolist())),
+                map_lnprob=float(lnprob[max_idx]),
+                mass_frac=mass_frac,
+                hpd={name: stats.hpd(chain[:, i], mass_frac).tolist()
+                     for i, name in enumerate(names)})
+
+
+def save_chain(fname, chain, lnprob, names, mass_frac=0.95):
+    '''
+    Saves an MCMC chain in binary format. The samples and their log
+    probability are stored as the columns of a .npy file that can be
+    memory-mapped, and the parameter names with the MAP and HPD summary
+    are stored in a small .json header next to it.
+
+    Parameters
+    ----------
+    fname : str.
+        Path of the chain. The extension is replaced by .npy and .json.
+    chain : array-like. shape = (n_samples, n_params)
+        Flat chain of samples, e.g. sampler.flatchain.
+    lnprob : array-like. shape = (n_samples,)
+        Log probability of each sample, e.g. sampler.flatlnprobability.
+    names : list of str.
+        Name of each parameter.
+    mass_frac : float. Default = 0.95
+        Fraction of the probability included in the HPD.
+
+    Returns
+    -------
+    summary : dict.
+        Summary saved in the header. See chain_summary.
+    '''
+    chain = np.asarray(chain, dtype=float)
+    lnprob = np.asarray(lnprob, dtype=float)
+    if chain.shape != (len(lnprob), len(names)):
+        raise ValueError('chain must have shape (len(lnprob), len(names))')
+    npy_file, json_file = chain_files(fname)
+    summary = chain_summary(chain, lnprob, names, mass_frac)
+
+    # Write to temporary files first such that readers never find a
+    # partially written chain
+    tmp = '.{:d}.tmp'.format(os.getpid())
+    with open(npy_file + tmp, 'wb') as file:
+        np.save(file, np.column_stack([chain, lnprob]))
+    with open(json_file + tmp, 'w') as file:
+        json.dump(summary, file, indent=1)
+    os.replace(npy_file + tmp, npy_file)
+    os.replace(json_file + tmp, json_file)
+
+    return summary
+
+
+def load_chain_summary(fname):
+    '''
+    Reads the MAP and HPD summary of a chain saved with save_chain without
+    touching the samples.
+
+    Parameters
+    ----------
+    fname : str.
+        Path of the chain with or without extension.
+
+    Returns
+    -------
+    summary : dict.
+        Summary of the chain. See chain_summary.
+    '''
+    with open(chain_files(fname)[1], 'r') as file:
+        return json.load(file)
+
+
+def load_chain(fname, mmap_mode='r'):
+    '''
+    Loads a chain saved with save_chain.
+
+    Parameters
+    ----------
+    fname : str.
+        Path of the chain with or without extension.
+    mmap_mode : str or None. Default = 'r'
+        Memory-map mode passed to numpy.load. With the default the samples
+        are only read from disk when accessed. If None the whole chain is
+        read into memory.
+
+    Returns
+    -------
+    chain : array-like. shape = (n_samples, n_params)
+        Flat chain of samples.
+    lnprob : array-like. shape = (n_samples,)
+        Log probability of each sample.
+    summary : dict.
+        Summary of the chain. See chain_summary.
+    '''
+    data = np.load(chain_files(fname)[0], mmap_mode=mmap_mode)
+    summary = load_chain_summary(fname)
+
+    return data[:, :-1], data[:, -1], summary
+
+
+def load_pkl_chain(pkl_file):
+    '''
+    Reads one of the pickle files with the flat chain followed by the log
+    probability.
+
+    Returns
+    -------
+    flatchain : array-like. shape = (n_samples, n_params)
+        Flat chain of samples.
+    flatlnprobability : array-like. shape = (n_samples,)
+        Log probability of each sample.
+    '''
+    with open(pkl_file, 'rb') as file:
+        unpickler = pickle.Unpickler(file)
+        flatchain = unpickler.load()
+        flatlnprobability = unpickler.load()
+
+    return flatchain, flatlnprobability
+
+
+def pkl_to_chain(pkl_file, names, out_file=None, mass_frac=0.95):
+    '''
+    Converts one of the pickle files with the flat chain followed by the
+    log probability (such as lacUV5_constitutive_mRNA_double_expo.pkl)
+    into the binary chain format.
+
+    Parameters
+    ----------
+    pkl_file : str.
+        Path to the pickle file.
+    names : list of str.
+        Name of each parameter, e.g. ['kp_on', 'kp_off', 'rm'].
+    out_file : str or None.
+        Path of the binary chain. If None it is saved next to pkl_file.
+    mass_frac : float. Default = 0.95
+        Fraction of the probability included in the HPD.
+
+    Returns
+    -------
+    summary : dict.
+        Summary saved in the header. See chain_summary.
+    '''
+    flatchain, flatlnprobability = load_pkl_chain(pkl_file)
+    if out_file is None:
+        out_file = pkl_file
+
+    return save_chain(out_file, flatchain, flatlnprobability, names,
+                      mass_frac)
+
+
+def pkl_chain_summary(pkl_file, names, mass_frac=0.95, save=False):
+    '''
+    Returns the summary of one of the pickled chains. If the chain was
+    converted to the binary format (see pkl_to_chain) and the pickle is not
+    newer than it, only the header is read. Otherwise the summary is
+    computed from the pickle.
+
+    Parameters
+    ----------
+    pkl_file : str.
+        Path to the pickle file.
+    names : list of str.
+        Name of each parameter.
+    mass_frac : float. Default = 0.95
+        Fraction of the probability included in the HPD.
+    save : bool. Default = False
+        If True, a chain that has to be read from the pickle is also
+        converted to the binary format, so later calls only read the
+        header. Otherwise no file is written.
+
+    Returns
+    -------
+    summary : dict.
+        Summary of the chain. See chain_summary.
+    '''
+    header = chain_files(pkl_file)[1]
+    if os.path.exists(header) and \
+            os.path.getmtime(header) >= os.path.getmtime(pkl_file):
+        summary = load_chain_summary(header)
+        if summary['mass_frac'] == mass_frac:
+            return summary
+
+    if save:
+        return pkl_to_chain(pkl_file, names, mass_frac=mass_frac)
+    flatchain, flatlnprobability = load_pkl_chain(pkl_file)
+    return chain_summary(np.asarray(flatchain), flatlnprobability, names,
+                         mass_frac)
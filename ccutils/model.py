@@ -11,15 +11,20 @@ Purpose:
     theoretical model for transcriptional regulation relevant
     for the channel capacity project
 """
+import os
+import json
+import warnings
 import pickle
+import hashlib
 import numpy as np
 import scipy as sp
 import scipy.optimize
 import scipy.special
 import scipy.integrate
+import scipy.interpolate
+import scipy.sparse.csgraph
 import mpmath
 import pandas as pd
-import git
 
 
 # THERMODYNAMIC FUNCTIONS
@@ -92,7 +97,120 @@ np_log_hyp = np.frompyfunc(lambda x, y, z:
                            mpmath.ln(mpmath.hyp1f1(x, y, z, zeroprec=1000)), 3, 1)
 
 
-def log_p_m_unreg(mRNA, kp_on, kp_off, gm, rm):
+def log_hyp1f1_series(c, b, x, n_terms=None):
+    '''
+    Computes ln 1F1(c; b; x) for c >= 0, b > 0 and x >= 0 by summing the
+    hypergeometric series in log space. Since all of the terms are
+    positive there is no cancellation.
+
+    Parameters
+    ----------
+    c, b, x : array-like.
+        Parameters and argument of the confluent hypergeometric function.
+        They must be broadcastable to each other.
+    n_terms : int or None.
+        Number of terms to include in the series. If None it is chosen such
+        that the remaining terms decay geometrically.
+
+    Returns
+    -------
+    ln 1F1(c; b; x) with the broadcasted shape of the inputs.
+    '''
+    c, b, x = np.broadcast_arrays(*[np.array(v, dtype=float)
+                                    for v in (c, b, x)])
+    if n_terms is None:
+        n_terms = int(np.max(2 * x * np.maximum(1, c / b), initial=0)) + 100
+    k = np.arange(1, n_terms)
+    # Compute the log of the ratio between consecutive terms
+    with np.errstate(divide='ignore'):
+        log_ratio = np.log(c[..., None] + k - 1) - \
+            np.log(b[..., None] + k - 1) + \
+            np.log(x[..., None]) - np.log(k)
+    # Accumulate to find the log of each of the terms
+    log_terms = np.concatenate([np.zeros(c.shape + (1,)),
+                                np.cumsum(log_ratio, axis=-1)], axis=-1)
+
+    return sp.special.logsumexp(log_terms, axis=-1)
+
+
+def log_hyp1f1_recurrence(a, b, z, m_max, check=True, n_anchor=3,
+                          tol=1E-8):
+    '''
+    Computes ln 1F1(a + m; b + m; z) for m = 0, 1, ..., m_max at once with
+    a three-term recurrence relation. Using Kummer's transformation
+    1F1(a + m; b + m; z) = exp(z) 1F1(b - a; b + m; -z)
+    the problem is mapped to a series of positive terms for z <= 0. The
+    recurrence in the second parameter (DLMF 13.3.2)
+    b(b - 1) M(c, b - 1, x) + b(1 - b - x) M(c, b, x) + x(b - c) M(c, b + 1, x)
+    is run backwards on the ratios M(c, b + m, x) / M(c, b + m + 1, x),
+    which is the stable direction for this solution and avoids overflow.
+
+    Parameters
+    ----------
+    a, b : array-like.
+        Parameters of the confluent hypergeometric function. Must satisfy
+        b > 0 and b - a >= 0.
+    z : array-like.
+        Argument of the function. Must be <= 0.
+    m_max : int.
+        Largest shift of the parameters to evaluate.
+    check : bool. Default = True
+        If True, the result is compared with mpmath.hyp1f1 at n_anchor
+        points and an error is raised if they differ by more than tol.
+    n_anchor : int. Default = 3
+        Number of points evenly spaced in m at which to check the result.
+    tol : float. Default = 1E-8
+        Tolerance for the check, relative to max(1, |ln 1F1|).
+
+    Returns
+    -------
+    log_hyp : array-like. shape = broadcast(a, b, z).shape + (m_max + 1,)
+        ln 1F1(a + m; b + m; z) for all m.
+
+    Raises
+    ------
+    ValueError
+        Thrown if the parameters are outside of the supported domain.
+    RuntimeError
+        Thrown if check is True and the result does not match mpmath.
+    '''
+    a, b, z = np.broadcast_arrays(*[np.array(v, dtype=float)
+                                    for v in (a, b, z)])
+    if np.any(z > 0) or np.any(b <= 0) or np.any(b - a < 0):
+        raise ValueError('the recurrence requires z <= 0, b > 0 and b >= a')
+    # Define parameters of the transformed function
+    c, x = b - a, -z
+
+    # Initialize array to save log M(c, b + m, x)
+    log_M = np.zeros(a.shape + (m_max + 1,))
+    # Compute last value and the ratio to the following one with the series
+    log_M[..., -1] = log_hyp1f1_series(c, b + m_max, x)
+    rho = np.exp(log_M[..., -1] - log_hyp1f1_series(c, b + m_max + 1, x))
+
+    # Run recurrence backwards on the ratios
+    for m in range(m_max, 0, -1):
+        B = b + m
+        rho = (B * (B - 1 + x) - x * (B - c) / rho) / (B * (B - 1))
+        log_M[..., m - 1] = log_M[..., m] + np.log(rho)
+
+    # Undo Kummer's transformation
+    log_hyp = z[..., None] + log_M
+
+    # Compare with mpmath at anchor points
+    if check:
+        anchors = np.unique(np.linspace(0, m_max, n_anchor).astype(int))
+        for idx in np.ndindex(a.shape):
+            for m in anchors:
+                ref = float(mpmath.ln(mpmath.hyp1f1(a[idx] + m, b[idx] + m,
+                                                    z[idx], zeroprec=1000)))
+                if np.abs(log_hyp[idx + (m,)] - ref) > tol * max(1, abs(ref)):
+                    raise RuntimeError('recurrence for ln 1F1 does not match '
+                                       'mpmath at m = {:d}'.format(m))
+
+    return log_hyp
+
+
+def log_p_m_unreg(mRNA, kp_on, kp_off, gm, rm, method='mpmath'):
     '''
     Computes the log probability lnP(m) for an unregulated promoter,
     i.e. the probability of having m mRNA.
@@ -109,6 +227,12 @@ def log_p_m_unreg(mRNA, kp_on, kp_off, gm, rm):
         1 / half-life time for the mRNA.
     rm : float.
         production rate of the mRNA
+    method : str. Default = 'mpmath'
+        Method used to evaluate the confluent hypergeometric function.
+        'mpmath' evaluates it with arbitrary precision for each mRNA value.
+        'recurrence' evaluates it for all mRNA values at once in float64
+        with log_hyp1f1_recurrence, which checks itself against mpmath at a
+        few anchor points. This method requires integer mRNA counts.
 
     Returns
     -------
@@ -117,6 +241,17 @@ def log_p_m_unreg(mRNA, kp_on, kp_off, gm, rm):
     # Convert the mRNA copy number to a  numpy array
     mRNA = np.array(mRNA)
 
+    # Compute the log confluent hypergeometric function
+    if method == 'mpmath':
+        log_hyp = np_log_hyp(kp_on / gm + mRNA,
+                             (kp_off + kp_on) / gm + mRNA, -rm / gm)
+    elif method == 'recurrence':
+        log_hyp = log_hyp1f1_recurrence(kp_on / gm, (kp_off + kp_on) / gm,
+                                        -rm / gm, int(np.max(mRNA)))
+        log_hyp = log_hyp[mRNA.astype(int)]
+    else:
+        raise ValueError("method must be 'mpmath' or 'recurrence'")
+
     # Compute the probability
     lnp = scipy.special.gammaln(kp_on / gm + mRNA) \
         - scipy.special.gammaln(mRNA + 1) \
@@ -124,8 +259,7 @@ def log_p_m_unreg(mRNA, kp_on, kp_off, gm, rm):
         + scipy.special.gammaln((kp_off + kp_on) / gm) \
         - scipy.special.gammaln(kp_on / gm) \
         + mRNA * np.log(rm / gm) \
-        + np_log_hyp(kp_on / gm + mRNA,
-                     (kp_off + kp_on) / gm + mRNA, -rm / gm)
+        + log_hyp
 
     return lnp.astype(float)
 
@@ -157,6 +291,384 @@ def kr_off_fun(eRA, k0, kp_on, kp_off, Nns=4.6E6, Vcell=2.15):
         kp_off / (kp_off + kp_on)
 
 
+# ANALYTIC PROTEIN DISTRIBUTION
+# define a np.frompyfunc that allows us to evaluate the mpmath.hyp2f1
+np_log_gauss_hyp = np.frompyfunc(lambda a, b, c, z:
+                                 mpmath.ln(mpmath.hyp2f1(a, b, c, z,
+                                                         maxprec=60)).real,
+                                 4, 1)
+
+
+def log_hyp2f1_series(a, b, c, x, chunk=1000, max_terms=10**7):
+    '''
+    Computes ln 2F1(a, b; c; x) for a, b, c > 0 and 0 <= x < 1 by summing
+    the hypergeometric series in log space. Since all of the terms are
+    positive there is no cancellation. Terms are added in chunks until the
+    remaining terms are negligible.
+
+    Parameters
+    ----------
+    a, b, c, x : array-like.
+        Parameters and argument of the Gauss hypergeometric function.
+        They must be broadcastable to each other.
+    chunk : int. Default = 1000
+        Number of terms added per iteration.
+    max_terms : int. Default = 10**7
+        Maximum number of terms before giving up.
+
+    Returns
+    -------
+    ln 2F1(a, b; c; x) with the broadcasted shape of the inputs.
+    '''
+    a, b, c, x = [v[..., None] for v in np.broadcast_arrays(
+        *[np.array(v, dtype=float) for v in (a, b, c, x)])]
+    # Initialize log of the current term and of the sum
+    log_term = np.zeros(a.shape)
+    log_sum = np.zeros(a.shape[:-1])
+    k0 = 1
+    while k0 < max_terms:
+        k = np.arange(k0, k0 + chunk)
+        # Compute the log of the ratio between consecutive terms
+        with np.errstate(divide='ignore'):
+            log_ratio = np.log(a + k - 1) + np.log(b + k - 1) - \
+                np.log(c + k - 1) - np.log(k) + np.log(x)
+        log_terms = log_term + np.cumsum(log_ratio, axis=-1)
+        log_sum = np.logaddexp(log_sum,
+                               sp.special.logsumexp(log_terms, axis=-1))
+        log_term = log_terms[..., -1:]
+        # Stop once the terms decrease and are below machine precision
+        if np.all((log_ratio[..., -1] < 0) &
+                  (log_term[..., 0] < log_sum - 40)):
+            return log_sum
+        k0 += chunk
+
+    raise RuntimeError('series for ln 2F1 did not converge')
+
+
+def log_hyp2f1_recurrence(a, b, c, x, p_max, check=True, n_anchor=3,
+                          tol=1E-8):
+    '''
+    Computes ln 2F1(a + p, b; c + p; x) for p = 0, 1, ..., p_max at once
+    with the contiguous relation
+    (c - 1) F(a - 1, c - 1) = [c - 1 + (a - b)x] F(a, c)
+                              - a(c - b)x / c F(a + 1, c + 1).
+    As p grows F tends to a constant while the dominant solution of the
+    relation grows as x**-p, so the recurrence is run backwards on the
+    ratios F(a + p, c + p) / F(a + p + 1, c + p + 1), seeded with the
+    series at the largest p.
+
+    Parameters
+    ----------
+    a, b, c : array-like.
+        Parameters of the Gauss hypergeometric function. Must be positive.
+    x : array-like.
+        Argument of the function. Must satisfy 0 <= x < 1.
+    p_max : int.
+        Largest shift of the parameters to evaluate.
+    check : bool. Default = True
+        If True, the result is compared with the direct series
+        (log_hyp2f1_series) at n_anchor points and an error is raised if
+        they differ by more than tol.
+    n_anchor : int. Default = 3
+        Number of points evenly spaced in p at which to check the result.
+    tol : float. Default = 1E-8
+        Tolerance for the check, relative to max(1, |ln 2F1|).
+
+    Returns
+    -------
+    log_hyp : array-like. shape = broadcast(a, b, c, x).shape + (p_max + 1,)
+        ln 2F1(a + p, b; c + p; x) for all p.
+
+    Raises
+    ------
+    ValueError
+        Thrown if the parameters are outside of the supported domain.
+    RuntimeError
+        Thrown if check is True and the result does not match the series.
+    '''
+    a, b, c, x = np.broadcast_arrays(*[np.array(v, dtype=float)
+                                       for v in (a, b, c, x)])
+    if np.any(a <= 0) or np.any(b <= 0) or np.any(c <= 0) or \
+       np.any(x < 0) or np.any(x >= 1):
+        raise ValueError('the recurrence requires a, b, c > 0 and 0 <= x < 1')
+
+    # Initialize array to save ln 2F1(a + p, b; c + p; x)
+    log_hyp = np.zeros(a.shape + (p_max + 1,))
+    # Compute last value and the ratio to the following one with the series
+    log_hyp[..., -1] = log_hyp2f1_series(a + p_max, b, c + p_max, x)
+    rho = np.exp(log_hyp[..., -1] -
+                 log_hyp2f1_series(a + p_max + 1, b, c + p_max + 1, x))
+
+    # Run recurrence backwards on the ratios
+    for p in range(p_max, 0, -1):
+        A, C = a + p, c + p
+        rho = (C - 1 + (A - b) * x - A * (C - b) * x / (C * rho)) / (C - 1)
+        log_hyp[..., p - 1] = log_hyp[..., p] + np.log(rho)
+
+    # Compare with the direct series at anchor points
+    if check:
+        anchors = np.unique(np.linspace(0, p_max, n_anchor).astype(int))
+        ref = log_hyp2f1_series(a[..., None] + anchors, b[..., None],
+                                c[..., None] + anchors, x[..., None])
+        err = np.abs(log_hyp[..., anchors] - ref) / np.maximum(1, np.abs(ref))
+        if np.any(err > tol):
+            raise RuntimeError('recurrence for ln 2F1 does not match the '
+                               'series at the anchor points')
+
+    return log_hyp
+
+
+def log_p_p_mid_C(C, protein, rep, ka, ki, epsilon, kon, k0, gamma_m,
+                  r_gamma_m, gamma_p, r_gamma_p, logC=False,
+                  method='recurrence'):
+    '''
+    Computes the log conditional probability lnP(p|C,R),
+    i.e. the probability of having p proteins given
+    an inducer concentration C and a repressor copy number R.
+
+    Parameters
+    ----------
+    C : array-like.
+        Concentration at which evaluate the probability.
+    protein : array-like.
+        protein copy number at which evaluate the probability.
+    rep : float.
+        repressor copy number per cell.
+    ki, ka : float.
+        dissociation constants for the inactive and active states respectively
+        in the MWC model of the lac repressor.
+    epsilon : float.
+        energetic barrier between the inactive and the active state.
+    kon : float.
+        rate of activation of the promoter in the chemical master equation
+    k0 : float.
+        diffusion limited rate of a repressor binding the promoter
+    gamma_m : float.
+        half-life time for the mRNA.
+    r_gamma_m : float.
+        average number of mRNA in the unregulated promoter.
+    gamma_p : float.
+        half-life time for the protein.
+    r_gamma_p : float.
+        average number of protein per mRNA in the unregulated promoter.
+    logC : Bool.
+        boolean indicating if the concentration is given in log scale. If True
+        C = 10**C
+    method : str. Default = 'recurrence'
+        Method used to evaluate the Gauss hypergeometric function.
+        'recurrence' evaluates it for all protein values at once with
+        log_hyp2f1_recurrence, which checks itself against the direct
+        series at a few anchor points. This method requires integer protein
+        counts; if any count is not an integer the 'mpmath' method is used
+        instead.
+        'mpmath' evaluates it with arbitrary precision for each value.
+
+    Returns
+    -------
+    log probability lnP(p|c,R)
+    '''
+    # Convert C and protein into np.arrays
+    C, protein = np.broadcast_arrays(np.array(C, dtype=float),
+                                     np.array(protein))
+    # Convert from log if necessary
+    if logC:
+        C = 10**C
+
+    # Calculate the off rate including the MWC model
+    koff = k0 * rep * p_act(C, ka, ki, epsilon)
+
+    # compute the variables needed for the distribution
+    a = r_gamma_m * gamma_m / gamma_p  # r_m / gamma_p
+    b = r_gamma_p * gamma_p / gamma_m  # r_p / gamma_m
+    Kon = kon / gamma_p
+    Koff = koff / gamma_p
+
+    phi = np.sqrt((a + Kon + Koff)**2 - 4 * a * Kon)
+
+    alpha = 1 / 2 * (a + Kon + Koff + phi)
+    beta = 1 / 2 * (a + Kon + Koff - phi)
+
+    # The recurrence is only defined on integer protein counts
+    if (method == 'recurrence') and np.any(np.mod(protein, 1) != 0):
+        method = 'mpmath'
+
+    # Compute the log Gauss hypergeometric function
+    if method == 'mpmath':
+        log_hyp = np_log_gauss_hyp(alpha + protein, Kon + Koff - beta,
+                                   Kon + Koff + protein,
+                                   b / (1 + b)).astype(float)
+    elif method == 'recurrence':
+        # Evaluate the recurrence once per unique concentration
+        C_unique, inv = np.unique(C, return_inverse=True)
+        koff_u = k0 * rep * p_act(C_unique, ka, ki, epsilon) / gamma_p
+        phi_u = np.sqrt((a + Kon + koff_u)**2 - 4 * a * Kon)
+        log_hyp = log_hyp2f1_recurrence(
+            1 / 2 * (a + Kon + koff_u + phi_u),
+            Kon + koff_u - 1 / 2 * (a + Kon + koff_u - phi_u),
+            Kon + koff_u, b / (1 + b), int(np.max(protein)))
+        log_hyp = log_hyp[inv.reshape(C.shape), protein.astype(int)]
+    else:
+        raise ValueError("method must be 'mpmath' or 'recurrence'")
+
+    # Compute the probability
+    lnp = scipy.special.gammaln(alpha + protein) \
+        + scipy.special.gammaln(beta + protein) \
+        + scipy.special.gammaln(Kon + Koff) \
+        - scipy.special.gammaln(protein + 1) \
+        - scipy.special.gammaln(alpha) \
+        - scipy.special.gammaln(beta) \
+        - scipy.special.gammaln(Kon + Koff + protein) \
+        + protein * (np.log(b) - np.log(1 + b)) \
+        + alpha * np.log(1 - b / (1 + b)) \
+        + log_hyp
+
+    return lnp.astype(float)
+
+
+def adaptive_log_interp(log_fun, x_range, tol=1E-3, n_init=20,
+                        max_iter=50, return_nodes=False):
+    '''
+    Evaluates a log probability mass function over a range of integers by
+    cubic interpolation on a set of nodes that is refined where the
+    interpolant is inaccurate. At each iteration the function is evaluated
+    at the midpoint of every interval that has not converged, and the
+    interval is accepted if the mass error at the midpoint, scaled by the
+    interval width, is below its share of tol. Every evaluated point is kept
+    as a node, so no evaluation is wasted.
+    Since the cubic spline is global, adding nodes also changes intervals
+    that were already accepted. The final interpolant is therefore checked
+    once more at the midpoint of all of its intervals and a RuntimeWarning
+    is issued if the estimated error in the normalization exceeds tol.
+
+    Parameters
+    ----------
+    log_fun : function.
+        Function that takes an array of integers and returns the log
+        probability at each of them.
+    x_range : array-like.
+        [x_min, x_max) range at which to evaluate the function.
+    tol : float. Default = 1E-3
+        Target for the error in the normalization of the distribution
+        introduced by the interpolation.
+    n_init : int. Default = 20
+        Number of evenly spaced initial nodes. Must be at least 4.
+    max_iter : int. Default = 50
+        Maximum number of refinement iterations.
+    return_nodes : bool. Default = False
+        If True, the nodes at which log_fun was evaluated are also returned.
+
+    Returns
+    -------
+    log_p : array-like. shape = x_max - x_min
+        Interpolated log probability at each integer in x_range.
+    nodes : array-like.
+        Nodes at which the function was evaluated. Only returned if
+        return_nodes is True.
+    '''
+    x_array = np.arange(x_range[0], x_range[1])
+    length = len(x_array) - 1
+    # Initialize nodes and evaluate function
+    nodes = np.unique(np.linspace(x_array[0], x_array[-1],
+                                  max(n_init, 4)).astype(int))
+    values = np.array(log_fun(nodes), dtype=float)
+    # List intervals that can still be refined
+    pending = np.stack([nodes[:-1], nodes[1:]], axis=1)
+    pending = pending[np.diff(pending, axis=1)[:, 0] > 1]
+
+    for i in range(max_iter):
+        if len(pending) == 0 or len(nodes) < 4:
+            break
+        # Interpolate with the current nodes
+        log_spline = scipy.interpolate.interp1d(nodes, values, kind='cubic')
+        # Evaluate function at the midpoint of the pending intervals
+        mid = (pending[:, 0] + pending[:, 1]) // 2
+        log_mid = np.array(log_fun(mid), dtype=float)
+        # Estimate the mass error on each interval
+        width = pending[:, 1] - pending[:, 0]
+        err = np.abs(np.exp(log_mid) - np.exp(log_spline(mid))) * width
+        # Add the new points to the nodes
+        nodes = np.concatenate([nodes, mid])
+        values = np.concatenate([values, log_mid])
+        idx = np.argsort(nodes)
+        nodes, values = nodes[idx], values[idx]
+        # Split intervals that exceed their share of the tolerance
+        split = err > tol * width / length
+        pending = np.concatenate([
+            np.stack([pending[split, 0], mid[split]], axis=1),
+            np.stack([mid[split], pending[split, 1]], axis=1)])
+        pending = pending[np.diff(pending, axis=1)[:, 0] > 1]
+
+    # Interpolate with all of the nodes
+    if len(nodes) >= 4:
+        log_p = scipy.interpolate.interp1d(nodes, values,
+                                           kind='cubic')(x_array)
+    else:
+        log_p = values
+
+    # Check the error of the final interpolant on every interval
+    width = np.diff(nodes)
+    if np.any(width > 1):
+        mid = (nodes[:-1] + nodes[1:])[width > 1] // 2
+        err = np.sum(np.abs(np.exp(np.array(log_fun(mid), dtype=float)) -
+                            np.exp(log_p[mid - x_array[0]])) *
+                     width[width > 1])
+        if err > tol:
+            warnings.warn('interpolation error {:.2E} exceeds tol = {:.2E}. '
+                          'Increase max_iter or n_init.'.format(err, tol),
+                          RuntimeWarning)
+
+    if return_nodes:
+        return log_p, nodes
+    return log_p
+
+
+def log_p_p_mid_C_spline(C, p_range, rep, ka, ki, epsilon, kon, k0, gamma_m,
+                         r_gamma_m, gamma_p, r_gamma_p, tol=1E-3, n_init=20,
+                         method='mpmath', return_nodes=False):
+    '''
+    Computes the log conditional probability lnP(p|C,R) for all protein
+    copy numbers in p_range by adaptive interpolation of the analytic
+    distribution computed with log_p_p_mid_C. Nodes are added until the
+    estimated error in the normalization due to the interpolation is below
+    tol.
+    This pays off when every evaluation is expensive (method='mpmath').
+    With method='recurrence' the cost of an evaluation is set by the
+    largest protein count, so evaluating the whole range directly with
+    log_p_p_mid_C is usually faster.
+
+    Parameters
+    ----------
+    C : float.
+        Concentration at which evaluate the probability.
+    p_range : array-like.
+        [p_min, p_max) protein copy number range at which evaluate the
+        probability.
+    rep, ka, ki, epsilon, kon, k0, gamma_m, r_gamma_m, gamma_p, r_gamma_p :
+        Parameters of the distribution. See log_p_p_mid_C.
+    tol : float. Default = 1E-3
+        Target for the error in the normalization due to the interpolation.
+    n_init : int. Default = 20
+        Number of evenly spaced initial nodes.
+    method : str. Default = 'mpmath'
+        Method used by log_p_p_mid_C to evaluate the hypergeometric
+        function.
+    return_nodes : bool. Default = False
+        If True, the protein copy numbers at which the analytic
+        distribution was evaluated are also returned.
+
+    Returns
+    -------
+    log probability lnP(p|c,R) for p in range(p_min, p_max)
+    '''
+    def log_fun(protein):
+        return log_p_p_mid_C(C, protein, rep, ka, ki, epsilon, kon, k0,
+                             gamma_m, r_gamma_m, gamma_p, r_gamma_p,
+                             method=method)
+
+    return adaptive_log_interp(log_fun, p_range, tol=tol, n_init=n_init,
+                               return_nodes=return_nodes)
+
+
 # DISTRIBUTION MOMENT DYNAMICS
 def rhs_dmomdt(mom, t, A):
     '''
@@ -180,6 +692,123 @@ def rhs_dmomdt(mom, t, A):
     '''
     return np.dot(A, mom)
 
+
+def block_triangular_solve(M, b):
+    '''
+    Solves the linear system M x = b by permuting M into block triangular
+    form and solving block by block with forward substitution. The blocks
+    are the strongly connected components of the sparsity pattern of M.
+    For the moment dynamics the blocks group moments of the same order,
+    so each block is solved at its own scale. This avoids the loss of
+    precision of a single solve when the moments span many orders of
+    magnitude (e.g. <p**6> ~ 1E20).
+
+    Parameters
+    ----------
+    M : array-like. shape = k x k or N x k x k
+        Matrix (or stack of matrices sharing the same sparsity pattern)
+        defining the linear system.
+    b : array-like. shape = k x r or N x k x r
+        Right-hand side(s) of the linear system.
+
+    Returns
+    -------
+    x : array-like. Same shape as b.
+        Solution of the linear system.
+    '''
+    M = np.array(M, dtype=float)
+    b = np.array(b, dtype=float)
+    # Find the sparsity pattern shared by all matrices
+    pattern = np.any(M != 0, axis=tuple(range(M.ndim - 2)))
+
+    # Find the strongly connected components of the dependency graph
+    n_comp, labels = scipy.sparse.csgraph.connected_components(
+        pattern, directed=True, connection='strong')
+    # Find the dependencies between components
+    rows, cols = np.nonzero(pattern)
+    depends = [set() for i in range(n_comp)]
+    for r, c in zip(labels[rows], labels[cols]):
+        if r != c:
+            depends[r].add(c)
+
+    # Solve components in an order such that all of the dependencies of a
+    # component are solved before it
+    x = np.zeros_like(b)
+    solved = set()
+    while len(solved) < n_comp:
+        for comp in range(n_comp):
+            if (comp in solved) or (not depends[comp] <= solved):
+                continue
+            idx = np.nonzero(labels == comp)[0]
+            # Move already solved terms to the right-hand side
+            rhs = b[..., idx, :] - np.matmul(M[..., idx, :], x)
+            x[..., idx, :] = np.linalg.solve(M[..., idx[:, None], idx], rhs)
+            solved.add(comp)
+
+    return x
+
+
+def steady_state_moments(A_mat, n_states, check_residual=False, tol=1E-6):
+    '''
+    Computes the steady state of the moment dynamics
+    dµ/dt = Aµ
+    by solving the linear system Aµ = 0 subject to the normalization
+    constraint that the zeroth moments of all promoter states add up to
+    one. This replaces integrating the dynamics for a long time and keeping
+    the last time point.
+
+    Parameters
+    ----------
+    A_mat : array-like. shape = k x k or N x k x k
+        Matrix (or stack of matrices) defining the moment dynamics. The
+        first n_states entries of the moment vector must be the zeroth
+        moment of each of the promoter states.
+    n_states : int.
+        Number of promoter states.
+    check_residual : bool. Default = False
+        If True the relative residual of each equation, i.e.
+        |∑_j A_ij µ_j| / ∑_j |A_ij µ_j|, is computed and an error is raised
+        if any of them is larger than tol.
+    tol : float. Default = 1E-6
+        Tolerance for the relative residual.
+
+    Returns
+    -------
+    mom_ss : array-like. shape = k or N x k
+        Steady state moments.
+
+    Raises
+    ------
+    RuntimeError
+        Thrown if check_residual is True and the residual is larger than
+        tol, for example when the dynamics do not reach a steady state.
+    '''
+    A_mat = np.array(A_mat, dtype=float)
+
+    # Since the probability is conserved, the equations for the zeroth
+    # moments are linearly dependent. Replace the first of them with the
+    # normalization constraint.
+    A_norm = A_mat.copy()
+    A_norm[..., 0, :] = 0
+    A_norm[..., 0, :n_states] = 1
+    b = np.zeros(A_mat.shape[:-1])
+    b[..., 0] = 1
+
+    # Solve linear system
+    mom_ss = block_triangular_solve(A_norm, b[..., None])[..., 0]
+
+    # Check that the solution satisfies the dynamics
+    if check_residual:
+        terms = A_mat * mom_ss[..., None, :]
+        resid = np.abs(terms.sum(axis=-1))
+        scale = np.abs(terms).sum(axis=-1)
+        if np.any(resid > tol * scale):
+            raise RuntimeError('steady state residual larger than tol. '
+                               'The dynamics might not have a steady state.')
+
+    return mom_ss
+
+
 def dmomdt(A_mat, expo, t, mom_init, states=['I', 'A', 'R']):
     '''
     Function to integrate 
@@ -223,10 +852,45 @@ def dmomdt(A_mat, expo, t, mom_init, states=['I', 'A', 'R']):
     
     return df
 
+def division_matrix(Z_mat, expo, states):
+    '''
+    Expands the binomial partitioning matrix to act on the moments of all
+    of the promoter states, i.e. builds the matrix that maps the moments
+    right before cell division to the moments right after it.
+
+    Parameters
+    ----------
+    Z_mat : array-like.
+        Array containing the linear coefficients to compute the moments
+        after the cell division
+    expo : array-like
+        List containing the moments involved in the dynamics
+    states : array-like.
+        Array containing the strings that define the promoter states.
+
+    Returns
+    -------
+    Z_mat_div : 2D-array. shape = len(expo) * len(states) squared
+        Matrix to compute the moments of all promoter states after division.
+    '''
+    # Initialize matrix
+    Z_mat_div = np.zeros([len(expo) * len(states), len(expo) * len(states)])
+    
+    # Loop through exponents
+    for i, e in enumerate(expo):
+        # Loop through states
+        for j, s in enumerate(states):
+            Z_mat_div[(i * len(states)) + j,
+                      j::len(states)] = Z_mat[i]
+
+    return Z_mat_div
+
+
 def dmomdt_cycles(mom_init, t_single, t_double,
                   A_mat_fun, par_single, par_double,
                   expo, n_cycles, Z_mat,
-                  n_steps=1000, states=['A', 'I']):
+                  n_steps=1000, states=['A', 'I'],
+                  return_array=False, last_cycle=False):
     '''
     Function that integrates the moment dynamics over several cell 
     cycles. The dynamics are integrated assuming a non-poisson
@@ -272,10 +936,25 @@ def dmomdt_cycles(mom_init, t_single, t_double,
         two available states are 'A' (active state) and 'E' (inactive).
         For the regulated case a third state 'R' (repressor bound) is
         available to the system.
+    return_array : bool. Default = False
+        If True the dynamics are returned as numpy arrays rather than as a
+        tidy data frame. See Returns for the shape of the arrays.
+    last_cycle : bool. Default = False
+        If True only the dynamics of the last cell cycle are kept. All
+        previous cycles are still integrated, but not stored.
 
     Returns
     -------
-    distribution moment dynamics over cell cycles
+    distribution moment dynamics over cell cycles.
+    If return_array is False, a tidy data frame with columns
+    ['time', 'state', 'cycle'] + moment names.
+    If return_array is True, a tuple (time, mom) where
+    time : 3D-array. shape = n_cycles x 2 x n_steps
+        Global time for each (cycle, promoter phase, step). Phase 0 is the
+        single promoter and phase 1 the two promoter state.
+    mom : 4D-array. shape = n_cycles x 2 x n_steps x len(expo) * len(states)
+        Moments for each (cycle, promoter phase, step). If last_cycle is True
+        the first dimension has length 1.
     '''
     # Initialize names for moments in data frame
     names = ['m{0:d}p{1:d}'.format(*x) + s for x in expo 
@@ -288,50 +967,42 @@ def dmomdt_cycles(mom_init, t_single, t_double,
     A_mat_d = A_mat_fun(*par_double)
 
     # Generate division matrix for all states
-    # Initialize matrix
-    Z_mat_div = np.zeros([len(names), len(names)])
-    
-    # Loop through exponents
-    for i, e in enumerate(expo):
-        # Loop through states
-        for j, s in enumerate(states):
-            Z_mat_div[(i * len(states)) + j,
-                      j::len(states)] = Z_mat[i]
+    Z_mat_div = division_matrix(Z_mat, expo, states)
     
-    # Initialize data frame
-    df = pd.DataFrame(columns=['time', 'state', 'cycle'] + names)
+    # Define time arrays for each of the promoter states
+    t_s = np.linspace(0, t_single, n_steps)
+    t_d = np.linspace(0, t_double, n_steps)
+
+    # Preallocate arrays to save the (cycle, phase, step, moment) dynamics
+    n_store = 1 if last_cycle else n_cycles
+    time_array = np.zeros([n_store, 2, n_steps])
+    mom_array = np.zeros([n_store, 2, n_steps, len(names)])
     
     # Initilaize global time
     t_sim = 0
     
     ###  Loop through cycles  ###
     for cyc in range(n_cycles):
-        # == Single promoter == #
-        # Define time array
-        t = np.linspace(0, t_single, n_steps)
+        # Define index where to store this cycle
+        idx = 0 if last_cycle else cyc
 
+        # == Single promoter == #
         # Integrate moment equations
-        mom = sp.integrate.odeint(rhs_dmomdt, mom_init, t, 
-                             args=(A_mat_s,))
-
-        # Generate data frame
-        df_mom = pd.DataFrame(mom, columns=names)
-        # Append time, state and cycle
-        df_mom = df_mom.assign(time=t + t_sim)
-        df_mom = df_mom.assign(state=['single'] * mom.shape[0])
-        df_mom = df_mom.assign(cycle=[cyc] * mom.shape[0])
-        
-        # Append results to global data frame
-        df = df.append(df_mom, ignore_index=True, sort=False)
+        mom = sp.integrate.odeint(rhs_dmomdt, mom_init, t_s, 
+                                  args=(A_mat_s,))
+
+        # Store results
+        time_array[idx, 0, :] = t_s + t_sim
+        mom_array[idx, 0, :, :] = mom
         
         # Update global time
         # NOTE: Here we account for whether or not this is the first cycle
         # This is because of the extra time bit we have to add in order not
         # to have two overlapping time points
         if cyc == 0:
-            t_sim = t_sim + t[-1]
+            t_sim = t_sim + t_s[-1]
         else:
-            t_sim = t_sim + t[-1] + np.diff(t)[0]
+            t_sim = t_sim + t_s[-1] + np.diff(t_s)[0]
         
         # == Two promoters == #
         
@@ -339,25 +1010,16 @@ def dmomdt_cycles(mom_init, t_single, t_double,
         # point of single promoter state
         mom_init = mom[-1, :]
         
-        # Define time array
-        t = np.linspace(0, t_double, n_steps)
-
         # Integrate moment equations
-        mom = sp.integrate.odeint(rhs_dmomdt, mom_init, t, 
+        mom = sp.integrate.odeint(rhs_dmomdt, mom_init, t_d, 
                                   args=(A_mat_d,))
 
-        # Generate data frame
-        df_mom = pd.DataFrame(mom, columns=names)
-        # Append time, state and cycle
-        df_mom = df_mom.assign(time=t + t_sim)
-        df_mom = df_mom.assign(state=['double'] * mom.shape[0])
-        df_mom = df_mom.assign(cycle=[cyc] * mom.shape[0])
-        
-        # Append results to global data frame
-        df = df.append(df_mom, ignore_index=True, sort=False)
+        # Store results
+        time_array[idx, 1, :] = t_d + t_sim
+        mom_array[idx, 1, :, :] = mom
         
         # Update global time
-        t_sim = t_sim + t[-1] + np.diff(t)[0]
+        t_sim = t_sim + t_d[-1] + np.diff(t_d)[0]
         
         # == Cell division == #
         
@@ -366,17 +1028,663 @@ def dmomdt_cycles(mom_init, t_single, t_double,
         
         # Compute moments after cell division
         mom_init = np.dot(Z_mat_div, mom_fix)
+
+    if return_array:
+        return time_array, mom_array
+
+    # Generate tidy data frame out of the arrays
+    df = pd.DataFrame(mom_array.reshape(-1, len(names)), columns=names)
+    # Define cycle numbers stored in the arrays
+    cycles = np.arange(n_cycles - n_store, n_cycles)
+    # Append time, state and cycle
+    df = df.assign(time=time_array.ravel())
+    df = df.assign(state=np.tile(np.repeat(['single', 'double'], n_steps),
+                                 n_store))
+    df = df.assign(cycle=np.repeat(cycles, 2 * n_steps))
         
-    return df
+    return df[['time', 'state', 'cycle'] + names]
+
+
+# PARAMETER SENSITIVITIES OF THE MOMENT DYNAMICS
+def dA_dpar(A_mat_fun, par, par_idx=None, rel_step=1E-6, par_ref=None):
+    '''
+    Computes the derivative of the moment dynamics matrix with respect to
+    the rate parameters using central differences. Since the entries of the
+    matrix are low order polynomials of the rates, the differences are
+    exact up to round-off error.
+
+    Parameters
+    ----------
+    A_mat_fun: function.
+        Function to build the matrix moment dynamics.
+    par : list.
+        List containing the rate parameters to be fed into A_mat_fun, e.g.
+        [kr_on, kr_off, kp_on, kp_off, rm, gm, rp, gp].
+    par_idx : list of int or None.
+        Indexes of the parameters with respect to which to differentiate.
+        If None all parameters are used.
+    rel_step : float. Default = 1E-6
+        Relative step for the central differences. Parameters equal to zero
+        use rel_step as an absolute step.
+    par_ref : list or None.
+        Parameters with respect to which the derivatives are taken. Each
+        entry of par must be proportional to the corresponding entry of
+        par_ref, e.g. par_ref = par_single and par = par_double where the
+        mRNA production rate is 2 * rm. If None par_ref = par.
+
+    Returns
+    -------
+    dA : 3D-array. shape = len(par_idx) x k x k
+        Derivative of the matrix with respect to each of the parameters.
+    '''
+    par = np.array(par, dtype=float)
+    par_ref = par if par_ref is None else np.array(par_ref, dtype=float)
+    if par_idx is None:
+        par_idx = range(len(par))
+
+    dA = list()
+    # Loop through parameters
+    for i in par_idx:
+        # Define the step of the reference parameter and of the parameter
+        if par_ref[i] != 0:
+            h = rel_step * np.abs(par_ref[i])
+            h_par = h * par[i] / par_ref[i]
+        else:
+            h = h_par = rel_step
+        # Compute central difference
+        par_plus, par_minus = par.copy(), par.copy()
+        par_plus[i] += h_par
+        par_minus[i] -= h_par
+        dA.append((np.array(A_mat_fun(*par_plus), dtype=float) -
+                   np.array(A_mat_fun(*par_minus), dtype=float)) / (2 * h))
+
+    return np.array(dA)
+
+
+def sensitivity_matrix(A_mat, dA):
+    '''
+    Builds the matrix of the augmented linear system for the moments µ and
+    their derivatives s_i = ∂µ/∂θ_i with respect to the parameters
+    dµ/dt = Aµ
+    ds_i/dt = A s_i + (∂A/∂θ_i) µ
+
+    Parameters
+    ----------
+    A_mat : 2D-array. shape = k x k
+        Matrix defining the moment dynamics.
+    dA : 3D-array. shape = n_par x k x k
+        Derivatives of A_mat with respect to the parameters.
+
+    Returns
+    -------
+    A_aug : 2D-array. shape = k * (n_par + 1) x k * (n_par + 1)
+        Matrix of the augmented system acting on [µ, s_1, ..., s_n_par].
+    '''
+    n_par, k = len(dA), A_mat.shape[0]
+    # Each derivative follows the same dynamics as the moments
+    A_aug = np.kron(np.eye(n_par + 1), A_mat)
+    # Add the source terms for the derivatives
+    A_aug[k:, :k] = np.reshape(dA, (n_par * k, k))
+
+    return A_aug
+
+
+def dmomdt_sensitivity(A_mat_fun, par, t, mom_init, sens_init=None,
+                       par_idx=None):
+    '''
+    Integrates the moment dynamics together with the derivatives of the
+    moments with respect to the rate parameters. Rather than integrating the
+    dynamics 2 * n_par extra times for finite differences, the derivatives
+    are obtained from a single integration of the augmented linear system.
+
+    Parameters
+    ----------
+    A_mat_fun: function.
+        Function to build the matrix moment dynamics.
+    par : list.
+        List containing the rate parameters to be fed into A_mat_fun.
+    t : array-like
+        Time array in seconds
+    mom_init : array-like. lenth = k
+        Initial condition for the moments.
+    sens_init : array-like or None. shape = n_par x k
+        Initial condition for the derivatives of the moments. If None the
+        initial condition is assumed to be independent of the parameters.
+    par_idx : list of int or None.
+        Indexes of the parameters with respect to which to differentiate.
+        If None all parameters are used.
+
+    Returns
+    -------
+    mom : 2D-array. shape = len(t) x k
+        Moment dynamics.
+    sens : 3D-array. shape = len(t) x n_par x k
+        Derivatives of the moments with respect to each of the parameters.
+    '''
+    # Build matrix and its derivatives
+    A_mat = np.array(A_mat_fun(*par), dtype=float)
+    dA = dA_dpar(A_mat_fun, par, par_idx)
+    n_par, k = len(dA), A_mat.shape[0]
+
+    # Define initial conditions of augmented system
+    if sens_init is None:
+        sens_init = np.zeros([n_par, k])
+    aug_init = np.concatenate([mom_init, np.ravel(sens_init)])
+
+    # Integrate augmented system
+    aug = sp.integrate.odeint(rhs_dmomdt, aug_init, t,
+                              args=(sensitivity_matrix(A_mat, dA),))
+
+    return aug[:, :k], aug[:, k:].reshape(len(t), n_par, k)
+
+
+def steady_state_sensitivity(A_mat_fun, par, n_states, par_idx=None):
+    '''
+    Computes the steady state moments together with their derivatives with
+    respect to the rate parameters. The derivatives solve
+    A s_i = -(∂A/∂θ_i) µ
+    with the same normalization constraint used by steady_state_moments,
+    which does not depend on the parameters.
+
+    Parameters
+    ----------
+    A_mat_fun: function.
+        Function to build the matrix moment dynamics.
+    par : list.
+        List containing the rate parameters to be fed into A_mat_fun.
+    n_states : int.
+        Number of promoter states.
+    par_idx : list of int or None.
+        Indexes of the parameters with respect to which to differentiate.
+        If None all parameters are used.
+
+    Returns
+    -------
+    mom_ss : 1D-array. length = k
+        Steady state moments.
+    sens_ss : 2D-array. shape = n_par x k
+        Derivatives of the steady state moments with respect to each of the
+        parameters.
+    '''
+    # Build matrix and its derivatives
+    A_mat = np.array(A_mat_fun(*par), dtype=float)
+    dA = dA_dpar(A_mat_fun, par, par_idx)
+
+    # Compute steady state
+    mom_ss = steady_state_moments(A_mat, n_states)
+
+    # Replace the first equation with the normalization constraint
+    A_norm = A_mat.copy()
+    A_norm[0, :] = 0
+    A_norm[0, :n_states] = 1
+    # Compute right-hand side for all parameters
+    rhs = -np.dot(dA, mom_ss)
+    rhs[:, 0] = 0
+
+    # Solve linear system for all parameters at once
+    sens_ss = block_triangular_solve(A_norm, rhs.T).T
+
+    return mom_ss, sens_ss
+
+
+def dmomdt_cycles_sensitivity(mom_init, sens_init, t_single, t_double,
+                              A_mat_fun, par_single, par_double,
+                              expo, n_cycles, Z_mat, par_idx=None,
+                              n_steps=1000, states=['A', 'I']):
+    '''
+    Integrates the moment dynamics over several cell cycles as in
+    dmomdt_cycles, together with the derivatives of the moments with respect
+    to the rate parameters. Since the binomial partitioning does not depend
+    on the parameters, the derivatives go through cell division with the
+    same linear map as the moments.
+    The derivatives are taken with respect to the entries of par_single.
+    The entries of par_double must be proportional to them (e.g. 2 * rm).
+
+    Parameters
+    ----------
+    mom_init : array-like. length = k
+        Initial conditions for the moments of all promoter states.
+    sens_init : array-like or None. shape = n_par x k
+        Initial conditions for the derivatives of the moments, e.g. as
+        computed by steady_state_sensitivity. If None the initial condition
+        is assumed to be independent of the parameters.
+    t_single, t_double : float.
+        Time that cells spend with a single and two promoter copies.
+    A_mat_fun: function.
+        Function to build the matrix moment dynamics.
+    par_single, par_double: list.
+        Lists containing the rate parameters to be fed into the
+        A_mat_fun function for a single and two promoters respectively.
+    expo : array-like
+        List containing the moments involved in the 
+        dynamics defined by A
+    n_cycles : int.
+        Number of cell cycles to integrate for.
+    Z_mat : array-like.
+        Array containing the linear coefficients to compute the moments
+        after the cell division
+    par_idx : list of int or None.
+        Indexes of the parameters with respect to which to differentiate.
+        If None all parameters are used.
+    n_steps : int. Default = 1000.
+        Number of steps to use for the numerical integration.
+    states : array-like. Default = ['A', 'I']
+        Array containing the strings that define the promoter states.
+
+    Returns
+    -------
+    time : 2D-array. shape = 2 x n_steps
+        Global time of the last cell cycle for each promoter phase.
+    mom : 3D-array. shape = 2 x n_steps x k
+        Moments during the last cell cycle.
+    sens : 4D-array. shape = 2 x n_steps x n_par x k
+        Derivatives of the moments during the last cell cycle.
+    '''
+    # Build the augmented matrices for both promoter states
+    A_mat_s = np.array(A_mat_fun(*par_single), dtype=float)
+    A_mat_d = np.array(A_mat_fun(*par_double), dtype=float)
+    dA_s = dA_dpar(A_mat_fun, par_single, par_idx)
+    dA_d = dA_dpar(A_mat_fun, par_double, par_idx, par_ref=par_single)
+    A_aug_s = sensitivity_matrix(A_mat_s, dA_s)
+    A_aug_d = sensitivity_matrix(A_mat_d, dA_d)
+    n_par, k = len(dA_s), A_mat_s.shape[0]
+
+    # Generate division matrix for the moments and all derivatives
+    Z_mat_div = np.kron(np.eye(n_par + 1),
+                        division_matrix(Z_mat, expo, states))
+
+    # Define initial conditions of augmented system
+    if sens_init is None:
+        sens_init = np.zeros([n_par, k])
+    aug_init = np.concatenate([mom_init, np.ravel(sens_init)])
+
+    # Define time arrays for each of the promoter states
+    t_s = np.linspace(0, t_single, n_steps)
+    t_d = np.linspace(0, t_double, n_steps)
+
+    # Initilaize global time
+    t_sim = 0
+
+    ###  Loop through cycles  ###
+    for cyc in range(n_cycles):
+        # == Single promoter == #
+        aug_s = sp.integrate.odeint(rhs_dmomdt, aug_init, t_s,
+                                    args=(A_aug_s,))
+        time_s = t_s + t_sim
+        # Update global time as in dmomdt_cycles
+        if cyc == 0:
+            t_sim = t_sim + t_s[-1]
+        else:
+            t_sim = t_sim + t_s[-1] + np.diff(t_s)[0]
+
+        # == Two promoters == #
+        aug_d = sp.integrate.odeint(rhs_dmomdt, aug_s[-1, :], t_d,
+                                    args=(A_aug_d,))
+        time_d = t_d + t_sim
+        # Update global time
+        t_sim = t_sim + t_d[-1] + np.diff(t_d)[0]
+
+        # == Cell division == #
+        aug_init = np.dot(Z_mat_div, aug_d[-1, :])
+
+    # Stack time of both promoter states
+    time = np.stack([time_s, time_d])
+
+    # Split moments and derivatives
+    aug = np.stack([aug_s, aug_d])
+
+    return time, aug[:, :, :k], aug[:, :, k:].reshape(2, n_steps, n_par, k)
+
+
+# BATCHED MOMENT DYNAMICS
+# Coefficients of the [13/13] Padé approximant to the matrix exponential
+# (Higham, SIAM J. Matrix Anal. Appl. 26, 2005)
+PADE13_COEFF = np.array([64764752532480000., 32382376266240000.,
+                         7771770303897600., 1187353796428800.,
+                         129060195264000., 10559470521600., 670442572800.,
+                         33522128640., 1323241920., 40840800., 960960.,
+                         16380., 182., 1.])
+PADE13_THETA = 5.371920351148152
+
+
+def expm_batch(A_mat):
+    '''
+    Computes the matrix exponential of a stack of square matrices using the
+    scaling and squaring algorithm with a [13/13] Padé approximant. Every
+    matrix in the stack is scaled independently so that the accuracy is the
+    same as computing each exponential individually, but all of the matrix
+    products and linear solves are performed as batched BLAS operations.
+
+    Parameters
+    ----------
+    A_mat : array-like. shape = N x k x k or k x k
+        Stack of square matrices to exponentiate.
+
+    Returns
+    -------
+    expA : array-like. Same shape as A_mat
+        Matrix exponential of each of the matrices in the stack.
+    '''
+    # Convert to a 3D array
+    A_mat = np.array(A_mat, dtype=float)
+    squeeze = A_mat.ndim == 2
+    if squeeze:
+        A_mat = A_mat[None, :, :]
+
+    # Compute the 1-norm of each matrix
+    norm = np.abs(A_mat).sum(axis=1).max(axis=1)
+    # Compute the number of squarings required for each matrix
+    with np.errstate(divide='ignore'):
+        n_sq = np.ceil(np.log2(norm / PADE13_THETA))
+    n_sq = np.where(np.isfinite(n_sq), np.maximum(n_sq, 0), 0).astype(int)
+
+    # Scale matrices
+    A = A_mat / (2.0**n_sq)[:, None, None]
+    b = PADE13_COEFF
+    ident = np.eye(A.shape[-1])[None, :, :]
+
+    # Compute the powers of the matrices
+    A2 = np.matmul(A, A)
+    A4 = np.matmul(A2, A2)
+    A6 = np.matmul(A4, A2)
+
+    # Compute the odd and even terms of the Padé approximant
+    U = np.matmul(A6, b[13] * A6 + b[11] * A4 + b[9] * A2) + \
+        b[7] * A6 + b[5] * A4 + b[3] * A2 + b[1] * ident
+    U = np.matmul(A, U)
+    V = np.matmul(A6, b[12] * A6 + b[10] * A4 + b[8] * A2) + \
+        b[6] * A6 + b[4] * A4 + b[2] * A2 + b[0] * ident
+
+    # Solve for the approximant of the scaled matrices
+    expA = np.linalg.solve(V - U, V + U)
+
+    # Undo the scaling by repeated squaring only where needed
+    for i in range(n_sq.max()):
+        sq = i < n_sq
+        expA[sq] = np.matmul(expA[sq], expA[sq])
+
+    if squeeze:
+        return expA[0]
+    return expA
+
+
+def dmomdt_cycles_batch(mom_init, t_single, t_double, A_mat_s, A_mat_d,
+                        expo, n_cycles, Z_mat, n_steps=1000,
+                        states=['A', 'I']):
+    '''
+    Batched version of dmomdt_cycles. Integrates the moment dynamics over
+    several cell cycles for a whole stack of conditions at once and returns
+    the moments averaged over the last cell cycle, i.e.
+    <x> = ∫ da P(a) <x(a)>
+    with P(a) = ln(2) * 2**(1 - a) the cell age distribution.
+    Since the dynamics are linear with constant coefficients within each
+    phase of the cell cycle, they are propagated exactly using the matrix
+    exponential of all of the A matrices in the stack.
+
+    Parameters
+    ----------
+    mom_init : array-like. shape = N x k or k
+        Initial conditions for the moments of all promoter states. If 1D
+        the same initial condition is used for all conditions.
+    t_single : float.
+        Time [in 1/mRNA degradation rate units] that cells spend 
+        with a single promoter copy
+    t_double : float.
+        Time [in 1/mRNA degradation rate units] that cells spend 
+        with a two promoter copies.
+    A_mat_s, A_mat_d : array-like. shape = N x k x k
+        Stack of matrices defining the moment dynamics dµ/dt = A_mat * µ
+        for the single and the two promoter state respectively.
+    expo : array-like
+        List containing the moments involved in the 
+        dynamics defined by A
+    n_cycles : int.
+        Number of cell cycles to integrate for. A cell cycle is defined
+        as t_single + t_double.
+    Z_mat : array-like.
+        Array containing the linear coefficients to compute the moments
+        after the cell division
+    n_steps : int. Default = 1000.
+        Number of time points per promoter state used for the average over
+        the last cell cycle.
+    states : array-like. Default = ['A', 'I']
+        Array containing the strings that define the promoter states.
+
+    Returns
+    -------
+    mom_avg : 2D-array. shape = N x len(expo)
+        Moments averaged over the last cell cycle and summed over all
+        promoter states for each of the conditions.
+    '''
+    # Convert the matrices to 3D arrays
+    A_mat_s = np.array(A_mat_s, dtype=float)
+    A_mat_d = np.array(A_mat_d, dtype=float)
+    n_cond, n_mom = A_mat_s.shape[0], A_mat_s.shape[1]
+    # Broadcast initial conditions to all conditions
+    mom = np.array(np.broadcast_to(mom_init, (n_cond, n_mom)), dtype=float)
+
+    # Generate division matrix for all states
+    Z_mat_div = division_matrix(Z_mat, expo, states)
+
+    # Define time arrays for each of the promoter states
+    t_s = np.linspace(0, t_single, n_steps)
+    t_d = np.linspace(0, t_double, n_steps)
+
+    # Compute the propagators over each full promoter state
+    P_s = expm_batch(A_mat_s * t_single)
+    P_d = expm_batch(A_mat_d * t_double)
+
+    ###  Loop through all but the last cycle  ###
+    for cyc in range(n_cycles - 1):
+        mom = np.einsum('nij,nj->ni', P_d, np.einsum('nij,nj->ni', P_s, mom))
+        # Compute moments after cell division
+        mom = np.dot(mom, Z_mat_div.T)
+
+    ### Last cycle ###
+    # Build the time array of the last cell cycle as in dmomdt_cycles
+    time = np.concatenate([t_s, t_s[-1] + np.diff(t_s)[0] + t_d])
+
+    # Compute the time differences
+    time_diff = np.diff(time)
+    # Compute the cumulative time difference
+    time_cumsum = np.cumsum(time_diff)
+    time_cumsum = time_cumsum / time_cumsum[-1]
+
+    # Define array for spacing of cell cycle
+    a_array = np.zeros(len(time))
+    a_array[1:] = time_cumsum
+
+    # Compute probability based on this array
+    p_a_array = np.log(2) * 2**(1 - a_array)
+
+    # Compute the Simpson's rule integration weights. Since the rule is
+    # linear, these are the integrals of the unit vectors.
+    weights = np.zeros(len(time))
+    for i in range(0, len(time), 512):
+        idx = np.arange(i, min(i + 512, len(time)))
+        unit = np.zeros([len(idx), len(time)])
+        unit[np.arange(len(idx)), idx] = 1
+        weights[idx] = sp.integrate.simps(unit, a_array, axis=1)
+    weights = weights * p_a_array
+
+    # Compute the propagators over a single time step
+    P_step_s = expm_batch(A_mat_s * np.diff(t_s)[0])
+    P_step_d = expm_batch(A_mat_d * np.diff(t_d)[0])
+
+    # Initialize array to accumulate the average moments
+    mom_avg = weights[0] * mom
+    # Loop through time points of the last cycle accumulating the average
+    for i in range(1, len(time)):
+        # NOTE: The first time point of the two promoter state starts with
+        # the same moments as the last time point of the single promoter
+        if i < n_steps:
+            mom = np.einsum('nij,nj->ni', P_step_s, mom)
+        elif i > n_steps:
+            mom = np.einsum('nij,nj->ni', P_step_d, mom)
+        mom_avg += weights[i] * mom
+
+    # Add moments over all promoter states
+    return mom_avg.reshape(n_cond, len(expo), len(states)).sum(axis=2)
+
+
+# EXPERIMENTAL CONSTANTS
+# Path of the MCMC chain of the constitutive promoter parameters relative to
+# the data directory
+MCMC_CHAIN = os.path.join('mcmc', 'lacUV5_constitutive_mRNA_double_expo.pkl')
+# In-process cache of the constants
+_CONSTANTS = dict()
+
+
+def find_data_dir(data_dir=None):
+    '''
+    Locates the data directory of the project. The directory is taken in
+    order from
+    1. the data_dir argument.
+    2. the environment variable CCUTILS_DATA.
+    3. the `data` directory of the repository holding the ccutils package.
+
+    Parameters
+    ----------
+    data_dir : str or None.
+        Path to the data directory.
+
+    Returns
+    -------
+    data_dir : str.
+        Absolute path to the data directory.
+
+    Raises
+    ------
+    FileNotFoundError
+        Thrown if no data directory is found.
+    '''
+    if data_dir is None:
+        data_dir = os.environ.get('CCUTILS_DATA')
+    if data_dir is not None:
+        if not os.path.isdir(data_dir):
+            raise FileNotFoundError('data directory {} does not exist'.format(
+                data_dir))
+        return os.path.abspath(data_dir)
+
+    # Resolve relative to the package
+    path = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'data')
+    if os.path.isdir(path):
+        return path
+
+    raise FileNotFoundError('data directory not found. Set the CCUTILS_DATA '
+                            'environment variable or pass data_dir.')
+
+
+def file_hash(fname, chunk=2**20):
+    '''
+    Returns the sha1 hash of the contents of a file.
+    '''
+    sha = hashlib.sha1()
+    with open(fname, 'rb') as file:
+        for block in iter(lambda: file.read(chunk), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def mcmc_map(chain_file):
+    '''
+    Returns the maximum a posteriori (MAP) parameters of the constitutive
+    promoter MCMC chain in units of the mRNA degradation rate. If the chain
+    was converted to the binary format of mcmc.save_chain, the MAP is read
+    from its header. Otherwise the values are saved in a sidecar json file
+    next to the chain, which is reused as long as the hash of the chain
+    file does not change.
+
+    Parameters
+    ----------
+    chain_file : str.
+        Path to the pickle file containing the flat chain followed by the
+        log probability of each sample.
+
+    Returns
+    -------
+    par_map : dict.
+        MAP values of kp_on, kp_off and rm.
+    '''
+    from . import mcmc
+
+    # Use the header of the binary chain unless the pickle is newer
+    header = mcmc.chain_files(chain_file)[1]
+    if os.path.exists(header) and (
+            not os.path.exists(chain_file) or
+            os.path.getmtime(header) >= os.path.getmtime(chain_file)):
+        return mcmc.load_chain_summary(header)['map']
+
+    sidecar = os.path.splitext(chain_file)[0] + '_map.json'
+    stat = os.stat(chain_file)
+    stamp = dict(size=stat.st_size, mtime=stat.st_mtime)
+
+    # Read sidecar file. Only hash the chain if its size or modification
+    # time changed since the sidecar was written
+    cache = dict(hash=None, stamp=None)
+    if os.path.exists(sidecar):
+        with open(sidecar, 'r') as file:
+            cache = json.load(file)
+        if cache['stamp'] == stamp:
+            return cache['map']
+    chain_hash = file_hash(chain_file)
+
+    if cache['hash'] == chain_hash:
+        par_map = cache['map']
+    else:
+        # Load MCMC parameters
+        with open(chain_file, 'rb') as file:
+            unpickler = pickle.Unpickler(file)
+            gauss_flatchain = unpickler.load()
+            gauss_flatlnprobability = unpickler.load()
+        # map value of the parameters
+        max_idx = np.argmax(gauss_flatlnprobability, axis=0)
+        par_map = dict(zip(['kp_on', 'kp_off', 'rm'],
+                           np.asarray(gauss_flatchain)[max_idx].tolist()))
+
+    # Save sidecar file. Write to a temporary file first such that parallel
+    # workers never read a partially written file
+    try:
+        tmp_file = '{}.{:d}.tmp'.format(sidecar, os.getpid())
+        with open(tmp_file, 'w') as file:
+            json.dump(dict(hash=chain_hash, stamp=stamp, map=par_map), file)
+        os.replace(tmp_file, sidecar)
+    except OSError:
+        # Read-only data directory
+        pass
+
+    return par_map
+
+
+def load_constants(data_dir=None):
+    '''
+    Returns a dictionary of various constants. The MAP parameters of the
+    constitutive promoter are read from a sidecar file of the MCMC chain
+    (see mcmc_map) and the result is cached for the rest of the process.
+
+    Parameters
+    ----------
+    data_dir : str or None.
+        Path to the data directory. If None it is located with
+        find_data_dir.
+
+    Returns
+    -------
+    param : dict.
+        Dictionary with the constants.
+    '''
+    chain_file = os.path.join(find_data_dir(data_dir), MCMC_CHAIN)
+    if chain_file not in _CONSTANTS:
+        _CONSTANTS[chain_file] = _compute_constants(chain_file)
+    # Return a copy such that callers can modify it
+    return dict(_CONSTANTS[chain_file])
 
 
-def load_constants():
+def _compute_constants(chain_file):
     '''
-    Returns a dictionary of various constants 
+    Computes the dictionary returned by load_constants.
     '''
-    # Find project parental directory
-    repo = git.Repo('./', search_parent_directories=True)
-    homedir = repo.working_dir
     # Define constants
     epR_O1=-15.3
     epR_O2=-13.9
@@ -392,20 +1700,9 @@ def load_constants():
     k0=2.7E-3
     Vcell=2.15
     rp=0.0965084635096711
-    # Load MCMC parameters
-    with open(homedir + '/data/mcmc/lacUV5_constitutive_mRNA_double_expo.pkl',
-              'rb') as file:
-        unpickler = pickle.Unpickler(file)
-        gauss_flatchain = unpickler.load()
-        gauss_flatlnprobability = unpickler.load()
-    # Generate a Pandas Data Frame with the mcmc chain
-    index = ['kp_on', 'kp_off', 'rm']
-    # Generate a data frame out of the MCMC chains
-    df_mcmc = pd.DataFrame(gauss_flatchain, columns=index)
-    index = df_mcmc.columns
-    # map value of the parameters
-    max_idx = np.argmax(gauss_flatlnprobability, axis=0)
-    kp_on, kp_off, rm = df_mcmc.iloc[max_idx, :] * gm
+    # MAP value of the parameters
+    par_map = mcmc_map(chain_file)
+    kp_on, kp_off, rm = [par_map[x] * gm for x in ['kp_on', 'kp_off', 'rm']]
 
     # Compute repressor dissociation constants
     kr_off_O1 = kr_off_fun(epR_O1, k0, kp_on, kp_off, Nns, Vcell)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Title:
+    momgen.py
+Last update:
+    2026-10-19
+Author(s):
+    Manuel Razo-Mejia
+Purpose:
+    This file compiles the functions used to derive the moment dynamics
+    matrices (A) and the binomial partitioning matrices (Z) for an arbitrary
+    set of mRNA and protein moments and promoter models. The derived matrices
+    are turned into numpy source code and cached on disk such that the
+    symbolic derivation only runs once per model.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from scipy.special import comb
+
+from . import codegen
+
+
+# PROMOTER MODELS
+def promoter_model(n_states):
+    '''
+    Returns the definition of the promoter models used in the project.
+
+    Parameters
+    ----------
+    n_states : int.
+        Number of promoter states. 2 for the unregulated promoter (states
+        'A' and 'I') and 3 for the regulated promoter (states 'A', 'I' and
+        'R').
+
+    Returns
+    -------
+    model : dict.
+        Dictionary with entries
+        - states : list with the name of the promoter states.
+        - transitions : list of (from state, to state, rate name) tuples.
+        - production : dictionary with the mRNA production rate name for
+          each of the transcriptionally active states.
+        - params : list with the names of the rate parameters in the order
+          in which the generated functions take them.
+    '''
+    if n_states == 2:
+        return dict(states=['A', 'I'],
+                    transitions=[('I', 'A', 'kp_on'), ('A', 'I', 'kp_off')],
+                    production={'A': 'rm'},
+                    params=['kp_on', 'kp_off', 'rm', 'gm', 'rp', 'gp'])
+    elif n_states == 3:
+        return dict(states=['A', 'I', 'R'],
+                    transitions=[('I', 'R', 'kr_on'), ('R', 'I', 'kr_off'),
+                                 ('I', 'A', 'kp_on'), ('A', 'I', 'kp_off')],
+                    production={'A': 'rm'},
+                    params=['kr_on', 'kr_off', 'kp_on', 'kp_off',
+                            'rm', 'gm', 'rp', 'gp'])
+    else:
+        raise ValueError('only 2 and 3 state promoter models are defined. '
+                         'Define the model dictionary manually.')
+
+
+# MOMENT CLOSURE
+def moment_closure(moments):
+    '''
+    Finds the set of moments <m**x * p**y> needed to close the dynamics of
+    the requested moments, including the lower moments needed to compute
+    the moments after binomial partitioning at cell division.
+
+    Parameters
+    ----------
+    moments : list of tuples.
+        List of (x, y) exponents of the requested moments.
+
+    Returns
+    -------
+    expo : list of tuples.
+        Sorted list of exponents (by total order and then by protein
+        exponent) closing the dynamics. The first entry is always (0, 0).
+    '''
+    expo = set()
+    pending = [tuple(int(e) for e in mom) for mom in moments] + [(0, 0)]
+    while pending:
+        x, y = pending.pop()
+        if (x, y) in expo:
+            continue
+        expo.add((x, y))
+        # mRNA production and degradation and binomial partitioning
+        pending += [(j, y) for j in range(x)]
+        # protein production
+        pending += [(x + 1, j) for j in range(y)]
+        # protein degradation and binomial partitioning
+        pending += [(x, j) for j in range(y)]
+
+    return sorted(expo, key=lambda e: (e[0] + e[1], e[1]))
+
+
+def moment_dynamics_matrix(expo, model):
+    '''
+    Builds the symbolic matrix A defining the moment dynamics
+    dµ/dt = Aµ
+    for a promoter model where mRNA is produced at the transcriptionally
+    active states and degraded at rate gm, and protein is produced at rate
+    rp per mRNA and degraded at rate gp.
+    The moments are ordered as
+    [<m**x0 p**y0>_s0, <m**x0 p**y0>_s1, ..., <m**x1 p**y1>_s0, ...]
+
+    Parameters
+    ----------
+    expo : list of tuples.
+        Closed list of exponents as returned by moment_closure.
+    model : dict.
+        Promoter model definition as returned by promoter_model.
+
+    Returns
+    -------
+    A_sym : sympy.Matrix.
+        Symbolic moment dynamics matrix.
+    params : list.
+        List of sympy symbols in the order given by model['params'].
+    '''
+    import sympy
+
+    states = model['states']
+    n_states = len(states)
+    params = sympy.symbols(model['params'])
+    sym = dict(zip(model['params'], params))
+    # Map moments and states to the index in the moment vector
+    idx = {(x, y, s): i * n_states + j for i, (x, y) in enumerate(expo)
+           for j, s in enumerate(states)}
+
+    A_sym = sympy.zeros(len(idx), len(idx))
+    gm, rp, gp = sym['gm'], sym['rp'], sym['gp']
+    # Loop through moments and states
+    for (x, y) in expo:
+        for s in states:
+            row = idx[(x, y, s)]
+            # Promoter state transitions
+            for s_from, s_to, rate in model['transitions']:
+                if s_from == s:
+                    A_sym[row, row] -= sym[rate]
+                if s_to == s:
+                    A_sym[row, idx[(x, y, s_from)]] += sym[rate]
+            # mRNA production  r <((m + 1)**x - m**x) p**y>
+            if s in model['production']:
+                for j in range(x):
+                    A_sym[row, idx[(j, y, s)]] += \
+                        comb(x, j, exact=True) * sym[model['production'][s]]
+            # mRNA degradation  gm <m ((m - 1)**x - m**x) p**y>
+            for j in range(x):
+                A_sym[row, idx[(j + 1, y, s)]] += \
+                    comb(x, j, exact=True) * (-1)**(x - j) * gm
+            # protein production  rp <m m**x ((p + 1)**y - p**y)>
+            for j in range(y):
+                A_sym[row, idx[(x + 1, j, s)]] += comb(y, j, exact=True) * rp
+            # protein degradation  gp <m**x p ((p - 1)**y - p**y)>
+            for j in range(y):
+                A_sym[row, idx[(x, j + 1, s)]] += \
+                    comb(y, j, exact=True) * (-1)**(y - j) * gp
+
+    return A_sym, list(params)
+
+
+def binomial_partition_matrix(expo):
+    '''
+    Builds the matrix Z that computes the moments right after cell division
+    assuming that each mRNA and protein molecule is binomially partitioned
+    with probability 1/2, i.e.
+    <m'**x p'**y> = ∑ Z[(x, y), (i, j)] <m**i p**j>
+
+    Parameters
+    ----------
+    expo : list of tuples.
+        Closed list of exponents as returned by moment_closure.
+
+    Returns
+    -------
+    Z_mat : 2D-array. shape = len(expo) x len(expo)
+        Binomial partitioning matrix in the format used by dmomdt_cycles.
+    '''
+    import sympy
+
+    n = sympy.Symbol('n')
+
+    def binom_moment(x):
+        # Coefficients of E[k**x | n] for k ~ Binomial(n, 1/2) as a
+        # polynomial in n, using the falling factorial moments.
+        poly = sum(sympy.functions.combinatorial.numbers.stirling(x, k) *
+                   sympy.ff(n, k) / 2**k for k in range(x + 1))
+        poly = sympy.Poly(sympy.expand(poly), n)
+        return {int(p[0]): float(c) for p, c in zip(poly.monoms(),
+                                                     poly.coeffs())}
+
+    index = {e: i for i, e in enumerate(expo)}
+    Z_mat = np.zeros([len(expo), len(expo)])
+    # Loop through moments
+    for (x, y) in expo:
+        m_coeff = binom_moment(x)
+        p_coeff = binom_moment(y)
+        for i, cm in m_coeff.items():
+            for j, cp in p_coeff.items():
+                Z_mat[index[(x, y)], index[(i, j)]] = cm * cp
+
+    return Z_mat
+
+
+# CACHED GENERATION
+# Version of the generated moment matrices. Increase it whenever a change to
+# the derivation or to the code generation changes the generated files, so
+# that the builders written by the previous code are not reused.
+CACHE_VERSION = 1
+
+
+def model_key(moments, model):
+    '''
+    Returns a hash that uniquely identifies a set of moments and a promoter
+    model. Used as the key of the on-disk cache.
+    '''
+    spec = dict(version=CACHE_VERSION,
+                moments=sorted(tuple(int(e) for e in m) for m in moments),
+                states=model['states'],
+                transitions=sorted(model['transitions']),
+                production=sorted(model['production'].items()),
+                params=model['params'])
+    return hashlib.sha1(json.dumps(spec).encode()).hexdigest()[:16]
+
+
+def load_moment_matrices(moments, n_states=3, model=None, cache_dir=None):
+    '''
+    Returns the function that builds the moment dynamics matrix A, the
+    list of exponents and the binomial partitioning matrix Z for any set of
+    requested moments. The first time a model is requested the matrices are
+    derived symbolically and saved as a numpy module in cache_dir. Later
+    calls import the cached module directly.
+
+    Parameters
+    ----------
+    moments : list of tuples.
+        List of (x, y) exponents of the moments <m**x p**y> needed.
+    n_states : int. Default = 3
+        Number of promoter states. See promoter_model.
+    model : dict or None.
+        Promoter model definition. If None promoter_model(n_states) is used.
+    cache_dir : str or None.
+        Directory where to save the generated modules. If None the
+        environment variable CCUTILS_CACHE is used, defaulting to
+        ~/.cache/ccutils.
+
+    Returns
+    -------
+    A_mat_fun : function.
+        Function that builds the matrix A given the rate parameters in the
+        order of model['params']. Parameters can be arrays, in which case
+        a stack of matrices is returned.
+    expo : list of tuples.
+        List of exponents of the moments included in the dynamics.
+    Z_mat : 2D-array.
+        Binomial partitioning matrix to be fed to dmomdt_cycles.
+    '''
+    if model is None:
+        model = promoter_model(n_states)
+    if cache_dir is None:
+        cache_dir = os.environ.get(
+            'CCUTILS_CACHE',
+            os.path.join(os.path.expanduser('~'), '.cache', 'ccutils'))
+
+    # Define file name from the model specification
+    key = model_key(moments, model)
+    module_file = os.path.join(cache_dir, 'moment_matrix_{}.py'.format(key))
+
+    # Derive matrices if they are not cached
+    if not os.path.exists(module_file):
+        os.makedirs(cache_dir, exist_ok=True)
+        expo = moment_closure(moments)
+        A_sym, params = moment_dynamics_matrix(expo, model)
+        Z_mat = binomial_partition_matrix(expo)
+        source = codegen.matrix_to_source(
+            A_sym, params, expo=expo,
+            header='Moments: {}\nStates: {}'.format(
+                sorted(tuple(m) for m in moments), model['states']))
+        source += '\nZ_mat = numpy.array({})\n'.format(Z_mat.tolist())
+        # Write to a temporary file first such that parallel workers
+        # never import a partially written module
+        tmp_file = '{}.{:d}.tmp'.format(module_file, os.getpid())
+        with open(tmp_file, 'w') as file:
+            file.write(source)
+        os.replace(tmp_file, module_file)
+
+    module = codegen.import_file(module_file)
+
+    return module.A_mat, module.expo, module.Z_mat
@@ -65,20 +65,9 @@ A_mat_unreg_s_init = A_mat_unreg_lam(param['kp_on'], param['kp_off'],
                                      param['rm'], param['gm'],
                                      rp_init, gp_init)
 
-# Define time on which to perform integration
-t = np.linspace(0, 4000 * 60, 2000)
-
-# Define initial conditions
-mom_init = np.zeros(len(expo) * 2)
-# Set initial condition for zero moment
-# Since this needs to add up to 1
-mom_init[0] = 1
-
-# Numerically integrate equations
-mp_sol = sp.integrate.odeint(ccutils.model.rhs_dmomdt, mom_init, t, 
-                             args=(A_mat_unreg_s_init,))
-
-mp_init = mp_sol[-1, :]
+# Compute the steady state moments to be used as initial conditions
+mp_init = ccutils.model.steady_state_moments(A_mat_unreg_s_init, n_states=2,
+                                             check_residual=True)
 #%%
 # Define doubling time
 doubling_time = 60
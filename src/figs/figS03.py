@@ -1,6 +1,5 @@
 #%%
 import os
-import pickle
 import cloudpickle
 import itertools
 import glob
@@ -42,29 +41,17 @@ df = pd.read_csv(f'{datadir}Jones_Brewster_2014.csv', index_col=0)
 # Extract the lacUV5 data
 dfUV5 = df[df.experiment == 'UV5']
 
-# Load the flat-chain
-with open(f'{mcmcdir}lacUV5_constitutive_mRNA_prior.pkl', 'rb') as file:
-    unpickler = pickle.Unpickler(file)
-    gauss_flatchain = unpickler.load()
-    gauss_flatlnprobability = unpickler.load()
-    
-# Generate a Pandas Data Frame with the mcmc chain
+# Read the MAP parameters of the chain (see ccutils.mcmc.pkl_chain_summary)
 index = ['kp_on', 'kp_off', 'rm']
-
-# Generate a data frame out of the MCMC chains
-df_mcmc = pd.DataFrame(gauss_flatchain, columns=index)
-
-# rerbsine the index with the new entries
-index = df_mcmc.columns
-
-# map value of the parameters
-max_idx = np.argmax(gauss_flatlnprobability, axis=0)
-kp_on, kp_off, rm = df_mcmc.iloc[max_idx, :]
+summary = ccutils.mcmc.pkl_chain_summary(
+    f'{mcmcdir}lacUV5_constitutive_mRNA_prior.pkl', index)
+kp_on, kp_off, rm = [summary['map'][x] for x in index]
 
 # Define bins
 bins = np.arange(0, dfUV5.mRNA_cell.max())
 
-logp_mRNA = ccutils.model.log_p_m_unreg(bins, kp_on, kp_off, 1, rm)
+logp_mRNA = ccutils.model.log_p_m_unreg(bins, kp_on, kp_off, 1, rm,
+                                          method='recurrence')
 
 # Plot the histogram of the data with bins of width 1
 _ = plt.hist(dfUV5.mRNA_cell, bins=bins, density=1, histtype='stepfilled',
@@ -1,6 +1,5 @@
 #%%
 import os
-import pickle
 import cloudpickle
 import itertools
 import glob
@@ -76,26 +75,12 @@ dfUV5_large = dfUV5[dfUV5["area_cells"] > threshold]
 # Splot DataFrame by area
 dfUV5_large = dfUV5[dfUV5["area_cells"] > threshold]
 
-# Load the flat-chain
-with open(
-    f"{mcmcdir}lacUV5_constitutive_mRNA_double_expo.pkl", "rb"
-) as file:
-    unpickler = pickle.Unpickler(file)
-    gauss_flatchain = unpickler.load()
-    gauss_flatlnprobability = unpickler.load()
-
-# Generate a Pandas Data Frame with the mcmc chain
+# Read the MAP parameters of the chain (see ccutils.mcmc.pkl_chain_summary)
 index = ["kp_on", "kp_off", "rm"]
-
-# Generate a data frame out of the MCMC chains
-df_mcmc = pd.DataFrame(gauss_flatchain, columns=index)
-
-# rerbsine the index with the new entries
-index = df_mcmc.columns
-
-# map value of the parameters
-max_idx = np.argmax(gauss_flatlnprobability, axis=0)
-kpon_double, kpoff_double, rm_double = df_mcmc.iloc[max_idx, :]
+summary = ccutils.mcmc.pkl_chain_summary(
+    f"{mcmcdir}lacUV5_constitutive_mRNA_double_expo.pkl", index
+)
+kpon_double, kpoff_double, rm_double = [summary["map"][x] for x in index]
 
 # Initialize figure
 fig, ax = plt.subplots(1, 2, figsize=(6, 2.5), sharey=False, sharex=True)
@@ -109,9 +94,9 @@ frac = 1 / 3
 fraction = 2 * (1 - 2 ** (-frac))
 
 logp_mRNA_double = fraction * ccutils.model.log_p_m_unreg(
-    bins, kpon_double, kpoff_double, 1, rm_double
+    bins, kpon_double, kpoff_double, 1, rm_double, method="recurrence"
 ) + (1 - fraction) * ccutils.model.log_p_m_unreg(
-    bins, kpon_double, kpoff_double, 1, 2 * rm_double
+    bins, kpon_double, kpoff_double, 1, 2 * rm_double, method="recurrence"
 )
 # Re-Normalize distribution
 logp_mRNA_double = logp_mRNA_double - scipy.special.logsumexp(logp_mRNA_double)
@@ -136,10 +121,10 @@ colors = sns.color_palette("Blues", n_colors=3)[1::]
 
 # Compute the probability
 logp_mRNA_small = ccutils.model.log_p_m_unreg(
-        bins, kpon_double, kpoff_double, 1, rm_double
+        bins, kpon_double, kpoff_double, 1, rm_double, method="recurrence"
 )
 logp_mRNA_large = ccutils.model.log_p_m_unreg(
-    bins, kpon_double, kpoff_double, 1, 2 * rm_double
+    bins, kpon_double, kpoff_double, 1, 2 * rm_double, method="recurrence"
 )
 
 # Plot the histogram of the data with bins of width 1
@@ -50,8 +50,10 @@ rm = param['rm']
 gm = param['gm']
 
 # Compute the probability
-logp_mRNA_small = ccutils.model.log_p_m_unreg(bins, kp_on, kp_off, gm, rm)
-logp_mRNA_large = ccutils.model.log_p_m_unreg(bins, kp_on, kp_off, gm, 2 * rm)
+logp_mRNA_small = ccutils.model.log_p_m_unreg(bins, kp_on, kp_off, gm, rm,
+                                                method='recurrence')
+logp_mRNA_large = ccutils.model.log_p_m_unreg(bins, kp_on, kp_off, gm, 2 * rm,
+                                                method='recurrence')
 
 # Group by promoter state
 df_group = df.groupby("state")
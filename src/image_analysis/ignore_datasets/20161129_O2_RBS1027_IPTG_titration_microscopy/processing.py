@@ -105,7 +105,7 @@ for i, st in enumerate(STRAINS):
             # Select random image to print example segmentation
             ex_no = np.random.choice(np.arange(0, len(images) - 1))    
             for z, x in enumerate(ims):
-                _, m, y = im_utils.ome_split(x)
+                _, m, y = im_utils.MultiChannelImage.from_ome(x)
                 y_flat = im_utils.generate_flatfield(y, yfp_noise, yfp_avg)
     
                 # Segment the mCherry channel.
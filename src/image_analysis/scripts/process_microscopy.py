@@ -0,0 +1,103 @@
+import os
+import sys
+import glob
+import json
+import importlib.util
+import pandas as pd
+
+# Import the project utils
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '../../../'))
+import ccutils
+
+# =============================================================================
+# Incremental processing of the IPTG titration microscopy dates.
+# The measurements of each position are cached in shards named after the
+# hash of its images and of the processing parameters, so only the positions
+# that changed (or that belong to new dates) are segmented again. The final
+# csv files are only rewritten for the dates whose measurements changed.
+# =============================================================================
+
+# Define directories
+script_dir = os.path.dirname(os.path.abspath(__file__))
+analysis_dir = os.path.join(script_dir, '../')
+raw_dir = os.path.join(script_dir, '../../../data/microscopy/')
+csv_dir = os.path.join(script_dir, '../../../data/csv_microscopy/')
+cache_dir = os.path.join(script_dir, '../../../data/microscopy_cache/')
+os.makedirs(cache_dir, exist_ok=True)
+
+# Number of processes
+n_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else -1
+
+# Quality control gates on the area (µm**2) and eccentricity of the cells
+qc_params = dict(area_bounds=[0.5, 6.0], min_eccentricity=0.8)
+
+# Read the hash of the measurements of each date
+key_file = os.path.join(cache_dir, 'date_keys.json')
+date_keys = ccutils.image.read_json(key_file)
+
+# List the experiment directories
+date_dirs = sorted(glob.glob(os.path.join(analysis_dir,
+                                          '*_IPTG_titration_microscopy')))
+
+# Loop through dates
+for date_dir in date_dirs:
+    # Load metadata. It is read from the experiment directory since it uses
+    # the directory name to define the date, operator and strain.
+    cwd = os.getcwd()
+    os.chdir(date_dir)
+    try:
+        spec = importlib.util.spec_from_file_location('metadata',
+                                                      'metadata.py')
+        meta = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(meta)
+    finally:
+        os.chdir(cwd)
+
+    data_dir = os.path.join(raw_dir, str(meta.DATE))
+    if not os.path.isdir(data_dir):
+        print('skipping {}: no raw images'.format(meta.DATE))
+        continue
+
+    # Process the positions that are not cached
+    try:
+        df_im = ccutils.image.process_date(meta, data_dir, n_jobs=n_jobs,
+                                           cache_dir=cache_dir)
+    except ValueError as e:
+        # Missing background images or no segmented objects
+        print('skipping {}: {}'.format(meta.DATE, e))
+        continue
+
+    # Check if the measurements or the quality control changed since the
+    # last run
+    name = str(meta.DATE) + '_' + meta.OPERATOR + '_' + meta.STRAIN + \
+        '_IPTG_titration_microscopy.csv'
+    out_file = os.path.join(date_dir, 'outdir', name)
+    fc_file = out_file.replace('_microscopy.csv', '_fold_change.csv')
+    key = json.dumps([str(pd.util.hash_pandas_object(df_im).sum()),
+                      qc_params, ccutils.image.CACHE_VERSION])
+    if (date_keys.get(name) == key) and \
+            os.path.exists(os.path.join(csv_dir, name)) and \
+            os.path.exists(fc_file):
+        print('{} is up to date'.format(name))
+        continue
+
+    # Apply the area and eccentricity bounds and compute the fold-change.
+    df_filt, df_fc = ccutils.image.qc_fold_change(df_im, meta.STRAIN,
+                                                  **qc_params)
+
+    # Save files in the same directory as the summary plots
+    os.makedirs(os.path.join(date_dir, 'outdir'), exist_ok=True)
+    df_filt.to_csv(out_file, index=False)
+    df_fc.to_csv(fc_file, index=False)
+
+    # Export file to data directory including the comments
+    with open(os.path.join(csv_dir, name), 'w') as output:
+        for fname in [os.path.join(date_dir, 'README.txt'), out_file]:
+            with open(fname) as infile:
+                output.write(infile.read())
+
+    # Save the key of the measurements
+    date_keys[name] = key
+    ccutils.image.write_json(key_file, date_keys)
+    print('{} written'.format(name))
@@ -203,238 +203,11 @@ def log_p_m_mid_C(C, mRNA, rep, ki, ka, epsilon, kon, k0, gamma, r_gamma,
 # =============================================================================
 
 
-# define a np.frompyfunc that allows us to evaluate the sympy.mp.math.hyp1f1
-np_log_gauss_hyp = np.frompyfunc(lambda a, b, c, z:
-                                 mpmath.ln(mpmath.hyp2f1(a, b, c, z,  maxprec=60)).real, 4, 1)
-
-
-def log_p_p_mid_C(C, protein, rep, ka, ki, epsilon, kon, k0, gamma_m, r_gamma_m,
-                  gamma_p, r_gamma_p, logC=False):
-    '''
-    Computes the log conditional probability lnP(p|C,R),
-    i.e. the probability of having p proteins given
-    an inducer concentration C and a repressor copy number R.
-
-    Parameters
-    ----------
-    C : array-like.
-        Concentration at which evaluate the probability.
-    protein : array-like.
-        protein copy number at which evaluate the probability.
-    repressor : float.
-        repressor copy number per cell.
-    ki, ka : float.
-        dissociation constants for the inactive and active states respectively
-        in the MWC model of the lac repressor.
-    epsilon : float.
-        energetic barrier between the inactive and the active state.
-    kon : float.
-        rate of activation of the promoter in the chemical master equation
-    k0 : float.
-        diffusion limited rate of a repressor binding the promoter
-    gamma_m : float.
-        half-life time for the mRNA.
-    r_gamma_m : float.
-        average number of mRNA in the unregulated promoter.
-    gamma_p : float.
-        half-life time for the protein.
-    r_gamma_p : float.
-        average number of protein per mRNA in the unregulated promoter.
-    logC : Bool.
-        boolean indicating if the concentration is given in log scale. If True
-        C = 10**C
-    Returns
-    -------
-    log probability lnP(p|c,R)
-    '''
-    # Convert C and mRNA into np.arrays
-    C = np.array(C)
-    protein = np.array(protein)
-    # Convert from log if necessary
-    if logC:
-        C = 10**C
-
-    # Calculate the off rate including the MWC model
-    koff = k0 * rep * p_act(C, ka, ki, epsilon)
-
-    # compute the variables needed for the distribution
-    a = r_gamma_m * gamma_m / gamma_p  # r_m / gamma_p
-    b = r_gamma_p * gamma_p / gamma_m  # r_p / gamma_m
-    gamma = gamma_m / gamma_p
-    Kon = kon / gamma_p
-    Koff = koff / gamma_p
-
-    phi = np.sqrt((a + Kon + Koff)**2 - 4 * a * Kon)
-
-    alpha = 1 / 2 * (a + Kon + Koff + phi)
-    beta = 1 / 2 * (a + Kon + Koff - phi)
-
-    # Compute the probability
-    lnp = scipy.special.gammaln(alpha + protein) \
-        + scipy.special.gammaln(beta + protein) \
-        + scipy.special.gammaln(Kon + Koff) \
-        - scipy.special.gammaln(protein + 1) \
-        - scipy.special.gammaln(alpha) \
-        - scipy.special.gammaln(beta) \
-        - scipy.special.gammaln(Kon + Koff + protein) \
-        + protein * (np.log(b) - np.log(1 + b)) \
-        + alpha * np.log(1 - b / (1 + b)) \
-        + np_log_gauss_hyp(alpha + protein, Kon + Koff - beta,
-                           Kon + Koff + protein, b / (1 + b))
-    return lnp.astype(float)
-
-# ==============================================================================
-
-
-def log_p_p_mid_C_spline(C, p_range, step, rep, ka, ki, omega,
-                         kon, k0, gamma_m, r_gamma_m, gamma_p, r_gamma_p,
-                         norm_check=False, tol=0.01):
-    '''
-    Computes the log conditional probability lnP(p|C,R),
-    i.e. the probability of having p proteins given
-    an inducer concentration C and a repressor copy number R.
-    This function performs an interpolation with n_points uniformly
-    distributed in p_range
-
-    Parameters
-    ----------
-    C : array-like.
-        Concentration at which evaluate the probability.
-    p_range : array-like.
-        Protein copy number range at which evaluate the probability.
-    step : int.
-        Step size to take between values in p_range.
-    repressor : float.
-        Repressor copy number per cell.
-    ki, ka : float.
-        Dissociation constants for the inactive and active states respectively
-        in the MWC model of the lac repressor.
-    omega : float.
-        Energetic barrier between the inactive and the active state.
-    kon : float.
-        Rate of activation of the promoter in the chemical master equation
-    k0 : float.
-        Diffusion limited rate of a repressor binding the promoter
-    gamma_m : float.
-        Half-life time for the mRNA.
-    r_gamma_m : float.
-        Average number of mRNA in the unregulated promoter.
-    gamma_p : float.
-        Half-life time for the protein.
-    r_gamma_p : float.
-        Average number of protein per mRNA in the unregulated promoter.
-    norm_check : bool.
-        Check if the returned distribution is normalized, and if not perform
-        the full evaluation of the analytical expression.
-    tol : float.
-        +- Tolerance allowed for the normalization. The distribution is
-         considered
-        normalized if it is within 1+-tol
-    Returns
-    -------
-    log probability lnP(p|c,R)
-    '''
-    # Convert C and the protein range into np.arrays
-    C = np.array(C)
-    protein = np.arange(p_range[0], p_range[1], step)
-    protein = np.append(protein, p_range[1])
-    # Compute the probability
-    lnp = log_p_p_mid_C(C, protein, rep, ka, ki, omega,
-                        kon, k0, gamma_m, r_gamma_m, gamma_p, r_gamma_p)
-
-    # Perform the cubic spline interpolation
-    lnp_spline = scipy.interpolate.interp1d(protein, lnp, kind='cubic')
-    # return the complete array of proteins evaluated with the spline
-    p_array = np.arange(p_range[0], p_range[1])
-
-    lnp = lnp_spline(p_array)
-    # If ask to check the normalization of the distribution
-    if norm_check:
-        if (np.sum(np.exp(lnp)) <= 1 + tol) and (np.sum(np.exp(lnp)) >= 1 - tol):
-            return lnp
-        else:
-            print('Did not pass the normalization test. Re-doing calculation')
-            protein = np.arange(p_range[0], p_range[1])
-            return log_p_p_mid_C(C, protein, rep, ka, ki, omega,
-                                 kon, k0, gamma_m, r_gamma_m, gamma_p, r_gamma_p)
-    else:
-        return lnp
-
-# ==============================================================================
-
-
-def log_p_p_mid_C_spline(C, p_range, step, rep, ka, ki, omega,
-                         kon, k0, gamma_m, r_gamma_m, gamma_p, r_gamma_p,
-                         norm_check=False, tol=0.01):
-    '''
-    Computes the log conditional probability lnP(p|C,R),
-    i.e. the probability of having p proteins given
-    an inducer concentration C and a repressor copy number R.
-    This function performs an interpolation with n_points uniformly
-    distributed in p_range
-
-    Parameters
-    ----------
-    C : array-like.
-        Concentration at which evaluate the probability.
-    p_range : array-like.
-        Protein copy number range at which evaluate the probability.
-    step : int.
-        Step size to take between values in p_range.
-    repressor : float.
-        Repressor copy number per cell.
-    ki, ka : float.
-        Dissociation constants for the inactive and active states respectively
-        in the MWC model of the lac repressor.
-    omega : float.
-        Energetic barrier between the inactive and the active state.
-    kon : float.
-        Rate of activation of the promoter in the chemical master equation
-    k0 : float.
-        Diffusion limited rate of a repressor binding the promoter
-    gamma_m : float.
-        Half-life time for the mRNA.
-    r_gamma_m : float.
-        Average number of mRNA in the unregulated promoter.
-    gamma_p : float.
-        Half-life time for the protein.
-    r_gamma_p : float.
-        Average number of protein per mRNA in the unregulated promoter.
-    norm_check : bool.
-        Check if the returned distribution is normalized, and if not perform
-        the full evaluation of the analytical expression.
-    tol : float.
-        +- Tolerance allowed for the normalization. The distribution is considered
-        normalized if it is within 1+-tol
-    Returns
-    -------
-    log probability lnP(p|c,R)
-    '''
-    # Convert C and the protein range into np.arrays
-    C = np.array(C)
-    protein = np.arange(p_range[0], p_range[1], step)
-    protein = np.append(protein, p_range[1])
-    # Compute the probability
-    lnp = log_p_p_mid_logC(C, protein, rep, ka, ki, omega,
-                           kon, k0, gamma_m, r_gamma_m, gamma_p, r_gamma_p)
-
-    # Perform the cubic spline interpolation
-    lnp_spline = scipy.interpolate.interp1d(protein, lnp, kind='cubic')
-    # return the complete array of proteins evaluated with the spline
-    p_array = np.arange(p_range[0], p_range[1])
-
-    lnp = lnp_spline(p_array)
-    # If ask to check the normalization of the distribution
-    if norm_check:
-        if (np.sum(np.exp(lnp)) <= 1 + tol) and (np.sum(np.exp(lnp)) >= 1 - tol):
-            return lnp
-        else:
-            print('Did not pass the normalization test. Re-doing calculation')
-            protein = np.arange(p_range[0], p_range[1])
-            return log_p_p_mid_C(C, protein, rep, ka, ki, omega,
-                                 kon, k0, gamma_m, r_gamma_m, gamma_p, r_gamma_p)
-    else:
-        return lnp
+# The analytic protein distribution and its adaptive interpolation now live
+# in ccutils.model, where the Gauss hypergeometric function is evaluated with
+# a vectorized recurrence
+from ccutils.model import np_log_gauss_hyp, log_p_p_mid_C, \
+    log_p_p_mid_C_spline
 
 
 # =============================================================================
@@ -1,7 +1,5 @@
-import pickle
 # Our numerical workhorses
 import numpy as np
-import pandas as pd
 
 # Import matplotlib stuff for plotting
 import matplotlib.pyplot as plt
@@ -27,29 +25,18 @@ k0 = 2.7E-3
 # =============================================================================
 # Single promoter
 # =============================================================================
-# Load the flat-chain
-with open('../../data/mcmc/lacUV5_constitutive_mRNA_prior.pkl', 'rb') as file:
-    unpickler = pickle.Unpickler(file)
-    gauss_flatchain = unpickler.load()
-    gauss_flatlnprobability = unpickler.load()
-
-# Generate a Pandas Data Frame with the mcmc chain
+# Read the MAP and HPD summary of the chain, from the header of the binary
+# chain if it was converted with ccutils.mcmc.pkl_to_chain.
 index = ['kp_on', 'kp_off', 'rm']
-
-# Generate a data frame out of the MCMC chains
-df_mcmc = pd.DataFrame(gauss_flatchain, columns=index)
-
-# reasign the index with the new entries
-index = df_mcmc.columns
+summary = ccutils.mcmc.pkl_chain_summary(
+    '../../data/mcmc/lacUV5_constitutive_mRNA_prior.pkl', index,
+    mass_frac=0.95)
 
 # map value of the parameters
-max_idx = np.argmax(gauss_flatlnprobability, axis=0)
-kpon, kpoff, rm = df_mcmc.iloc[max_idx, :]
+kpon, kpoff, rm = [summary['map'][x] for x in index]
 
 # ea range
-kpon_hpd = ccutils.stats.hpd(df_mcmc.iloc[:, 0], 0.95)
-kpoff_hpd = ccutils.stats.hpd(df_mcmc.iloc[:, 1], 0.95)
-rm_hpd = ccutils.stats.hpd(df_mcmc.iloc[:, 2], 0.95)
+kpon_hpd, kpoff_hpd, rm_hpd = [np.array(summary['hpd'][x]) for x in index]
 
 # Print results
 print('Single gene copy parameters: ')
@@ -82,30 +69,18 @@ rm = {6:.3f} -{7:0.3f} +{8:0.3f} s^-1
 # Double promoter
 # =============================================================================
 
-# Load the flat-chain
-with open('../../data/mcmc/lacUV5_constitutive_mRNA_double_expo.pkl',
-          'rb') as file:
-    unpickler = pickle.Unpickler(file)
-    gauss_flatchain = unpickler.load()
-    gauss_flatlnprobability = unpickler.load()
-
-# Generate a Pandas Data Frame with the mcmc chain
+# Read the MAP and HPD summary of the chain, from the header of the binary
+# chain if it was converted with ccutils.mcmc.pkl_to_chain.
 index = ['kp_on', 'kp_off', 'rm']
-
-# Generate a data frame out of the MCMC chains
-df_mcmc = pd.DataFrame(gauss_flatchain, columns=index)
-
-# rerbsine the index with the new entries
-index = df_mcmc.columns
+summary = ccutils.mcmc.pkl_chain_summary(
+    '../../data/mcmc/lacUV5_constitutive_mRNA_double_expo.pkl', index,
+    mass_frac=0.95)
 
 # map value of the parameters
-max_idx = np.argmax(gauss_flatlnprobability, axis=0)
-kpon_double, kpoff_double, rm_double = df_mcmc.iloc[max_idx, :]
+kpon_double, kpoff_double, rm_double = [summary['map'][x] for x in index]
 
 # ea range
-kpon_hpd = ccutils.stats.hpd(df_mcmc.iloc[:, 0], 0.95)
-kpoff_hpd = ccutils.stats.hpd(df_mcmc.iloc[:, 1], 0.95)
-rm_hpd = ccutils.stats.hpd(df_mcmc.iloc[:, 2], 0.95)
+kpon_hpd, kpoff_hpd, rm_hpd = [np.array(summary['hpd'][x]) for x in index]
 
 # Print results
 print('Two-promoter model')
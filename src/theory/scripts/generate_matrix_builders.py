@@ -0,0 +1,23 @@
+#%%
+import git
+import ccutils
+
+# Find home directory for repo
+repo = git.Repo("./", search_parent_directories=True)
+homedir = repo.working_dir
+
+pkldir = f'{homedir}/src/theory/pkl_files/'
+#%%
+# Convert the two-state promoter matrix
+ccutils.codegen.pkl_to_module(
+    f'{pkldir}two_state_protein_dynamics_matrix.pkl',
+    f'{pkldir}two_state_protein_dynamics_matrix.py',
+    ['kp_on', 'kp_off', 'rm', 'gm', 'rp', 'gp'])
+
+# Convert the three-state promoter matrix
+ccutils.codegen.pkl_to_module(
+    f'{pkldir}three_state_protein_dynamics_matrix.pkl',
+    f'{pkldir}three_state_protein_dynamics_matrix.py',
+    ['kr_on', 'kr_off', 'kp_on', 'kp_off', 'rm', 'gm', 'rp', 'gp'])
+
+print('done!')
@@ -156,33 +156,24 @@ def constraints_parallel(par):
     A_reg_s_init = A_mat_reg_lam(kr_on, kr_off, kp_on, kp_off,
                                  rm, gm, rp_init, gp_init)
     
-    # Define initial conditions
-    mom_init = np.zeros(len(expo_reg) * 3)
-    # Set initial condition for zero moment
-    # Since this needs to add up to 1
-    mom_init[0] = 1
-
-    # Define time on which to perform integration
-    t = np.linspace(0, 4000 * 60, 10000)
-    # Numerically integrate equations
-    m_init = sp.integrate.odeint(ccutils.model.rhs_dmomdt, mom_init, t, 
-                                    args=(A_reg_s_init,))
-    # Keep last time point as initial condition
-    m_init = m_init[-1, :]
+    # Compute the steady state moments to be used as initial conditions
+    m_init = ccutils.model.steady_state_moments(A_reg_s_init, n_states=3,
+                                                check_residual=True)
     
-    # Integrate moment equations
-    df = ccutils.model.dmomdt_cycles(m_init, t_single, t_double,
-                                     A_mat_reg_lam, 
-                                     par_reg_s, par_reg_d,
-                                     expo_reg, n_cycles, Z_mat,
-                                     states=['A', 'I', 'R'], 
-                                     n_steps=3000)
-    
-    # Keep only last cycle
-    df = df[df['cycle'] == df['cycle'].max()]
+    # Integrate moment equations keeping only the last cycle
+    time, mom = ccutils.model.dmomdt_cycles(m_init, t_single, t_double,
+                                            A_mat_reg_lam, 
+                                            par_reg_s, par_reg_d,
+                                            expo_reg, n_cycles, Z_mat,
+                                            states=['A', 'I', 'R'], 
+                                            n_steps=3000,
+                                            return_array=True,
+                                            last_cycle=True)
 
     # Extract time of last cell cycle
-    time = np.sort(df['time'].unique())
+    time = time[-1].ravel()
+    # Add the moments over all promoter states
+    mom = mom[-1].reshape(len(time), len(expo_reg), -1).sum(axis=2)
 
     # Compute the time differences
     time_diff = np.diff(time)
@@ -197,20 +188,8 @@ def constraints_parallel(par):
     # Compute probability based on this array
     p_a_array = np.log(2) * 2**(1 - a_array)
 
-    # Initialize list to append moments
-    moms = list()
-    # Loop through moments computing the average moment
-    for i, mom in enumerate(expo_reg):
-        # Generate string that finds the moment
-        mom_name = 'm' + str(mom[0]) + 'p' + str(mom[1])
-        # List rows with moment
-        mom_bool = [x for x in df.columns if mom_name in x]
-        # Extract data for this particular moment
-        df_mom = df.loc[:, mom_bool].sum(axis=1)
-
-        # Average moment and append it to list
-        moms.append(sp.integrate.simps(df_mom * p_a_array,
-                                        a_array))
+    # Average all moments over the cell cycle
+    moms = list(sp.integrate.simps(mom.T * p_a_array, a_array, axis=1))
             
     # Save results into series in order to append it to data frame
     series = pd.Series([op, eRA, rep, iptg] + moms,
@@ -222,11 +201,8 @@ def constraints_parallel(par):
 constraint_series = Parallel(n_jobs=6)(delayed(constraints_parallel)(par)
                              for par in var)
 
-# Initialize data frame to save list of pareters
-df_constraints = pd.DataFrame([], columns=names)
-
-for s in constraint_series:
-    df_constraints = df_constraints.append(s, ignore_index=True)
+# Collect all of the series into a single data frame
+df_constraints = pd.DataFrame(constraint_series, columns=names)
 
 # Save progress at each step
 df_constraints.to_csv(f'{datadir}MaxEnt_multi_prom_ogorman.csv',
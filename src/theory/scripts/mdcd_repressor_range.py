@@ -1,14 +1,12 @@
 #%%
 import os
 import pickle
-import cloudpickle
 import itertools
 import glob
 import git
 import numpy as np
 import scipy as sp
 import pandas as pd
-from joblib import Parallel, delayed
 import ccutils
 
 # Find home directory for repo
@@ -17,11 +15,10 @@ homedir = repo.working_dir
 
 datadir = f'{homedir}/data/csv_maxEnt_dist/'
 #%%
-# Read protein ununregulated matrix 
-with open('../pkl_files/three_state_protein_dynamics_matrix.pkl',
-          'rb') as file:
-    A_mat_reg_lam = cloudpickle.load(file)
-    expo_reg = cloudpickle.load(file)
+# Read protein regulated matrix builder generated by
+# generate_matrix_builders.py
+A_mat_reg_fun, expo_reg = ccutils.codegen.load_matrix_module(
+    '../pkl_files/three_state_protein_dynamics_matrix.py')
 
 # Read matrix into memory
 with open('../pkl_files/binom_coeff_matrix.pkl', 'rb') as file:
@@ -61,126 +58,67 @@ n_cycles = 6
 names = ['operator', 'binding_energy', 'repressor', 'inducer_uM']
 names = names + ['m' + str(m[0]) + 'p' + str(m[1]) for m in expo_reg]         
 
-# Initialize DataFrame to save constraints
-df_constraints = pd.DataFrame([], columns=names)
-
-# Define function for parallel computation
-def constraints_parallel(par):
-    # Extract variables
-    op = par[0]  #operator
-    eRA = param[f'epR_{op}']  # binding energy
-    rep = par[1]  # repressors
-    iptg = par[2]  # inducer
-    print(op, eRA, rep, iptg)
-
-    # Load parameters
-    ka = param['Ka']
-    ki = param['Ki']
-    epAI = param['epAI']
-    Nns = param['Nns']
-    Vcell = param['Vcell']
-    kp_on = param['kp_on']
-    kp_off = param['kp_off']
-    rm = param['rm']
-    gm = param['gm']
-    rp = param['rp']
-    ko = param['k0']
-    # Single promoter
-    gp_init = 1 / (60 * 60)
-    rp_init = 500 * gp_init
-
-    # Calculate the repressor on rate including the MWC model
-    kr_on = ko * rep * ccutils.model.p_act(iptg, ka, ki, epAI) 
-
-    # Compute the repressor off-rate based on the on-rate and 
-    # the binding energy
-    kr_off = ccutils.model.kr_off_fun(eRA, ko, kp_on, kp_off,
-                                      Nns, Vcell)
-
-    # Generate matrices for dynamics
-    # Single promoter
-    par_reg_s = [kr_on, kr_off, kp_on, kp_off, rm, gm, rp, 0]
-    # Two promoters
-    par_reg_d = [kr_on, kr_off, kp_on, kp_off, 2 * rm, gm, rp, 0]
-    
-    # Initial conditions
-    A_reg_s_init = A_mat_reg_lam(kr_on, kr_off, kp_on, kp_off,
-                                 rm, gm, rp_init, gp_init)
-    
-    # Define initial conditions
-    mom_init = np.zeros(len(expo_reg) * 3)
-    # Set initial condition for zero moment
-    # Since this needs to add up to 1
-    mom_init[0] = 1
-
-    # Define time on which to perform integration
-    t = np.linspace(0, 4000 * 60, 10000)
-    # Numerically integrate equations
-    m_init = sp.integrate.odeint(ccutils.model.rhs_dmomdt, mom_init, t, 
-                                    args=(A_reg_s_init,))
-    # Keep last time point as initial condition
-    m_init = m_init[-1, :]
-    
-    # Integrate moment equations
-    df = ccutils.model.dmomdt_cycles(m_init, t_single, t_double,
-                                     A_mat_reg_lam, 
-                                     par_reg_s, par_reg_d,
-                                     expo_reg, n_cycles, Z_mat,
-                                     states=['A', 'I', 'R'], 
-                                     n_steps=3000)
-    
-    # Keep only last cycle
-    df = df[df['cycle'] == df['cycle'].max()]
-
-    # Extract time of last cell cycle
-    time = np.sort(df['time'].unique())
-
-    # Compute the time differences
-    time_diff = np.diff(time)
-    # Compute the cumulative time difference
-    time_cumsum = np.cumsum(time_diff)
-    time_cumsum = time_cumsum / time_cumsum[-1]
-
-    # Define array for spacing of cell cycle
-    a_array = np.zeros(len(time))
-    a_array[1:] = time_cumsum 
-    
-    # Compute probability based on this array
-    p_a_array = np.log(2) * 2**(1 - a_array)
-
-    # Initialize list to append moments
-    moms = list()
-    # Loop through moments computing the average moment
-    for i, mom in enumerate(expo_reg):
-        # Generate string that finds the moment
-        mom_name = 'm' + str(mom[0]) + 'p' + str(mom[1])
-        # List rows with moment
-        mom_bool = [x for x in df.columns if mom_name in x]
-        # Extract data for this particular moment
-        df_mom = df.loc[:, mom_bool].sum(axis=1)
-
-        # Average moment and append it to list
-        moms.append(sp.integrate.simps(df_mom * p_a_array,
-                                        a_array))
-            
-    # Save results into series in order to append it to data frame
-    series = pd.Series([op, eRA, rep, iptg] + moms,
-                index=names)
-
-    return series
-
-# Run function in parallel
-constraint_series = Parallel(n_jobs=6)(delayed(constraints_parallel)(par)
-                             for par in var)
-
-# Initialize data frame to save list of pareters
-df_constraints = pd.DataFrame([], columns=names)
-
-for s in constraint_series:
-    df_constraints = df_constraints.append(s, ignore_index=True)
+# Load parameters
+ka = param['Ka']
+ki = param['Ki']
+epAI = param['epAI']
+Nns = param['Nns']
+Vcell = param['Vcell']
+kp_on = param['kp_on']
+kp_off = param['kp_off']
+rm = param['rm']
+gm = param['gm']
+rp = param['rp']
+ko = param['k0']
+# Single promoter
+gp_init = 1 / (60 * 60)
+rp_init = 500 * gp_init
+
+# Extract variables for all conditions
+op = np.array([x[0] for x in var])  # operator
+eRA = np.array([param[f'epR_{o}'] for o in op])  # binding energy
+rep = np.array([x[1] for x in var])  # repressors
+iptg = np.array([x[2] for x in var])  # inducer
+
+# Calculate the repressor on rate including the MWC model
+kr_on = ko * rep * ccutils.model.p_act(iptg, ka, ki, epAI) 
+
+# Compute the repressor off-rate based on the on-rate and 
+# the binding energy
+kr_off = ccutils.model.kr_off_fun(eRA, ko, kp_on, kp_off,
+                                  Nns, Vcell)
+
+# Generate stacks of matrices for dynamics of all conditions
+# Initial conditions
+A_reg_s_init = A_mat_reg_fun(kr_on, kr_off, kp_on, kp_off,
+                             rm, gm, rp_init, gp_init)
+# Single promoter
+A_reg_s = A_mat_reg_fun(kr_on, kr_off, kp_on, kp_off, rm, gm, rp, 0)
+# Two promoters
+A_reg_d = A_mat_reg_fun(kr_on, kr_off, kp_on, kp_off, 2 * rm, gm, rp, 0)
+
+# Compute the steady state moments of all conditions to be used as
+# initial conditions
+m_init = ccutils.model.steady_state_moments(A_reg_s_init, n_states=3,
+                                            check_residual=True)
+
+# Integrate moment equations for all conditions at once, returning the
+# moments averaged over the last cell cycle
+moms = ccutils.model.dmomdt_cycles_batch(m_init, t_single, t_double,
+                                         A_reg_s, A_reg_d,
+                                         expo_reg, n_cycles, Z_mat,
+                                         states=['A', 'I', 'R'],
+                                         n_steps=3000)
+
+# Save results into data frame
+df_constraints = pd.DataFrame(moms, columns=names[4:])
+df_constraints.insert(0, 'inducer_uM', iptg)
+df_constraints.insert(0, 'repressor', rep)
+df_constraints.insert(0, 'binding_energy', eRA)
+df_constraints.insert(0, 'operator', op)
 
 # Save progress at each step
 df_constraints.to_csv(f'{datadir}MaxEnt_multi_prom_constraints.csv',
             index=False)
 
-print('done!')
\ No newline at end of file
+print('done!')